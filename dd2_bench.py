@@ -0,0 +1,1265 @@
+"""
+Benchmarks for dd2_window_manager that run against SimulatedBackend, so no game clients
+(or Windows) are needed.
+
+Usage: python dd2_bench.py [registry] [broadcast] [dispatch] [layout] [scheduler] [probes] [manager] [shopping] [macro] [hotkeys] [repeat] [health] [activation] [profiles] [overlay] [calibration] [boxes] [background] [mirror] [--windows N]
+
+The manager benchmark drives a headless WindowManager end to end and can be compared against a
+stored baseline:
+    python dd2_bench.py manager --save-baseline bench_baseline.json
+    python dd2_bench.py manager --baseline bench_baseline.json --latency post_message=0.05
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tkinter as tk
+
+from dd2_window_manager import (DEFAULT_HOTKEYS, HOTKEY_POLICIES, KEY_CODES, LAYOUT_MODES, SHOPPING_SCRIPT, WM_KEYDOWN, WM_KEYUP,
+                                WM_LBUTTONDOWN, DD2WindowRegistry,
+                                HotkeyTable, InputDispatcher, KeyBroadcaster, LatencyHistogram, MacroPlayer, MacroRecorder, MacroTimeline, Metrics,
+                                PeriodicScheduler, ShopCalibrator, ShoppingOverlay, ShoppingRun, SimulatedBackend, WindowManager,
+                                calibrate_image, solve_layout,
+                                wait_until)
+
+
+def print_histogram(title, hist, width=40, max_rows=12):
+    """Prints a histogram summary plus one bar per non-empty bucket (per octave if there are many)."""
+    summary = hist.summary()
+    print(f"  {title}: n={summary['count']} mean={summary['mean_ms']:.2f}ms p50={summary['p50_ms']:.2f}ms "
+          f"p99={summary['p99_ms']:.2f}ms max={summary['max_ms']:.2f}ms")
+    rows = hist.rows()
+    if len(rows) > max_rows:
+        octaves = {}
+        for upper, n in rows:
+            bound = 2.0 ** math.ceil(math.log2(upper * 1e6)) / 1e6
+            octaves[bound] = octaves.get(bound, 0) + n
+        rows = sorted(octaves.items())
+    peak = max((n for _, n in rows), default=1)
+    for upper, n in rows:
+        print(f"    <= {upper * 1e3:9.3f}ms {'#' * max(1, round(width * n / peak)):{width}} {n}")
+
+
+def bench_registry(args):
+    """Compares cached registry reads with the old rescan-per-keypress path."""
+    backend = SimulatedBackend(latency={'list_processes': args.scan_latency_ms / 1000.0})
+    for _ in range(args.windows):
+        backend.spawn_process()
+    registry = DD2WindowRegistry(backend, "DunDefGame.exe", reconcile_interval=0)
+    registry.start()
+
+    # Old behaviour: one full scan per keypress
+    start = time.perf_counter()
+    for _ in range(args.presses):
+        registry.reconcile()
+    rescan_time = (time.perf_counter() - start) / args.presses
+
+    # New behaviour: every keypress reads the cache, with some churn in between
+    churn_every = max(1, args.presses // 10)
+    start = time.perf_counter()
+    for i in range(args.presses):
+        registry.hwnds()
+        if i % churn_every == 0:
+            backend.kill_process(registry.clients()[0].pid)
+            backend.spawn_process()
+    cached_time = (time.perf_counter() - start) / args.presses
+
+    stats = registry.stats
+    reads = stats['hits'] + stats['misses']
+    print(f"registry: {args.windows} DD2 windows, {len(backend.processes)} processes, {len(backend.windows)} windows")
+    print(f"  full rescan per press: {rescan_time * 1e6:10.1f} us")
+    print(f"  cached read per press: {cached_time * 1e6:10.1f} us (incl. simulated churn)")
+    print(f"  hit rate: {stats['hits'] / reads:.4f} ({stats['hits']} hits, {stats['misses']} misses)")
+    print(f"  notifications handled: {stats['events']}, scans: {stats['scans']}")
+    print(f"  tracked after churn: {len(registry)} (expected {args.windows})")
+
+
+def serial_send(backend, hwnds, vk_codes, hold_ms):
+    """The pre-broadcaster path: down, sleep, up, one window at a time."""
+    for vk_code in vk_codes:
+        for hwnd in hwnds:
+            backend.post_message(hwnd, WM_KEYDOWN, vk_code, 0)
+            time.sleep(hold_ms / 1000.0)
+            backend.post_message(hwnd, WM_KEYUP, vk_code, 0)
+
+
+def hold_times(posted):
+    """Pairs key-downs with key-ups in a recorded sink and returns the hold durations."""
+    down_at = {}
+    holds = []
+    for t, hwnd, msg, wparam, _ in posted:
+        if msg == WM_KEYDOWN:
+            down_at[(hwnd, wparam)] = t
+        elif msg == WM_KEYUP and (hwnd, wparam) in down_at:
+            holds.append(t - down_at.pop((hwnd, wparam)))
+    return holds
+
+
+def bench_broadcast(args):
+    """Serial per-window sends vs KeyBroadcaster, against a recording PostMessage sink."""
+    backend = SimulatedBackend(background_processes=0)
+    hwnds = [backend.create_window(backend.spawn_process(windows=0)) for _ in range(args.windows)]
+    vk_codes = [(ord('G'), 0x1B, ord('M'), ord('Y'))[i % 4] for i in range(args.keys)]
+    broadcaster = KeyBroadcaster(backend, args.hold_ms)
+    print(f"broadcast: {args.windows} windows, {len(vk_codes)} key(s), hold {args.hold_ms}ms, {args.broadcasts} broadcasts")
+
+    for label, send in (("serial", lambda: serial_send(backend, hwnds, vk_codes, args.hold_ms)),
+                        ("parallel", lambda: broadcaster.broadcast(hwnds, vk_codes))):
+        backend.posted = []
+        wall = LatencyHistogram()
+        for _ in range(args.broadcasts):
+            start = time.perf_counter()
+            send()
+            wall.record(time.perf_counter() - start)
+        hold = LatencyHistogram()
+        for held in hold_times(backend.posted):
+            hold.record(held)
+        print_histogram(f"{label} broadcast wall time", wall)
+        print_histogram(f"{label} per-window hold", hold)
+
+
+def bench_dispatch(args):
+    """Sustained hotkey spam into InputDispatcher, with real broadcasts as the dispatched work."""
+    backend = SimulatedBackend(background_processes=0)
+    hwnds = [backend.create_window(backend.spawn_process(windows=0)) for _ in range(args.windows)]
+    broadcaster = KeyBroadcaster(backend, args.hold_ms)
+    dispatcher = InputDispatcher()
+    dispatcher.start()
+
+    interval = 1.0 / args.spam_rate
+    presses = int(args.spam_seconds * args.spam_rate)
+    print(f"dispatch: {presses} presses at {args.spam_rate}/s into a queue of {dispatcher._queue.maxsize}, "
+          f"{args.windows} windows, hold {args.hold_ms}ms")
+    next_press = time.perf_counter()
+    for _ in range(presses):
+        dispatcher.submit(broadcaster.broadcast, hwnds, (ord('G'),))
+        next_press += interval
+        wait_until(next_press)
+    while dispatcher.stats['dispatched'] < dispatcher.stats['submitted']:
+        time.sleep(0.01)
+    dispatcher.stop()
+
+    print_histogram("hook callback (submit) time", dispatcher.submit_time)
+    print_histogram("enqueue -> dispatch latency", dispatcher.dispatch_latency)
+    print(f"  submitted={dispatcher.stats['submitted']} dispatched={dispatcher.stats['dispatched']} "
+          f"dropped={dispatcher.stats['dropped']} max depth={dispatcher.stats['max_depth']}")
+
+
+# Work areas and a custom template the layout properties are checked against
+LAYOUT_WORK_AREAS = [(0, 0, 2560, 1400), (0, 0, 1920, 1040), (-1920, 0, 0, 1040), (0, 40, 3440, 1440)]
+LAYOUT_TEMPLATE = ((0.0, 0.0, 0.7, 0.7), (0.7, 0.0, 0.3, 0.35), (0.7, 0.35, 0.3, 0.35), (0.0, 0.7, 1.0, 0.3))
+
+
+def check_layout_properties(mode, work_area, count, main_index, padding, rects):
+    """Returns a list of violated invariants for one solved layout."""
+    left, top, right, bottom = work_area
+    errors = []
+    if len(rects) != count:
+        errors.append(f"{len(rects)} rects for {count} windows")
+    for i, (x, y, w, h) in enumerate(rects):
+        if w < 1 or h < 1:
+            errors.append(f"window {i} has empty rect {w}x{h}")
+        if x < left or y < top or x + w > right or y + h > bottom:
+            errors.append(f"window {i} rect {(x, y, w, h)} leaves work area {work_area}")
+    for i, a in enumerate(rects):
+        for j in range(i + 1, len(rects)):
+            b = rects[j]
+            if a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]:
+                errors.append(f"windows {i} and {j} overlap")
+    main_slot = solve_layout(mode, work_area, count, 0, 1720, 900, padding, LAYOUT_TEMPLATE if mode == 'custom' else None)[0]
+    if rects and rects[main_index] != main_slot:
+        errors.append(f"main window {main_index} is not in the main slot")
+    return errors
+
+
+def bench_layout(args):
+    """Checks solver invariants for 1-32 windows in every mode, then times cold solves vs cached lookups."""
+    checked = failures = 0
+    for mode in LAYOUT_MODES:
+        template = LAYOUT_TEMPLATE if mode == 'custom' else None
+        for work_area in LAYOUT_WORK_AREAS:
+            for padding in (0, 8):
+                for count in range(1, 33):
+                    for main_index in range(count):
+                        rects = solve_layout(mode, work_area, count, main_index, 1720, 900, padding, template)
+                        errors = check_layout_properties(mode, work_area, count, main_index, padding, rects)
+                        checked += 1
+                        if errors:
+                            failures += 1
+                            if failures <= 10:
+                                print(f"  FAIL {mode} {work_area} pad={padding} n={count} main={main_index}: "
+                                      f"{'; '.join(errors[:3])}")
+
+    # Main window on one monitor, secondaries tiled on another
+    primary, secondary = (0, 0, 2560, 1400), (2560, 0, 4480, 1040)
+    for count in range(1, 33):
+        for main_index in range(count):
+            rects = solve_layout('classic', primary, count, main_index, 1720, 900, 0, None, secondary)
+            # Bounds against the whole desktop, then each window against its own monitor
+            errors = check_layout_properties('classic', (0, 0, 4480, 1400), count, main_index, 0, rects)
+            for i, (x, y, w, h) in enumerate(rects):
+                left, top, right, bottom = primary if i == main_index else secondary
+                if x < left or y < top or x + w > right or y + h > bottom:
+                    errors.append(f"window {i} is off its monitor")
+            checked += 1
+            if errors:
+                failures += 1
+                print(f"  FAIL two monitors n={count} main={main_index}: {'; '.join(errors[:3])}")
+    print(f"layout: {checked} layouts checked, {failures} failed")
+
+    for mode in LAYOUT_MODES:
+        template = LAYOUT_TEMPLATE if mode == 'custom' else None
+        cold = LatencyHistogram()
+        warm = LatencyHistogram()
+        for rotation in range(args.presses):
+            if rotation % 50 == 0:
+                solve_layout.cache_clear()
+                start = time.perf_counter()
+                solve_layout(mode, (0, 0, 2560, 1400), args.windows, 0, 1720, 900, 0, template)
+                cold.record(time.perf_counter() - start)
+            start = time.perf_counter()
+            solve_layout(mode, (0, 0, 2560, 1400), args.windows, rotation % args.windows, 1720, 900, 0, template)
+            warm.record(time.perf_counter() - start)
+        print(f"  {mode:8} {args.windows} windows: cold solve p50 {cold.percentile(50) * 1e6:6.1f}us, "
+              f"rotation lookup p50 {warm.percentile(50) * 1e6:5.2f}us p99 {warm.percentile(99) * 1e6:5.2f}us")
+    return failures == 0
+
+
+def bench_scheduler(args):
+    """Inactive-sender style job (two keys to N-1 windows every 100ms): reschedule-after-work vs PeriodicScheduler."""
+    backend = SimulatedBackend(background_processes=0)
+    hwnds = [backend.create_window(backend.spawn_process(windows=0)) for _ in range(args.windows)]
+    broadcaster = KeyBroadcaster(backend, args.hold_ms)
+    work = lambda: broadcaster.broadcast(hwnds[1:], (ord('G'), 0x1B))
+    ticks = int(args.spam_seconds * 10)
+    print(f"scheduler: 100ms job, {args.windows - 1} windows x 2 keys, {ticks} ticks")
+
+    # Old behaviour: self.after(100) is only armed once the work has finished
+    period = LatencyHistogram()
+    last = None
+    for _ in range(ticks):
+        start = time.perf_counter()
+        if last is not None:
+            period.record(start - last)
+        last = start
+        work()
+        time.sleep(0.1)
+    print(f"  reschedule-after-work: achieved period mean {period.mean * 1e3:.1f}ms p99 {period.percentile(99) * 1e3:.1f}ms")
+
+    scheduler = PeriodicScheduler()
+    job = scheduler.add_job('inactive_sender', work, 100)
+    scheduler.start()
+    scheduler.set_enabled('inactive_sender', True)
+    while job.runs < ticks:
+        time.sleep(0.05)
+    scheduler.stop()
+    summary = job.summary()
+    print(f"  PeriodicScheduler:     achieved period mean {summary['achieved_period_ms']:.1f}ms "
+          f"p99 {job.period_hist.percentile(99) * 1e3:.1f}ms, jitter p99 {summary['jitter_p99_ms']:.2f}ms, "
+          f"skipped {summary['skipped']}")
+
+
+def bench_probes(args):
+    """Per-call cost of a timing probe with probes on and off, and its share of a real broadcast."""
+    iterations = 200000
+    print(f"probes: {iterations} probe() blocks, broadcasts to {args.windows} windows with hold 0")
+    for enabled in (False, True):
+        metrics = Metrics(enabled=enabled)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            with metrics.probe('bench'):
+                pass
+        probe_cost = (time.perf_counter() - start) / iterations
+
+        backend = SimulatedBackend(background_processes=0)
+        hwnds = [backend.create_window(backend.spawn_process(windows=0)) for _ in range(args.windows)]
+        broadcaster = KeyBroadcaster(backend, 0, metrics)
+        start = time.perf_counter()
+        for _ in range(args.presses):
+            broadcaster.broadcast(hwnds, (ord('G'),), requested_at=time.perf_counter())
+        broadcast_cost = (time.perf_counter() - start) / args.presses
+        print(f"  probes {'on ' if enabled else 'off'}: probe block {probe_cost * 1e9:6.0f}ns, "
+              f"broadcast {broadcast_cost * 1e6:6.2f}us")
+
+
+def make_manager(args, windows):
+    """A headless WindowManager over a fake process table with `windows` DD2 clients."""
+    backend = SimulatedBackend(background_processes=args.background_processes, latency=args.latency)
+    for _ in range(windows):
+        backend.spawn_process()
+    app = WindowManager(backend, headless=True)
+    app.startup_complete.wait(5.0) # Discovery and the first layout run in the background
+    app.key_delay_ms = args.hold_ms
+    return app, backend
+
+
+def time_calls(func, iterations, before=None):
+    """Calls func() `iterations` times; returns (per-call histogram, calls per second). before() is untimed."""
+    hist = LatencyHistogram()
+    total = 0.0
+    for i in range(iterations):
+        if before:
+            before(i)
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        hist.record(elapsed)
+        total += elapsed
+    return hist, iterations / total if total else 0.0
+
+
+def manager_scenarios(app, backend, args):
+    """(name, func, iterations, before) for every WindowManager hot path the suite covers."""
+    hwnds = app.dd2_windows
+    steps = itertools.count()
+
+    def scatter(_):
+        for hwnd in hwnds: # Every window out of place, so the layout commits a full batch
+            backend.windows[hwnd]['rect'] = (0, 0, 800, 600)
+
+    app.automation.start() # Loop startup isn't part of a step
+    run = ShoppingRun(app, app.shopping_script)
+    box_steps = tuple(step for step in app.shopping_script['box'] if step[0] in ('move', 'press'))
+
+    def shopping_step():
+        # A box's move and Enter presses as one automation round trip; its settles are left out (fixed waits)
+        run.box_index = next(steps) % len(app.box_positions['shopping_boxes'])
+        app.automation.submit(run.run_steps(box_steps)).result()
+
+    return [
+        ('broadcast', lambda: app._send_key_to_all_dd2_windows('g'), args.broadcasts, None),
+        ('broadcast_inactive', lambda: app._send_key_to_inactive_dd2_windows('g', 'esc'), args.broadcasts, None),
+        ('rotation', lambda: app.rotate_main_window('up'), args.iterations, None),
+        ('layout', app.apply_layout, args.iterations, scatter),
+        ('discovery', app.find_dd2_windows, args.iterations, None),
+        ('shopping_step', shopping_step, args.iterations, None),
+    ]
+
+
+def reacting_frames(backend, react_s, settle_s):
+    """
+    Synthetic frame sequence for a game that answers every key press: the captured region keeps its
+    old colour for react_s, flickers for settle_s, then holds a new colour until the next press.
+    Cursor moves don't change the region, so the move step always runs into its timeout.
+    """
+    state = {'inputs': 0, 'last_input': None}
+
+    def fill(rect, out):
+        presses = [t for t, kind, _ in backend.input_log if kind == 'key']
+        if presses and presses[-1] != state['last_input']:
+            state['last_input'] = presses[-1]
+            state['inputs'] += 1
+        colour = state['inputs'] * 40 % 256
+        if state['last_input'] is not None:
+            elapsed = time.perf_counter() - state['last_input']
+            if elapsed < react_s:
+                colour = (state['inputs'] - 1) * 40 % 256
+            elif elapsed < react_s + settle_s:
+                colour = int(elapsed * 1e4) % 256 # Animation: different on every sample
+        out[...] = colour
+    return fill
+
+
+def bench_shopping(args):
+    """One auto-shopping cycle (8 boxes + utility box) headless, with adaptive pacing against synthetic frames."""
+    app, backend = make_manager(args, 1)
+    backend.frame_source = reacting_frames(backend, args.react_ms / 1000.0, args.settle_ms / 1000.0)
+    app.shopping_script = dict(app.shopping_script, cycles=1)
+    try:
+        app._toggle_shopping_mode() # OFF -> SETUP
+        app._toggle_shopping_mode() # SETUP -> AUTO-RUN
+        watch = app.shopping_watch
+        if not watch:
+            print("shopping: numpy is not installed, adaptive pacing unavailable")
+            return True
+        start = time.perf_counter()
+        while app.shopping_mode_state == "AUTO-RUN":
+            app.tk.dooneevent(0)
+        elapsed = time.perf_counter() - start
+        print(f"shopping: 8 boxes, game reacts after {args.react_ms}ms and settles {args.settle_ms}ms later, "
+              f"poll {app.shopping_poll_ms}ms")
+        print_histogram("per-box time", app.metrics.histogram('shopping.box_time'))
+        saved = app.shopping_time_saved # The next run starts counting from zero
+        print(f"  cycle took {elapsed:.1f}s, saved {saved:.1f}s vs the fixed schedule "
+              f"({watch.captures} captures)")
+
+        # ESC in the middle of a run: the routine should stop at its current wait, not at the next step
+        app._toggle_shopping_mode() # OFF -> SETUP
+        app._toggle_shopping_mode() # SETUP -> AUTO-RUN
+        task = app.shopping_task
+        deadline = time.perf_counter() + 0.5
+        while time.perf_counter() < deadline:
+            app.tk.dooneevent(0)
+        start = time.perf_counter()
+        backend.fire_hotkey('esc')
+        while not task.done():
+            time.sleep(0)
+        print(f"  ESC stopped the run in {(time.perf_counter() - start) * 1000:.2f}ms")
+    finally:
+        app._on_closing()
+    return saved > 0
+
+
+def scaled_script(script, factor):
+    """A shopping script with every 'wait' and 'settle' shortened by `factor`, for benchmarks that time whole runs."""
+    scaled = dict(script)
+    for part, steps in script.items():
+        if isinstance(steps, tuple) and steps and isinstance(steps[0], tuple):
+            scaled[part] = tuple((name, max(1, round(args[0] / factor))) if name in ('wait', 'settle') else (name, *args)
+                                 for name, *args in steps)
+    return scaled
+
+
+def bench_background(args):
+    """
+    Background shopping in every client at once with posted input, against the main-window run: wall
+    time per client count, cursor and focus left alone, clicks at each window's client coordinates,
+    and one client hanging mid-run.
+    """
+    script = dict(scaled_script(SHOPPING_SCRIPT, 100), cycles=1) # 15s settles become 150ms
+    ok = True
+
+    def shop(app, target):
+        app.shopping_script = script
+        app.shopping_target = target
+        app._toggle_shopping_mode() # OFF -> SETUP
+        start = time.perf_counter()
+        app._toggle_shopping_mode() # SETUP -> AUTO-RUN
+        while app.shopping_mode_state == "AUTO-RUN":
+            app.tk.dooneevent(0)
+        return time.perf_counter() - start
+
+    app, backend = make_manager(args, 1)
+    app.adaptive_shopping = False
+    try:
+        single = shop(app, 'main')
+        boxes = len(app.box_positions['shopping_boxes'])
+    finally:
+        app._on_closing()
+    print(f"background: 1-cycle script with delays / 100, main-window run takes {single * 1000:.0f}ms "
+          f"(N clients in turn: N x that)")
+
+    base = None # Background run in one client; posted presses are held key_delay_ms, so it is a little longer
+    for count in sorted(set([1] + args.window_counts)):
+        app, backend = make_manager(args, count)
+        backend.posted = []
+        try:
+            cursor, foreground = backend.cursor, backend.foreground
+            moves = backend.calls.get('set_cursor_pos', 0)
+            elapsed = shop(app, 'all')
+            done = sum(text == 'done' for text in app.shopping_progress.values())
+            untouched = backend.cursor == cursor and backend.foreground == foreground and backend.calls.get('set_cursor_pos', 0) == moves
+            clicks = {}
+            for _, hwnd, msg, _, lparam in backend.posted:
+                if msg == WM_LBUTTONDOWN:
+                    clicks[hwnd] = (lparam & 0xFFFF, lparam >> 16)
+            utility = script['utility_boxes'][0] - 1 # The only click of a 1-cycle run
+            main = app._main_client_rect()
+            half = ShoppingOverlay.UTILITY_SIZE // 2 # Box center in the main window, scaled to each client below
+            placed = True
+            for hwnd in app.dd2_windows:
+                left, top, right, bottom = app.registry.client_rect(hwnd)
+                x, y = app.box_table.client_pos(hwnd, 'utility_boxes', utility)
+                center = (x + half * (right - left) / (main[2] - main[0]), y + half * (bottom - top) / (main[3] - main[1]))
+                placed = placed and hwnd in clicks and all(abs(c - e) <= 1 for c, e in zip(clicks[hwnd], center))
+            base = base or elapsed
+            print(f"  {count:3} clients: {elapsed * 1000:6.0f}ms, {count * boxes / elapsed:6.1f} boxes/s "
+                  f"(speedup {count * base / elapsed:5.1f}x, {count * single / elapsed:5.1f}x vs main-window runs in turn), "
+                  f"{done}/{count} done, cursor/focus untouched {untouched}, clicks at client coordinates {placed}")
+            ok = ok and done == count and untouched and placed and elapsed < base * 1.5
+        finally:
+            app._on_closing()
+
+    # A client that stops responding mid-run fails alone; the others finish
+    app, backend = make_manager(args, max(args.windows, 2))
+    try:
+        hwnds = app.dd2_windows
+        app.shopping_script, app.shopping_target = script, 'all'
+        app._toggle_shopping_mode()
+        app._toggle_shopping_mode()
+        deadline = time.perf_counter() + single / 3
+        while time.perf_counter() < deadline:
+            app.tk.dooneevent(0)
+        backend.set_hung(backend.windows[hwnds[0]]['pid'])
+        app.health.probe_all()
+        while app.shopping_mode_state == "AUTO-RUN":
+            app.tk.dooneevent(0)
+        states = [app.shopping_progress.get(hwnd) for hwnd in hwnds]
+        print(f"  one client hung mid-run: {states.count('failed')} failed, {states.count('done')} done")
+        ok = ok and states[0] == 'failed' and states.count('done') == len(hwnds) - 1
+    finally:
+        app._on_closing()
+    return ok
+
+
+def bench_mirror(args):
+    """
+    Click mirroring: end-to-end latency from the input hook to the last secondary's post, where the
+    clicks land in each secondary, and the clicks that must not be mirrored.
+    """
+    app, backend = make_manager(args, max(args.windows, 2))
+    rng = random.Random(1)
+    ok = True
+    try:
+        hwnds = app.dd2_windows
+        main = app.last_main_hwnd
+        secondaries = [hwnd for hwnd in hwnds if hwnd != main]
+        left, top, right, bottom = app.registry.client_rect(main)
+        backend.posted = []
+        app.toggle_click_mirror()
+
+        def click(x, y, expected_posts):
+            """Injects a left click; returns seconds until the expected number of posts arrived (None if they didn't)."""
+            del backend.posted[:]
+            start = time.perf_counter()
+            backend.inject_input('mouse', 0, True, x, y)
+            backend.inject_input('mouse', 0, False, x, y)
+            deadline = start + 0.1
+            while len(backend.posted) < expected_posts and time.perf_counter() < deadline:
+                time.sleep(0)
+            time.sleep(0.001) # Anything beyond the expected posts shows up too
+            if len(backend.posted) != expected_posts:
+                return None
+            return backend.posted[-1][0] - start if backend.posted else 0.0
+
+        per_click = 3 * len(secondaries) # Move + button down, button up
+        end_to_end = LatencyHistogram()
+        for _ in range(args.iterations):
+            latency = click(rng.randrange(left, right), rng.randrange(top, bottom), per_click)
+            if latency is None:
+                ok = False
+                break
+            end_to_end.record(latency)
+        summary, hooked = end_to_end.summary(), app.metrics.histogram('mirror.latency').summary()
+        print(f"mirror: {len(hwnds)} clients, {end_to_end.count} clicks in the main window")
+        print(f"  hook -> last post p50 {hooked['p50_ms']:.3f}ms p99 {hooked['p99_ms']:.3f}ms; "
+              f"injected -> last post p50 {summary['p50_ms']:.3f}ms p99 {summary['p99_ms']:.3f}ms max {end_to_end.max * 1000:.3f}ms")
+        ok = ok and summary['p99_ms'] < 5
+
+        # A click in the middle of the main window lands in the middle of every secondary
+        click((left + right) // 2, (top + bottom) // 2, per_click)
+        landed = {hwnd: (lparam & 0xFFFF, lparam >> 16) for _, hwnd, msg, _, lparam in backend.posted if msg == WM_LBUTTONDOWN}
+        centered = all(abs(landed[hwnd][0] - (r - l) / 2) <= 1 and abs(landed[hwnd][1] - (b - t) / 2) <= 1
+                       for hwnd in secondaries for l, t, r, b in [app.registry.client_rect(hwnd)])
+        outside = click(right + 5, top, 0) is not None
+        app.registry.note_foreground(secondaries[0]) # Another window has focus: its clicks are its own
+        unfocused = click(left + 10, top + 10, 0) is not None
+        app.registry.note_foreground(main)
+        print(f"  lands at the same relative spot: {centered}, ignored outside the main window: {outside}, "
+              f"ignored when the main window isn't focused: {unfocused}")
+        ok = ok and centered and outside and unfocused
+
+        backend.set_hung(backend.windows[secondaries[0]]['pid'])
+        app.health.probe_all()
+        skipped = click(left + 10, top + 10, per_click - 3) is not None
+        backend.set_hung(backend.windows[secondaries[0]]['pid'], False)
+        while app.health.is_hung(secondaries[0]):
+            app.health.probe_all()
+        app._rotate_main_window(1) # The mirror follows the new main window's rect
+        new_left, new_top, _, _ = app.registry.client_rect(app.last_main_hwnd)
+        followed = app.last_main_hwnd != main and click(new_left + 10, new_top + 10, per_click) is not None
+        print(f"  hung secondary skipped: {skipped}, follows a rotation: {followed}, stats {app.click_mirror.stats}")
+        ok = ok and skipped and followed
+    finally:
+        app._on_closing()
+    return ok
+
+
+def synthetic_macro(events, seed=1):
+    """A trap-rebuild-like timeline: key taps and clicks 5-30ms apart, every press released 20-60ms later."""
+    rng = random.Random(seed)
+    timeline = MacroTimeline()
+    pending = [] # (release time, kind, code, x, y)
+    t = 0.0
+    while len(timeline) < events:
+        t += rng.uniform(0.005, 0.030)
+        while pending and pending[0][0] <= t:
+            released, kind, code, x, y = pending.pop(0)
+            timeline.append(released, kind, code, False, x, y)
+        if rng.random() < 0.7:
+            kind, code, x, y = MacroTimeline.KEY, rng.choice((ord('1'), ord('2'), ord('E'), ord('R'), 0x20)), 0.0, 0.0
+        else:
+            kind, code, x, y = MacroTimeline.MOUSE, rng.choice((0, 1)), rng.random(), rng.random()
+        timeline.append(t, kind, code, True, x, y)
+        pending.append((t + rng.uniform(0.020, 0.060), kind, code, x, y))
+        pending.sort()
+    for released, kind, code, x, y in pending:
+        timeline.append(released, kind, code, False, x, y)
+    return timeline
+
+
+def bench_macro(args):
+    """Record, save/load and replay a macro into every simulated client, measuring timing against the post sink."""
+    backend = SimulatedBackend(background_processes=0)
+    hwnds = [backend.create_window(backend.spawn_process(windows=0)) for _ in range(args.windows)]
+    ok = True
+
+    # Recorder: only the foreground window's input, clicks relative to its client area
+    backend.foreground = hwnds[0]
+    recorder = MacroRecorder(backend)
+    recorder.start(hwnds[0])
+    backend.inject_input('key', ord('E'), True)
+    left, top, right, bottom = backend.get_client_rect(hwnds[0])
+    x, y = (right - left) // 4, (bottom - top) // 4
+    backend.inject_input('mouse', 0, True, left + x, top + y)
+    backend.inject_input('mouse', 0, True, 5000, 5000) # Outside the window: dropped
+    backend.foreground = hwnds[1 % len(hwnds)]
+    backend.inject_input('key', ord('R'), True) # Another window has focus: dropped (unless there is only one)
+    recorded = recorder.stop()
+    expected = 3 if len(hwnds) == 1 else 2
+    placed = len(recorded) > 1 and abs(recorded.xs[1] - x / (right - left)) < 1e-6 and abs(recorded.ys[1] - y / (bottom - top)) < 1e-6
+    if len(recorded) != expected or not placed: # Fractions of the client size, stored as float32
+        print(f"macro: recorder kept {len(recorded)} events, expected {expected}")
+        ok = False
+
+    timeline = synthetic_macro(args.macro_events)
+    fd, path = tempfile.mkstemp(suffix='.dd2m')
+    os.close(fd)
+    try:
+        timeline.save(path)
+        size = os.path.getsize(path)
+        loaded = MacroTimeline.load(path)
+    finally:
+        os.remove(path)
+    if any(getattr(loaded, name) != getattr(timeline, name) for name, _ in MacroTimeline._FIELDS):
+        print("macro: timeline changed in a save/load round trip")
+        ok = False
+    print(f"macro: {len(timeline)} events over {timeline.duration:.2f}s into {len(hwnds)} windows, "
+          f"file {size} bytes ({size / len(timeline):.1f} per event)")
+
+    for speed in (1.0, 4.0):
+        metrics = Metrics()
+        player = MacroPlayer(backend, metrics)
+        backend.posted = []
+        player.play(loaded, hwnds, speed)
+        player._thread.join()
+        first = [t for t, hwnd, *_ in backend.posted if hwnd == hwnds[0]]
+        error = LatencyHistogram() # Posted offset vs scheduled offset, first window
+        for i in range(1, len(first)):
+            error.record(abs((first[i] - first[0]) - (loaded.times[i] - loaded.times[0]) / speed))
+        print(f"  speed {speed:g}x:")
+        print_histogram("event lateness", metrics.histogram('macro.lateness'))
+        print_histogram("schedule error at the sink", error)
+        if len(first) != len(loaded) or len(backend.posted) != len(loaded) * len(hwnds):
+            print(f"  posted {len(backend.posted)} messages, expected {len(loaded) * len(hwnds)}")
+            ok = False
+        ok = ok and error.percentile(50) < 0.001 # Tail depends on the OS scheduler; the median must be sub-ms
+    return ok
+
+
+def bench_hotkeys(args):
+    """Compile cost of the default bindings, and per-event hook cost of the compiled table vs one check per binding."""
+    fired = []
+    resolve = lambda action, action_args: (fired.append, (action,), False)
+    compile_hist = LatencyHistogram()
+    for _ in range(args.iterations):
+        start = time.perf_counter()
+        table = HotkeyTable.compile(DEFAULT_HOTKEYS, resolve)
+        compile_hist.record(time.perf_counter() - start)
+    print(f"hotkeys: {len(table)} bindings, {args.presses * 100} events per case")
+    print_histogram("compile", compile_hist, max_rows=4)
+
+    # What separate per-binding hooks do: every hook sees every event and checks its own key
+    separate = [(HotkeyTable.parse(hotkey), resolve(binding[0], ())[:2]) for hotkey, binding in DEFAULT_HOTKEYS.items()]
+
+    def per_binding(scan_code, down):
+        if down:
+            for (bound_scan, _), (callback, callback_args) in separate:
+                if bound_scan == scan_code:
+                    callback(*callback_args)
+
+    events = args.presses * 100
+    for label, scan_code, down in (("bound key", KEY_CODES['g'][1], True), ("unbound key", KEY_CODES['q'][1], True),
+                                   ("key up", KEY_CODES['g'][1], False), ("modifier", KEY_CODES['ctrl'][1], False)):
+        costs = []
+        for on_key in (table.on_key, per_binding):
+            start = time.perf_counter()
+            for _ in range(events):
+                on_key(scan_code, down)
+            costs.append((time.perf_counter() - start) / events)
+            fired.clear()
+        print(f"  {label:12} compiled table {costs[0] * 1e9:6.0f}ns/event, one check per binding {costs[1] * 1e9:6.0f}ns/event")
+
+
+def hold_key(app, name, seconds, rate=30):
+    """Feeds the hotkey hook what holding a key produces: key-downs at the OS repeat rate, then one key-up."""
+    scan_code = KEY_CODES[name][1]
+    next_event = time.perf_counter()
+    for _ in range(max(1, int(seconds * rate))):
+        app._on_hotkey_event(scan_code, True)
+        next_event += 1.0 / rate
+        wait_until(next_event)
+    app._on_hotkey_event(scan_code, False)
+
+
+def wait_for_dispatcher(dispatcher, timeout=30.0):
+    deadline = time.perf_counter() + timeout
+    while dispatcher.stats['dispatched'] < dispatcher.stats['submitted'] and time.perf_counter() < deadline:
+        time.sleep(0.001)
+
+
+def bench_repeat(args):
+    """Holding a broadcast key, and a burst of rotate presses, with and without the hotkey policies."""
+    no_policies = {action: {'repeat': 'allow', 'coalesce': False, 'max_rate': None} for action in HOTKEY_POLICIES}
+    # Work slower than the repeat interval, like serial sends to many clients: 60ms per broadcast, 50ms per layout
+    print(f"repeat: hold 'g' then 'up' for {args.repeat_seconds}s each at 30 repeats/s; {args.windows} windows, "
+          f"60ms per broadcast, 50ms per layout pass")
+    ok = True
+    for label, policies in (("no policies", no_policies), ("default policies", HOTKEY_POLICIES)):
+        app, backend = make_manager(args, args.windows)
+        app.hotkey_table = HotkeyTable.compile(DEFAULT_HOTKEYS,
+                                               lambda action, action_args: app._resolve_hotkey_action(action, action_args, policies))
+        app.key_delay_ms = 60
+        backend.latency['set_window_positions'] = 0.05
+        try:
+            backend.posted = []
+            hold_key(app, 'g', args.repeat_seconds)
+            released = time.perf_counter()
+            wait_for_dispatcher(app.dispatcher)
+            downs = [t for t, _, msg, _, _ in backend.posted if msg == WM_KEYDOWN]
+            tail = max(downs[-1] - released, 0.0) if downs else 0.0
+
+            layouts = app.metrics.histogram('apply_layout').summary()['count']
+            hold_key(app, 'up', args.repeat_seconds)
+            released = time.perf_counter()
+            wait_for_dispatcher(app.dispatcher)
+            rotation_tail = time.perf_counter() - released
+            layouts = app.metrics.histogram('apply_layout').summary()['count'] - layouts
+            stats = app.dispatcher.stats
+            print(f"  {label}:")
+            print(f"    'g': {len(downs) // args.windows} broadcasts, last one {tail * 1000:.0f}ms after release")
+            print(f"    'up': {int(args.repeat_seconds * 30)} presses -> {layouts} layout passes, "
+                  f"done {rotation_tail * 1000:.0f}ms after release")
+            print(f"    coalesced {stats['coalesced']}, rate-limited {stats['rate_limited']}, dropped {stats['dropped']}")
+            if policies is HOTKEY_POLICIES:
+                ok = tail < 0.2 and rotation_tail < 0.2
+        finally:
+            app._on_closing()
+    return ok
+
+
+def bench_health(args):
+    """One client hangs: detection time, then rotation (layout + activation) cost with the health monitor on and off."""
+    app, backend = make_manager(args, max(args.windows, 2))
+    health = app.health
+    health.interval_ms = 100
+    try:
+        pids = [pid for pid, name in backend.list_processes() if name == app.target_exe]
+        hung_pid = pids[1]
+        print(f"health: {len(pids)} windows, probe every {health.interval_ms}ms with a {health.timeout_ms}ms timeout, "
+              f"hung windows block SetWindowPos for {backend.hung_block * 1000:.0f}ms")
+        start = time.perf_counter()
+        backend.set_hung(hung_pid)
+        while health.summary()['hung'] == 0:
+            time.sleep(0.001)
+        print(f"  hang detected after {(time.perf_counter() - start) * 1000:.0f}ms")
+
+        ok = True
+        for enabled in (False, True):
+            health.enabled = enabled
+            hist, _ = time_calls(lambda: app.rotate_main_window('up'), len(pids) * 2)
+            print_histogram(f"rotation, monitor {'on' if enabled else 'off'}", hist, max_rows=4)
+            if enabled:
+                ok = hist.percentile(99) < backend.hung_block
+        health.enabled = True
+
+        start = time.perf_counter()
+        backend.set_hung(hung_pid, False)
+        while health.summary()['hung']:
+            time.sleep(0.001)
+        print(f"  recovery seen after {(time.perf_counter() - start) * 1000:.0f}ms; stats {health.stats}")
+    finally:
+        app._on_closing()
+    return ok
+
+
+def polled_activate(backend, hwnd):
+    """The pre-notification activation path: uncached thread lookups, a settle sleep and 50ms polling retries."""
+    current = backend.get_foreground_window()
+    if current == hwnd:
+        return True
+    current_tid = backend.get_window_thread_process_id(current)[0] if current else 0
+    target_tid = backend.get_window_thread_process_id(hwnd)[0]
+    if current_tid != target_tid:
+        backend.attach_thread_input(current_tid, target_tid, True)
+        time.sleep(0.01)
+    activated = False
+    for _ in range(5):
+        backend.bring_to_foreground(hwnd)
+        if backend.get_foreground_window() == hwnd:
+            activated = True
+            break
+        time.sleep(0.05)
+    if current_tid != target_tid:
+        backend.attach_thread_input(current_tid, target_tid, False)
+    return activated
+
+
+def bench_activation(args):
+    """Window activation: the old polling loop vs waiting on foreground notifications, per focus behaviour."""
+    app, backend = make_manager(args, max(args.windows, 2))
+    hwnds = app.dd2_windows
+    iterations = max(len(hwnds) * 10, 40)
+    print(f"activation: {len(hwnds)} windows, {iterations} activations per path, "
+          f"deadline {app.activation_timeout_ms}ms, retry after {app.activation_retry_ms}ms")
+    ok = True
+    try:
+        for label, delay, refusals in (('immediate', 0.0, 0), ('5ms focus delay', 0.005, 0), ('first request refused', 0.0, 1)):
+            backend.focus_delay = delay
+            for path, activate in (('polled', lambda hwnd: polled_activate(backend, hwnd)), ('notified', app._activate_window)):
+                targets = itertools.cycle(hwnds) # Every call moves the foreground to another window
+                failures = []
+
+                def before(_):
+                    backend.focus_refusals = refusals
+
+                def call():
+                    if not activate(next(targets)):
+                        failures.append(1)
+
+                hist, _ = time_calls(call, iterations, before)
+                time.sleep(delay * 2) # Let a late focus timer land before the next path starts
+                summary = hist.summary()
+                print(f"  {label:22} {path:9} p50 {summary['p50_ms']:7.2f}ms  p99 {summary['p99_ms']:7.2f}ms  "
+                      f"failed {len(failures)}")
+                ok = ok and (path == 'polled' or not failures)
+
+        # A window that never takes focus fails at the deadline instead of after 5 sleeps
+        backend.focus_delay = 0.0
+        backend.focus_refusals = 1000
+        start = time.perf_counter()
+        activated = app._activate_window(hwnds[1] if backend.foreground == hwnds[0] else hwnds[0])
+        elapsed = time.perf_counter() - start
+        backend.focus_refusals = 0
+        print(f"  refused window: {'activated' if activated else 'failed'} after {elapsed * 1000:.0f}ms")
+        ok = ok and not activated and elapsed < app.activation_timeout_ms / 1000.0 + 0.05
+
+        print("  per-window (notified path):")
+        for client in app.registry.clients():
+            summary = client.activation.summary()
+            print(f"    {client.hwnd}: {client.activation.count} ok, p50 {summary['p50_ms']:.2f}ms "
+                  f"p99 {summary['p99_ms']:.2f}ms, {client.activation_failures} failed")
+        print(f"  thread id lookups: {backend.calls.get('get_window_thread_process_id', 0)} "
+              f"(registry hits {app.registry.stats['hits']})")
+    finally:
+        app._on_closing()
+    return ok
+
+
+def bench_profiles(args):
+    """Profile store: unchanged-file polls, runtime switches, debounced saves and a failed save."""
+    app, backend = make_manager(args, args.windows)
+    with tempfile.TemporaryDirectory() as directory:
+        store = app.profiles
+        store.path = os.path.join(directory, 'profiles.json')
+        store.save_delay = 0.2
+        ok = True
+        try:
+            for name in ('farm', 'build', 'afk'):
+                layout = dict(store.get('default')['layout'], main_w=1200 + len(name) * 100)
+                store.put(name, dict(store.get('default'), layout=layout))
+            store.flush()
+            names = store.names()
+            print(f"profiles: {len(names)} profiles in {os.path.getsize(store.path)} bytes, {args.windows} windows")
+
+            hist, _ = time_calls(store.reload_if_changed, 1000)
+            print_histogram("unchanged-file poll", hist, max_rows=4)
+            switches = itertools.cycle(names)
+            hist, _ = time_calls(lambda: app.switch_profile(next(switches)), 200)
+            print_histogram("switch_profile (GUI thread part)", hist, max_rows=4)
+            wait_for_dispatcher(app.dispatcher)
+
+            saves = store.stats['saves']
+            for i in range(100): # A drag session's worth of box saves
+                app._save_box_positions({'shopping_boxes': [{'x': i, 'y': i}] * 8, 'utility_boxes': [{'x': i, 'y': 0}] * 3})
+            time.sleep(store.save_delay * 2)
+            written = store.stats['saves'] - saves
+            print(f"  100 box saves -> {written} file write(s)")
+            ok = ok and written == 1
+
+            before = open(store.path).read()
+            store.profiles['broken'] = {'layout': object()} # Not serializable: json.dump fails part way through
+            failed = not store.save()
+            del store.profiles['broken']
+            intact = open(store.path).read() == before
+            leftovers = [name for name in os.listdir(directory) if name != 'profiles.json']
+            print(f"  failed save: reported {failed}, old file intact {intact}, temp files left {leftovers}")
+            ok = ok and failed and intact and not leftovers
+        finally:
+            app._on_closing()
+        return ok
+
+
+def placed_squares_overlay(app, positions):
+    """The pre-canvas overlay: a fullscreen layered Toplevel with a Frame per box, moved with place() on every motion event."""
+    top = tk.Toplevel(app)
+    top.overrideredirect(True)
+    top.attributes('-topmost', True)
+    top.attributes('-alpha', 0.6)
+    top.geometry(f"{top.winfo_screenwidth()}x{top.winfo_screenheight()}+0+0")
+    frames = []
+    for pos in positions['shopping_boxes'] + positions['utility_boxes']:
+        frame = tk.Frame(top, bg='#f5e0dc', width=50, height=50)
+        tk.Label(frame, text=str(len(frames) + 1)).place(relx=0.5, rely=0.5, anchor=tk.CENTER)
+        frame.place(x=pos['x'], y=pos['y'])
+        frame.bind('<B1-Motion>', lambda event, frame=frame: frame.place(x=event.x_root - 5, y=event.y_root - 5))
+        frames.append(frame)
+    return top, frames
+
+
+def synthetic_drag(app, widget, x, y, origin, events, rate_hz=1000):
+    """Presses at widget (x, y) and drags 300px right at a gaming mouse's report rate. Returns CPU seconds spent."""
+    widget.event_generate('<ButtonPress-1>', x=x, y=y, rootx=origin[0] + x, rooty=origin[1] + y)
+    cpu = time.process_time()
+    for i in range(1, events + 1):
+        dx = 300 * i // events
+        widget.event_generate('<B1-Motion>', x=x + dx, y=y, rootx=origin[0] + x + dx, rooty=origin[1] + y)
+        app.update()
+        time.sleep(1.0 / rate_hz)
+    widget.event_generate('<ButtonRelease-1>', x=x + 300, y=y, rootx=origin[0] + x + 300, rooty=origin[1] + y)
+    app.update()
+    return time.process_time() - cpu
+
+
+def bench_overlay(args):
+    """Shopping overlay: CPU per drag and covered (composited) area, old fullscreen squares vs the canvas overlay. Needs a display."""
+    app, backend = make_manager(args, 1)
+    try:
+        app.loadtk() # Headless manager, with Tk loaded just for the overlay windows
+    except tk.TclError as e:
+        print(f"overlay: skipped ({e})")
+        app._on_closing()
+        return True
+    events = 1000
+    try:
+        positions = app.box_positions
+        screen = app.winfo_screenwidth() * app.winfo_screenheight()
+        print(f"overlay: {events} motion events at 1000 Hz per drag, refresh {backend.get_refresh_rate()} Hz")
+
+        top, frames = placed_squares_overlay(app, positions)
+        app.update()
+        cpu = synthetic_drag(app, frames[0], 5, 5, (positions['shopping_boxes'][0]['x'], positions['shopping_boxes'][0]['y']), events)
+        print(f"  fullscreen squares  cpu {cpu * 1000:7.1f}ms  redraws {events:5}  covered 100% of the screen")
+        top.destroy()
+
+        overlay = ShoppingOverlay(app, initial_positions=positions, refresh_hz=backend.get_refresh_rate())
+        app.update()
+        box = overlay.boxes[0]
+        cpu = synthetic_drag(app, overlay.canvas, box['x'] - overlay.origin[0] + 5, box['y'] - overlay.origin[1] + 5,
+                             overlay.origin, events)
+        area = int(overlay.canvas.cget('width')) * int(overlay.canvas.cget('height'))
+        print(f"  canvas overlay      cpu {cpu * 1000:7.1f}ms  redraws {overlay.stats['redraws']:5}  "
+              f"covered {area / screen:.0%} of the screen")
+        ok = overlay.stats['redraws'] < events and area < screen
+        overlay.destroy()
+    except tk.TclError as e: # e.g. -transparentcolor outside Windows
+        print(f"  skipped ({e})")
+        ok = True
+    finally:
+        app._on_closing()
+    return ok
+
+
+def synthetic_shop_screen(width, height, seed=1):
+    """
+    A window capture (BGRA) with 8 shop slots in two rows and 3 round utility buttons on a noisy
+    gradient, drawn in proportion to the window height like the game's UI. Returns (capture, positions).
+    """
+    import numpy
+    rng = numpy.random.default_rng(seed)
+    scale = height / 900
+    capture = numpy.empty((height, width, 4), numpy.uint8)
+    rows, cols = numpy.mgrid[0:height, 0:width]
+    capture[..., 0] = cols * 60 // width + 30
+    capture[..., 1] = rows * 60 // height + 40
+    capture[..., 2] = 50
+    capture[..., 3] = 255
+    capture[..., :3] += rng.integers(0, 20, (height, width, 3), dtype=numpy.uint8)
+    slot, button = round(64 * scale), round(40 * scale)
+    positions = {'shopping_boxes': [], 'utility_boxes': []}
+    for i in range(8):
+        x, y = int((600 + i % 4 * 110) * scale), int((250 + i // 4 * 110) * scale)
+        border, inner = max(2, slot // 10), slot // 3
+        capture[y:y + slot, x:x + slot, :3] = (40, 160, 200)
+        capture[y + border:y + slot - border, x + border:x + slot - border, :3] = (20, 30, 40)
+        capture[y + inner:y + slot - inner, x + inner:x + slot - inner, :3] = (200, 200, 90)
+        positions['shopping_boxes'].append((x + slot // 2, y + slot // 2))
+    for i in range(3):
+        x, y = int((650 + i * 120) * scale), int(600 * scale)
+        cx, cy = x + button // 2, y + button // 2
+        disc = (rows[y:y + button, x:x + button] - cy) ** 2 + (cols[y:y + button, x:x + button] - cx) ** 2 < (button // 2) ** 2
+        capture[y:y + button, x:x + button, :3][disc] = (30, 200, 60)
+        capture[cy - 2:cy + 2, x + 3:x + button - 3, :3] = 250
+        positions['utility_boxes'].append((cx, cy))
+    return capture, positions
+
+
+def bench_calibration(args):
+    """Calibrate end to end on a simulated screen: learn templates, resize the window, locate, recalibrate from cache."""
+    import numpy
+    app, backend = make_manager(args, 2)
+    with tempfile.TemporaryDirectory() as directory:
+        app.application_path = directory
+        app.profiles.path = os.path.join(directory, 'profiles.json')
+        screen = numpy.zeros((1440, 2560, 4), numpy.uint8)
+        backend.frame_source = lambda rect, out: out.__setitem__(Ellipsis, screen[rect[1]:rect[3], rect[0]:rect[2]])
+        main_hwnd = app.dd2_windows[app.main_window_index]
+        ok = True
+
+        def show_window(seed):
+            """Draws the main window's content in its client area; returns the true absolute positions."""
+            left, top, right, bottom = backend.get_client_rect(main_hwnd)
+            screen[...] = 0
+            capture, positions = synthetic_shop_screen(right - left, bottom - top, seed)
+            screen[top:bottom, left:right] = capture
+            return {kind: [{'x': left + x, 'y': top + y} for x, y in found] for kind, found in positions.items()}
+
+        def calibrate():
+            """Runs the Calibrate action; returns the locate time in ms (0 when templates were cut instead)."""
+            locate = app.metrics.histogram('calibration.locate')
+            before = locate.total
+            app.calibrate_shop_boxes()
+            wait_for_dispatcher(app.dispatcher)
+            app.run_headless(0.05) # Applies the result on the Tk thread
+            return (locate.total - before) * 1000
+
+        def error(truth):
+            return max(max(abs(a['x'] - b['x']), abs(a['y'] - b['y']))
+                       for kind in truth for a, b in zip(app.box_positions[kind], truth[kind]))
+
+        try:
+            app.save_calibration_capture = True # Replayed with --calibrate-image at the end
+            truth = show_window(seed=1)
+            app._save_box_positions(truth) # Placed by hand
+            calibrate()
+            print(f"calibration: templates cut at {app.calibrator.reference_size[0]}x{app.calibrator.reference_size[1]}")
+            for main_w, main_h in ((1280, 670), (2200, 1150), (1720, 900)):
+                app.main_w, app.main_h = main_w, main_h
+                app.apply_layout()
+                truth = show_window(seed=main_w)
+                app._save_box_positions({kind: [{'x': 0, 'y': 0}] * len(p) for kind, p in truth.items()}) # Stale placement
+                cold = calibrate()
+                cached = calibrate()
+                worst = error(truth)
+                print(f"  {main_w}x{main_h}: max error {worst}px, locate {cold:.1f}ms, recalibrate {cached:.2f}ms")
+                ok = ok and worst <= 2
+            capture_path = os.path.join(directory, app.calibration_capture_file)
+            print("  replaying the last capture with --calibrate-image:")
+            ok = ok and calibrate_image(capture_path, app.calibrator.path) == 0
+        finally:
+            app._on_closing()
+        return ok
+
+
+def bench_boxes(args):
+    """
+    Window-relative box positions: building the per-layout table, a click's lookup against computing
+    the position per click, boxes following the main window through rotations and resizes, and
+    migrating an absolute placement.
+    """
+    app, backend = make_manager(args, max(args.windows, 2))
+    with tempfile.TemporaryDirectory() as directory:
+        app.application_path = directory
+        app.profiles.path = os.path.join(directory, 'profiles.json')
+        ok = True
+
+        def expected(hwnd):
+            """Box positions computed directly from the profile and the window's live client rect."""
+            left, top, right, bottom = backend.get_client_rect(hwnd)
+            return {kind: [{'x': left + round(box['u'] * (right - left)), 'y': top + round(box['v'] * (bottom - top))}
+                           for box in boxes] for kind, boxes in app.profiles.get()['box_positions'].items()}
+
+        try:
+            for count in args.window_counts:
+                while len(app.dd2_windows) < count:
+                    backend.spawn_process()
+                    app.find_dd2_windows()
+                app.apply_layout()
+                boxes = sum(len(p) for p in app.box_positions.values())
+                hist, _ = time_calls(app._rebuild_box_table, args.iterations)
+                summary = hist.summary()
+                print(f"boxes: table for {len(app.dd2_windows)} windows x {boxes} boxes: rebuild p50 {summary['p50_ms']:.3f}ms "
+                      f"p99 {summary['p99_ms']:.3f}ms")
+
+            hwnds = app.dd2_windows
+            table, profile_boxes = app.box_table, app.profiles.get()['box_positions']['shopping_boxes']
+            clicks = [(hwnds[i % len(hwnds)], i % len(profile_boxes)) for i in range(args.iterations * 10)]
+
+            def lookup():
+                for hwnd, index in clicks:
+                    table.screen_pos(hwnd, 'shopping_boxes', index)
+
+            def per_click():
+                for hwnd, index in clicks:
+                    left, top, right, bottom = app.registry.client_rect(hwnd)
+                    box = profile_boxes[index]
+                    position = left + round(box['u'] * (right - left)), top + round(box['v'] * (bottom - top))
+
+            for label, func in (('table lookup', lookup), ('per-click math', per_click)):
+                hist, _ = time_calls(func, 20)
+                print(f"  {label:15} {hist.summary()['p50_ms'] * 1e6 / len(clicks):7.0f}ns per click")
+
+            app._save_box_positions(app.box_positions) # Round trip through the normalized form
+            for step in range(len(hwnds)):
+                app._rotate_main_window(1)
+                ok = ok and app.box_positions == expected(app.last_main_hwnd)
+            for main_w, main_h in ((1280, 670), (2200, 1150), (1720, 900)):
+                app.main_w, app.main_h = main_w, main_h
+                app.apply_layout()
+                ok = ok and all(app.box_table.positions(hwnd) == expected(hwnd) for hwnd in hwnds)
+            print(f"  boxes follow the main window through {len(hwnds)} rotations and 3 resizes: {'ok' if ok else 'FAILED'}")
+
+            left, top, _, _ = app._main_client_rect()
+            absolute = {kind: [{'x': left + 40 + i * 50, 'y': top + (60 if kind == 'shopping_boxes' else 200)} for i in range(len(p))]
+                        for kind, p in app.box_positions.items()}
+            app.profiles.update(app.profiles.active, box_positions=absolute) # As an older profile file stores them
+            app._rebuild_box_table()
+            stored = app.profiles.get()['box_positions']
+            migrated = all('u' in box for p in stored.values() for box in p) and app.box_positions == absolute
+            app.main_w = 1500
+            app.apply_layout()
+            moved = app.box_positions == expected(app.last_main_hwnd)
+            print(f"  absolute positions migrated: {'ok' if migrated else 'FAILED'}, follow a resize afterwards: {'ok' if moved else 'FAILED'}")
+            ok = ok and migrated and moved
+        finally:
+            app._on_closing()
+        return ok
+
+
+def compare_to_baseline(results, baseline, tolerance, floor_ms=0.05):
+    """Returns a list of regressions: latencies or throughput worse than the baseline by more than `tolerance`."""
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        for stat in ('p50_ms', 'p99_ms'):
+            # Sub-floor differences are scheduler noise, not regressions
+            if result[stat] > base[stat] * (1 + tolerance) and result[stat] - base[stat] > floor_ms:
+                regressions.append(f"{key} {stat} {base[stat]:.3f} -> {result[stat]:.3f}")
+        if result['ops_per_s'] < base['ops_per_s'] / (1 + tolerance) and result['p50_ms'] - base['p50_ms'] > floor_ms:
+            regressions.append(f"{key} ops/s {base['ops_per_s']:.0f} -> {result['ops_per_s']:.0f}")
+    return regressions
+
+
+def bench_manager(args):
+    """
+    WindowManager's broadcast, rotation, layout, discovery and shopping-step paths, run headless
+    against SimulatedBackend for each window count. Optionally saved as, or checked against, a baseline.
+    """
+    config = {'window_counts': args.window_counts, 'hold_ms': args.hold_ms, 'latency': args.latency,
+              'background_processes': args.background_processes}
+    print(f"manager: windows {args.window_counts}, hold {args.hold_ms}ms, "
+          f"{args.background_processes} background processes, injected latency {args.latency or 'none'}")
+    results = {}
+    for count in args.window_counts:
+        app, backend = make_manager(args, count)
+        try:
+            for name, func, iterations, before in manager_scenarios(app, backend, args):
+                hist, ops_per_s = time_calls(func, iterations, before)
+                summary = hist.summary()
+                results[f"{name}@{count}"] = {'p50_ms': summary['p50_ms'], 'p99_ms': summary['p99_ms'],
+                                              'ops_per_s': ops_per_s}
+                print(f"  {name:18} x{count:<3} p50 {summary['p50_ms']:8.3f}ms  p99 {summary['p99_ms']:8.3f}ms  "
+                      f"{ops_per_s:10.1f} ops/s")
+        finally:
+            app._on_closing()
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'config': config, 'python': platform.python_version(), 'results': results}, f, indent=4)
+        print(f"  baseline saved to {args.save_baseline}")
+    if not args.baseline:
+        return True
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get('config') != config:
+        print(f"  warning: baseline was recorded with a different config: {baseline.get('config')}")
+    regressions = compare_to_baseline(results, baseline['results'], args.tolerance)
+    for regression in regressions:
+        print(f"  REGRESSION {regression}")
+    print(f"  {len(regressions)} regression(s) against {args.baseline} (tolerance {args.tolerance:.0%})")
+    return not regressions
+
+
+BENCHMARKS = {
+    'registry': bench_registry,
+    'broadcast': bench_broadcast,
+    'dispatch': bench_dispatch,
+    'layout': bench_layout,
+    'scheduler': bench_scheduler,
+    'probes': bench_probes,
+    'manager': bench_manager,
+    'shopping': bench_shopping,
+    'macro': bench_macro,
+    'hotkeys': bench_hotkeys,
+    'repeat': bench_repeat,
+    'health': bench_health,
+    'activation': bench_activation,
+    'profiles': bench_profiles,
+    'overlay': bench_overlay,
+    'calibration': bench_calibration,
+    'boxes': bench_boxes,
+    'background': bench_background,
+    'mirror': bench_mirror,
+}
+
+
+def parse_latency(text):
+    """'method=ms' -> (method, seconds), for --latency."""
+    name, _, ms = text.partition('=')
+    try:
+        return name, float(ms) / 1000.0
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected METHOD=MS, got '{text}'")
+
+
+def parse_window_counts(text):
+    counts = [int(n) for n in text.split(',')]
+    if not all(1 <= n <= 32 for n in counts):
+        raise argparse.ArgumentTypeError("window counts must be between 1 and 32")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('names', nargs='*', help=f"Benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument('--windows', type=int, default=4, help="Number of simulated DD2 clients")
+    parser.add_argument('--presses', type=int, default=2000, help="Simulated hotkey presses")
+    parser.add_argument('--keys', type=int, default=1, help="Keys per broadcast")
+    parser.add_argument('--hold-ms', type=float, default=20, help="Key hold interval")
+    parser.add_argument('--broadcasts', type=int, default=50, help="Broadcasts per broadcast benchmark")
+    parser.add_argument('--spam-rate', type=float, default=200, help="Hotkey presses per second for dispatch")
+    parser.add_argument('--spam-seconds', type=float, default=2.0, help="Duration of the dispatch key spam")
+    parser.add_argument('--scan-latency-ms', type=float, default=0.0, help="Injected cost of one process table scan")
+    parser.add_argument('--window-counts', type=parse_window_counts, default=[1, 4, 8, 16, 32],
+                        help="Comma-separated DD2 client counts for the manager benchmark (1-32)")
+    parser.add_argument('--iterations', type=int, default=200, help="Calls per manager scenario (broadcasts use --broadcasts)")
+    parser.add_argument('--background-processes', type=int, default=200, help="Non-DD2 entries in the fake process table")
+    parser.add_argument('--latency', type=parse_latency, action='append', default=[], metavar='METHOD=MS',
+                        help="Injected per-call latency for a SimulatedBackend method (repeatable)")
+    parser.add_argument('--react-ms', type=float, default=150, help="Synthetic game reaction time for the shopping benchmark")
+    parser.add_argument('--settle-ms', type=float, default=200, help="Synthetic animation length for the shopping benchmark")
+    parser.add_argument('--repeat-seconds', type=float, default=2.0, help="How long the repeat benchmark holds a key")
+    parser.add_argument('--macro-events', type=int, default=400, help="Events in the synthetic macro")
+    parser.add_argument('--baseline', help="Compare manager results against this baseline file")
+    parser.add_argument('--save-baseline', metavar='PATH', help="Write manager results as a new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed slowdown before a result is a regression")
+    args = parser.parse_args()
+    args.latency = dict(args.latency)
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+    # Benchmarks that also check invariants return False on failure
+    results = [BENCHMARKS[name](args) for name in args.names or BENCHMARKS]
+    sys.exit(1 if False in results else 0)
+
+
+if __name__ == "__main__":
+    main()
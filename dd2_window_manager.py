@@ -1,170 +1,3334 @@
 import time
-import psutil
-import keyboard
-from pynput.mouse import Button, Controller as MouseController
-from pynput import mouse
-import win32gui
-import win32con
-import win32api
-import win32process
-import pywintypes # Added for win32api types
-from ctypes import windll
+_IMPORT_STARTED = time.perf_counter() # For the startup breakdown (see WindowManager.startup_times)
+import ctypes
+from ctypes import wintypes
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog, simpledialog
 import threading
+import collections
+import copy
+import logging
+import logging.handlers
+import itertools
+import random
+import tracemalloc
+import argparse
+import array
+import struct
+import functools
+import math
+import queue
 import json
+import csv
 import os
 import sys
+import tempfile
 
-class DraggableSquare(tk.Frame):
-    """A simple draggable frame widget."""
-    def __init__(self, master, box_number, bg_color='grey', text_color='white', **kwargs): # Added colors
-        # Extract width and height from kwargs, provide defaults if not present
-        width = kwargs.pop('width', 50)
-        height = kwargs.pop('height', 50)
-        
-        super().__init__(master, **kwargs) # Pass remaining kwargs to super
-        self.configure(bg=bg_color, width=width, height=height, cursor="fleur") # Use extracted width/height
-        self._drag_data = {"x": 0, "y": 0}
-        self.bind("<ButtonPress-1>", self._on_press)
-        self.bind("<B1-Motion>", self._on_drag)
-
-        # Add a label to display the number
-        self.number_label = tk.Label(self, text=str(box_number), bg=bg_color, fg=text_color, font=("Arial", 12, "bold")) # Use bg_color, text_color
-        self.number_label.place(relx=0.5, rely=0.5, anchor=tk.CENTER)
-        # Bind events to the label as well, so dragging works even if clicking on the number
-        self.number_label.bind("<ButtonPress-1>", self._on_press)
-        self.number_label.bind("<B1-Motion>", self._on_drag)
-        # Make sure the label doesn't "eat" mouse events, passing them to the parent frame
-        self.number_label.bind("<ButtonRelease-1>", lambda event: self.event_generate("<ButtonRelease-1>", x=event.x, y=event.y))
+# Windows-only modules. They dominate startup time, so they are imported on first use by
+# _load_platform_modules / _load_pynput (Win32Backend), after the GUI has painted.
+psutil = keyboard = mouse = None
+win32gui = win32con = win32api = win32event = win32process = pywintypes = windll = None
+_platform_lock = threading.Lock()
+
+def _load_platform_modules():
+    """Imports pywin32, psutil and keyboard into the module globals. Returns False if they are unavailable."""
+    global psutil, keyboard, win32gui, win32con, win32api, win32event, win32process, pywintypes, windll
+    with _platform_lock:
+        if windll is not None:
+            return True
+        try:
+            import psutil
+            import keyboard
+            import win32gui
+            import win32con
+            import win32api
+            import win32event
+            import win32process
+            import pywintypes # Added for win32api types
+            from ctypes import windll
+        except ImportError: # Not on Windows: only the simulated backend below is usable
+            return False
+        return True
+
+numpy = None # Optional; imported by _load_numpy when auto-shopping starts
+asyncio = None # Imported by AutomationEngine.start, on the first automation run
+
+def _load_numpy():
+    """Returns numpy, or None if it isn't installed (auto-shopping then keeps its fixed schedule)."""
+    global numpy
+    if numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            return None
+    return numpy
+
+def _load_pynput():
+    """pynput is only needed for clicks and select mode, so it is imported separately, on first use."""
+    global mouse
+    with _platform_lock:
+        if mouse is None:
+            from pynput import mouse
+    return mouse
+
+# WinEvent constants (not exposed by pywin32)
+EVENT_SYSTEM_FOREGROUND = 0x0003
+EVENT_OBJECT_DESTROY = 0x8001
+EVENT_OBJECT_SHOW = 0x8002
+EVENT_OBJECT_HIDE = 0x8003
+OBJID_WINDOW = 0
+CHILDID_SELF = 0
+WINEVENT_OUTOFCONTEXT = 0x0000
+WINEVENT_SKIPOWNPROCESS = 0x0002
+GA_ROOT = 2
+MONITORINFOF_PRIMARY = 1
+MDT_EFFECTIVE_DPI = 0
+SPI_SETWORKAREA = 0x002F
+SRCCOPY = 0x00CC0020
+DIB_RGB_COLORS = 0
+BI_RGB = 0
+
+class BITMAPINFOHEADER(ctypes.Structure):
+    _fields_ = [('biSize', wintypes.DWORD), ('biWidth', wintypes.LONG), ('biHeight', wintypes.LONG),
+                ('biPlanes', wintypes.WORD), ('biBitCount', wintypes.WORD), ('biCompression', wintypes.DWORD),
+                ('biSizeImage', wintypes.DWORD), ('biXPelsPerMeter', wintypes.LONG), ('biYPelsPerMeter', wintypes.LONG),
+                ('biClrUsed', wintypes.DWORD), ('biClrImportant', wintypes.DWORD)]
+
+# Win32 values used by backend-independent code (same values as win32con)
+WM_KEYDOWN = 0x0100
+WM_KEYUP = 0x0101
+WM_MOUSEMOVE = 0x0200
+WM_LBUTTONDOWN = 0x0201
+WM_LBUTTONUP = 0x0202
+WM_RBUTTONDOWN = 0x0204
+WM_RBUTTONUP = 0x0205
+MK_LBUTTON = 0x0001
+MK_RBUTTON = 0x0002
+MAPVK_VSC_TO_VK_EX = 3
+VK_ESCAPE = 0x1B
+VK_PRIOR = 0x21
+VK_NEXT = 0x22
+VK_F11 = 0x7A
+VK_F12 = 0x7B
+HWND_TOP = 0
+HWND_NOTOPMOST = -2
+SWP_NOACTIVATE = 0x0010
+SWP_SHOWWINDOW = 0x0040
+POSTED_MESSAGE_QUOTA = 10000 # Default per-thread posted message limit
+WM_NULL = 0x0000
+SMTO_ABORTIFHUNG = 0x0002
+
+# Key name -> (vk code, set-1 scan code, extended key), for hotkey bindings and posted key messages
+KEY_CODES = {
+    'esc': (VK_ESCAPE, 0x01, False), 'backspace': (0x08, 0x0E, False), 'tab': (0x09, 0x0F, False),
+    'enter': (0x0D, 0x1C, False), 'space': (0x20, 0x39, False),
+    'shift': (0x10, 0x2A, False), 'right shift': (0x10, 0x36, False), 'ctrl': (0x11, 0x1D, False), 'alt': (0x12, 0x38, False),
+    'page up': (VK_PRIOR, 0x49, True), 'page down': (VK_NEXT, 0x51, True), 'end': (0x23, 0x4F, True), 'home': (0x24, 0x47, True),
+    'left': (0x25, 0x4B, True), 'up': (0x26, 0x48, True), 'right': (0x27, 0x4D, True), 'down': (0x28, 0x50, True),
+    'insert': (0x2D, 0x52, True), 'delete': (0x2E, 0x53, True),
+}
+KEY_CODES.update((c, (ord(c), 0x02 + i, False)) for i, c in enumerate('1234567890'))
+for row, first_scan in (('qwertyuiop', 0x10), ('asdfghjkl', 0x1E), ('zxcvbnm', 0x2C)):
+    KEY_CODES.update((c, (ord(c.upper()), first_scan + i, False)) for i, c in enumerate(row))
+KEY_CODES.update((f"f{n}", (0x6F + n, 0x3A + n if n <= 10 else 0x4C + n, False)) for n in range(1, 13))
+KEY_ALIASES = {'pgup': 'page up', 'pgdn': 'page down', 'escape': 'esc', 'return': 'enter', 'control': 'ctrl'}
+
+def key_code(name):
+    """(vk code, scan code, extended) for a key name, or None if it isn't known."""
+    name = name.strip().lower()
+    return KEY_CODES.get(KEY_ALIASES.get(name, name))
+
+def key_lparams(scan_code, extended=False):
+    """(WM_KEYDOWN, WM_KEYUP) lParam: repeat count 1 and the scan code; key-up adds the previous-state and transition bits."""
+    down = 1 | (scan_code << 16) | (int(extended) << 24)
+    return down, down | 0xC0000000
+
+# vk code -> (key-down lParam, key-up lParam), so posted keys carry their scan code without per-post work
+VK_LPARAMS = {}
+for _vk, _scan, _extended in KEY_CODES.values():
+    VK_LPARAMS.setdefault(_vk, key_lparams(_scan, _extended))
+
+# Window notifications delivered to DD2WindowRegistry, keyed by WinEvent id
+WINDOW_EVENT_KINDS = {
+    EVENT_OBJECT_DESTROY: 'destroy',
+    EVENT_OBJECT_SHOW: 'show',
+    EVENT_OBJECT_HIDE: 'hide',
+    EVENT_SYSTEM_FOREGROUND: 'foreground',
+}
+
+class Win32Backend:
+    """Thin wrapper over the Win32 and psutil calls used for window discovery."""
+    def __init__(self):
+        if not _load_platform_modules():
+            raise RuntimeError("Win32Backend needs Windows with pywin32, psutil and keyboard installed")
+        self._process_names = {} # pid -> exe name, so window events don't hit psutil each time
+        self._event_thread = None
+        self._event_thread_id = None
+        self._mouse = None # pynput controller, created on first click
+        self._capture = None # (size, gdi32, memory DC, DIB section, pixel pointer), reused between captures
+        self.on_display_change = None # Called with no arguments when monitors or work areas change
+
+    def list_processes(self):
+        """Returns (pid, name) for every running process."""
+        return [(p.info['pid'], p.info['name']) for p in psutil.process_iter(['pid', 'name'])]
+
+    def get_process_name(self, pid):
+        """Returns the exe name for a pid, cached until the process exits."""
+        name = self._process_names.get(pid)
+        if name is None:
+            try:
+                name = psutil.Process(pid).name()
+            except psutil.Error:
+                return None
+            self._process_names[pid] = name
+        return name
+
+    def forget_process(self, pid):
+        """Drops cached data for an exited process (pids get reused)."""
+        self._process_names.pop(pid, None)
+
+    def enum_windows(self):
+        """Returns all visible and enabled top-level windows."""
+        hwnds = []
+
+        def callback(hwnd, acc):
+            if win32gui.IsWindowVisible(hwnd) and win32gui.IsWindowEnabled(hwnd):
+                acc.append(hwnd)
+            return True
+
+        win32gui.EnumWindows(callback, hwnds)
+        return hwnds
+
+    def is_candidate_window(self, hwnd):
+        """Same filter as enum_windows, for a single window."""
+        return bool(win32gui.IsWindow(hwnd) and win32gui.IsWindowVisible(hwnd) and win32gui.IsWindowEnabled(hwnd))
+
+    def get_window_thread_process_id(self, hwnd):
+        """Returns (thread id, pid) of the window's owner."""
+        return win32process.GetWindowThreadProcessId(hwnd)
+
+    def get_window_rect(self, hwnd):
+        return win32gui.GetWindowRect(hwnd)
+
+    def get_client_rect(self, hwnd):
+        """Client area (the game's drawing surface, without the frame) in screen coordinates."""
+        _, _, width, height = win32gui.GetClientRect(hwnd)
+        left, top = win32gui.ClientToScreen(hwnd, (0, 0))
+        return left, top, left + width, top + height
+
+    def is_window(self, hwnd):
+        return bool(win32gui.IsWindow(hwnd))
+
+    def needs_restore(self, hwnd):
+        """True if the window is minimized or maximized and must be restored before it can be placed."""
+        return bool(win32gui.IsIconic(hwnd) or win32gui.IsZoomed(hwnd))
+
+    def restore_window(self, hwnd):
+        win32gui.ShowWindow(hwnd, win32con.SW_RESTORE)
+
+    def set_window_positions(self, moves):
+        """
+        Applies (hwnd, insert_after, x, y, w, h, flags) moves as one DeferWindowPos batch, so DWM
+        recomposes once. Falls back to individual SetWindowPos calls if the batch can't be built.
+        """
+        try:
+            hdwp = win32gui.BeginDeferWindowPos(len(moves))
+            for hwnd, insert_after, x, y, w, h, flags in moves:
+                hdwp = win32gui.DeferWindowPos(hdwp, hwnd, insert_after, x, y, w, h, flags)
+            win32gui.EndDeferWindowPos(hdwp)
+        except pywintypes.error:
+            for hwnd, insert_after, x, y, w, h, flags in moves:
+                try:
+                    win32gui.SetWindowPos(hwnd, insert_after, x, y, w, h, flags)
+                except pywintypes.error:
+                    pass # Window closed mid-layout; the registry will drop it
+
+    def probe_window(self, hwnd, timeout_ms):
+        """Round trip of a WM_NULL through hwnd's message queue in seconds, or None if it didn't answer within timeout_ms."""
+        start = time.perf_counter()
+        try:
+            win32gui.SendMessageTimeout(hwnd, WM_NULL, 0, 0, SMTO_ABORTIFHUNG, timeout_ms)
+        except pywintypes.error: # Timed out, hung, or gone
+            return None
+        return time.perf_counter() - start
+
+    def get_foreground_window(self):
+        return win32gui.GetForegroundWindow()
+
+    def enum_monitors(self):
+        """Returns a MonitorInfo for every attached display."""
+        monitors = []
+        for hmonitor, _, _ in win32api.EnumDisplayMonitors(None, None):
+            info = win32api.GetMonitorInfo(hmonitor)
+            monitors.append(MonitorInfo(int(hmonitor), tuple(info['Monitor']), tuple(info['Work']),
+                                        self._monitor_dpi_scale(hmonitor), bool(info['Flags'] & MONITORINFOF_PRIMARY)))
+        return monitors
+
+    def get_refresh_rate(self):
+        """Refresh rate of the primary display in Hz (60 if the driver reports the hardware default)."""
+        frequency = win32api.EnumDisplaySettings(None, win32con.ENUM_CURRENT_SETTINGS).DisplayFrequency
+        return frequency if frequency > 1 else 60
+
+    def _monitor_dpi_scale(self, hmonitor):
+        dpi_x, dpi_y = wintypes.UINT(), wintypes.UINT()
+        try:
+            if windll.shcore.GetDpiForMonitor(wintypes.HMONITOR(int(hmonitor)), MDT_EFFECTIVE_DPI,
+                                              ctypes.byref(dpi_x), ctypes.byref(dpi_y)) == 0:
+                return dpi_x.value / 96.0
+        except (AttributeError, OSError): # shcore is Windows 8.1+
+            pass
+        return 1.0
+
+    def post_message(self, hwnd, msg, wparam, lparam):
+        """Posts to the window's queue; returns False if the window is gone."""
+        try:
+            win32api.PostMessage(hwnd, msg, wparam, lparam)
+            return True
+        except pywintypes.error:
+            return False
+
+    def bring_to_foreground(self, hwnd):
+        win32gui.BringWindowToTop(hwnd)
+        win32gui.SetForegroundWindow(hwnd)
+
+    def attach_thread_input(self, thread_id, target_thread_id, attach):
+        windll.user32.AttachThreadInput(thread_id, target_thread_id, attach)
+
+    # --- Screen capture ---
+    def capture_region(self, rect, out):
+        """
+        Copies the screen pixels in rect (left, top, right, bottom) into `out`, a C-contiguous uint8
+        array of shape (height, width, 4) in BGRA order. The DIB section is kept between calls.
+        Plain BitBlt (no CAPTUREBLT) leaves layered windows, i.e. the shopping overlay, out.
+        """
+        left, top, right, bottom = rect
+        width, height = right - left, bottom - top
+        if self._capture is None or self._capture[0] != (width, height):
+            self._create_capture_surface(width, height)
+        _, gdi32, memory_dc, _, bits = self._capture
+        screen_dc = windll.user32.GetDC(None)
+        try:
+            gdi32.BitBlt(memory_dc, 0, 0, width, height, screen_dc, left, top, SRCCOPY)
+        finally:
+            windll.user32.ReleaseDC(None, screen_dc)
+        gdi32.GdiFlush()
+        ctypes.memmove(out.ctypes.data, bits, width * height * 4)
+
+    def _create_capture_surface(self, width, height):
+        gdi32 = ctypes.WinDLL('gdi32')
+        gdi32.CreateCompatibleDC.restype = wintypes.HDC
+        gdi32.CreateCompatibleDC.argtypes = [wintypes.HDC]
+        gdi32.CreateDIBSection.restype = wintypes.HBITMAP
+        gdi32.CreateDIBSection.argtypes = [wintypes.HDC, ctypes.c_void_p, wintypes.UINT, ctypes.POINTER(ctypes.c_void_p),
+                                           wintypes.HANDLE, wintypes.DWORD]
+        gdi32.SelectObject.argtypes = [wintypes.HDC, wintypes.HGDIOBJ]
+        gdi32.BitBlt.argtypes = [wintypes.HDC, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int,
+                                 wintypes.HDC, ctypes.c_int, ctypes.c_int, wintypes.DWORD]
+        gdi32.DeleteObject.argtypes = [wintypes.HGDIOBJ]
+        gdi32.DeleteDC.argtypes = [wintypes.HDC]
+        if self._capture:
+            _, _, old_dc, old_bitmap, _ = self._capture
+            gdi32.DeleteDC(old_dc)
+            gdi32.DeleteObject(old_bitmap)
+        # Negative height: top-down rows, matching the (height, width, 4) array layout
+        header = BITMAPINFOHEADER(ctypes.sizeof(BITMAPINFOHEADER), width, -height, 1, 32, BI_RGB, 0, 0, 0, 0, 0)
+        bits = ctypes.c_void_p()
+        memory_dc = gdi32.CreateCompatibleDC(None)
+        bitmap = gdi32.CreateDIBSection(memory_dc, ctypes.byref(header), DIB_RGB_COLORS, ctypes.byref(bits), None, 0)
+        gdi32.SelectObject(memory_dc, bitmap)
+        self._capture = ((width, height), gdi32, memory_dc, bitmap, bits)
+
+    # --- Global input (real cursor and keyboard, not window messages) ---
+    def get_cursor_pos(self):
+        return win32api.GetCursorPos()
+
+    def set_cursor_pos(self, pos):
+        win32api.SetCursorPos(pos)
+
+    def click(self):
+        """Left click at the current cursor position."""
+        if self._mouse is None:
+            self._mouse = _load_pynput().Controller()
+        self._mouse.click(mouse.Button.left, 1)
+
+    def press_key(self, key_name):
+        """Presses and releases a key in whichever window has focus."""
+        keyboard.press_and_release(key_name)
+
+    def add_hotkey(self, hotkey, callback, args=()):
+        """Registers a global hotkey; callback(*args) runs on the hook thread. Returns a handle for remove_hotkey."""
+        return keyboard.add_hotkey(hotkey, callback, args=args)
+
+    def remove_hotkey(self, handle):
+        keyboard.remove_hotkey(handle)
+
+    def remove_all_hotkeys(self):
+        keyboard.unhook_all()
+
+    def hook_keys(self, on_key):
+        """Calls on_key(scan_code, down) for every global key event, on the hook thread. Returns a handle for unhook_keys."""
+        return keyboard.hook(lambda event: on_key(event.scan_code, event.event_type == keyboard.KEY_DOWN))
+
+    def unhook_keys(self, handle):
+        keyboard.unhook(handle)
+
+    def hook_input(self, on_input, keys=True):
+        """
+        Calls on_input(kind, code, down, x, y) for every global key ('key', vk code) and mouse button
+        ('mouse', 0 left / 1 right, screen position) event, on the hook threads. Returns a handle for unhook_input.
+        With keys=False only the mouse is hooked: no global keyboard hook is installed.
+        """
+        buttons = {_load_pynput().Button.left: 0, mouse.Button.right: 1}
+
+        def on_key(event):
+            vk_code = windll.user32.MapVirtualKeyW(event.scan_code, MAPVK_VSC_TO_VK_EX)
+            on_input('key', vk_code, event.event_type == keyboard.KEY_DOWN, 0, 0)
+
+        def on_click(x, y, button, pressed):
+            if button in buttons:
+                on_input('mouse', buttons[button], pressed, x, y)
+
+        listener = mouse.Listener(on_click=on_click)
+        listener.start()
+        return (keyboard.hook(on_key) if keys else None), listener
+
+    def unhook_input(self, handle):
+        key_hook, listener = handle
+        if key_hook is not None:
+            keyboard.unhook(key_hook)
+        listener.stop()
+
+    def start_event_listener(self, on_event):
+        """Starts a thread that reports top-level window show/hide/destroy and foreground changes as on_event(kind, hwnd)."""
+        if self._event_thread and self._event_thread.is_alive():
+            return
+        ready = threading.Event()
+        self._event_thread = threading.Thread(target=self._event_loop, args=(on_event, ready), daemon=True, name="dd2-winevents")
+        self._event_thread.start()
+        ready.wait(2.0)
+
+    def stop_event_listener(self):
+        if self._event_thread_id:
+            windll.user32.PostThreadMessageW(self._event_thread_id, win32con.WM_QUIT, 0, 0)
+            self._event_thread_id = None
+
+    def _event_loop(self, on_event, ready):
+        """WinEvent hooks are delivered through the message queue of the thread that set them."""
+        user32 = ctypes.WinDLL('user32')
+        WinEventProc = ctypes.WINFUNCTYPE(None, wintypes.HANDLE, wintypes.DWORD, wintypes.HWND,
+                                          wintypes.LONG, wintypes.LONG, wintypes.DWORD, wintypes.DWORD)
+        user32.SetWinEventHook.restype = wintypes.HANDLE
+        user32.SetWinEventHook.argtypes = [wintypes.UINT, wintypes.UINT, wintypes.HMODULE, WinEventProc,
+                                           wintypes.DWORD, wintypes.DWORD, wintypes.UINT]
+        user32.GetAncestor.restype = wintypes.HWND
+        user32.GetAncestor.argtypes = [wintypes.HWND, wintypes.UINT]
+
+        def handler(hook, event, hwnd, id_object, id_child, thread_id, timestamp):
+            if not hwnd or id_object != OBJID_WINDOW or id_child != CHILDID_SELF:
+                return
+            kind = WINDOW_EVENT_KINDS.get(event)
+            # Destroyed windows can't be queried anymore; the registry ignores unknown handles
+            if kind != 'destroy' and user32.GetAncestor(hwnd, GA_ROOT) != hwnd:
+                return
+            on_event(kind, hwnd)
+
+        proc = WinEventProc(handler) # Must stay referenced while the hook is installed
+        hook = user32.SetWinEventHook(EVENT_OBJECT_DESTROY, EVENT_OBJECT_HIDE, None, proc, 0, 0,
+                                      WINEVENT_OUTOFCONTEXT | WINEVENT_SKIPOWNPROCESS)
+        # Foreground changes include our own window, so activation never waits on a stale foreground
+        foreground_hook = user32.SetWinEventHook(EVENT_SYSTEM_FOREGROUND, EVENT_SYSTEM_FOREGROUND, None, proc, 0, 0,
+                                                 WINEVENT_OUTOFCONTEXT)
+        display_hwnd = self._create_display_watcher()
+        self._event_thread_id = windll.kernel32.GetCurrentThreadId()
+        ready.set()
+
+        msg = wintypes.MSG()
+        while user32.GetMessageW(ctypes.byref(msg), None, 0, 0) > 0:
+            user32.TranslateMessage(ctypes.byref(msg))
+            user32.DispatchMessageW(ctypes.byref(msg))
+        user32.UnhookWinEvent(hook)
+        user32.UnhookWinEvent(foreground_hook)
+        win32gui.DestroyWindow(display_hwnd)
+
+    def _create_display_watcher(self):
+        """
+        Hidden top-level window on the event thread: WM_DISPLAYCHANGE and work-area changes are only
+        broadcast to top-level windows, and this one forwards them to on_display_change.
+        """
+        def on_display_message(hwnd, msg, wparam, lparam):
+            if msg == win32con.WM_DISPLAYCHANGE or wparam == SPI_SETWORKAREA:
+                if self.on_display_change:
+                    self.on_display_change()
+            return 0
+
+        wc = win32gui.WNDCLASS()
+        wc.lpszClassName = "DD2DisplayWatcher"
+        wc.hInstance = win32api.GetModuleHandle(None)
+        wc.lpfnWndProc = {win32con.WM_DISPLAYCHANGE: on_display_message, win32con.WM_SETTINGCHANGE: on_display_message}
+        try:
+            class_atom = win32gui.RegisterClass(wc)
+        except pywintypes.error: # Already registered by an earlier listener
+            class_atom = wc.lpszClassName
+        return win32gui.CreateWindow(class_atom, "DD2DisplayWatcher", 0, 0, 0, 0, 0, 0, 0, wc.hInstance, None)
+
+    def watch_process_exit(self, pid, on_exit):
+        """Calls on_exit(pid) from a waiter thread once the process terminates."""
+        try:
+            handle = win32api.OpenProcess(win32con.SYNCHRONIZE, False, pid)
+        except pywintypes.error:
+            on_exit(pid) # Already gone
+            return
+
+        def waiter():
+            try:
+                win32event.WaitForSingleObject(handle, win32event.INFINITE)
+            finally:
+                win32api.CloseHandle(handle)
+            on_exit(pid)
+
+        threading.Thread(target=waiter, daemon=True, name=f"dd2-exit-{pid}").start()
+
+class SimulatedBackend:
+    """
+    In-process stand-in for Win32Backend with fake process, window, cursor and hotkey state.
+    Counts every call and can inject a per-call latency, so scan cost can be measured on any OS.
+    """
+    def __init__(self, background_processes=200, background_windows=40, latency=None):
+        self.calls = {} # method name -> call count
+        self.latency = dict(latency or {}) # method name -> seconds spent per call
+        self.processes = {} # pid -> exe name
+        self.windows = {} # hwnd -> {'pid', 'tid', 'rect', 'visible'}
+        self.foreground = 0
+        self.posted = None # Set to a list to record (time, hwnd, msg, wparam, lparam) for every post
+        self.cursor = (0, 0)
+        self.hotkeys = {} # handle -> (hotkey, callback, args)
+        self.input_hooks = {} # handle -> (on_input, keys), see hook_input
+        self.key_hooks = {} # handle -> on_key, see hook_keys
+        self.input_log = collections.deque(maxlen=1000) # (time, kind, detail) for global key presses, clicks and moves
+        self.frame_source = None # Called as frame_source(rect, out) to fill a capture; None captures black
+        self.monitors = [MonitorInfo(1, (0, 0, 2560, 1440), (0, 0, 2560, 1400), 1.0, True)]
+        self.hung_block = 0.5 # Seconds a synchronous call (SetWindowPos) into a hung window blocks
+        self.focus_delay = 0.0 # Seconds before a foreground request takes effect and its notification fires
+        self.focus_refusals = 0 # Upcoming foreground requests that are ignored, like a foreground lock
+        self.refresh_rate = 60
+        self.frame_insets = (8, 31, 8, 8) # Border and title bar around the client area: left, top, right, bottom
+        self.on_display_change = None
+        self._pids = itertools.count(1000, 4)
+        self._hwnds = itertools.count(0x10010, 2)
+        self._tids = itertools.count(5000, 4)
+        self._hotkey_handles = itertools.count(1)
+        self._on_event = None
+        self._exit_watchers = {} # pid -> [callbacks]
+        self._lock = threading.RLock()
+
+        for i in range(background_processes):
+            pid = self.spawn_process(f"background{i}.exe", windows=0)
+            if i < background_windows:
+                self.create_window(pid)
+
+    def _call(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        delay = self.latency.get(name)
+        if delay:
+            time.sleep(delay)
+
+    # --- Scripting API ---
+    def spawn_process(self, name="DunDefGame.exe", windows=1, rect=(0, 0, 1720, 900)):
+        """Adds a fake process, optionally with visible windows, and returns its pid."""
+        with self._lock:
+            pid = next(self._pids)
+            self.processes[pid] = name
+        for _ in range(windows):
+            self.create_window(pid, rect)
+        return pid
+
+    def kill_process(self, pid):
+        """Removes a process and destroys its windows, firing the same notifications as Windows would."""
+        with self._lock:
+            self.processes.pop(pid, None)
+            hwnds = [hwnd for hwnd, w in self.windows.items() if w['pid'] == pid]
+            watchers = self._exit_watchers.pop(pid, [])
+        for hwnd in hwnds:
+            self.destroy_window(hwnd)
+        for on_exit in watchers:
+            on_exit(pid)
+
+    def create_window(self, pid, rect=(0, 0, 1720, 900)):
+        with self._lock:
+            hwnd = next(self._hwnds)
+            self.windows[hwnd] = {'pid': pid, 'tid': next(self._tids), 'rect': tuple(rect), 'visible': True, 'state': 'normal',
+                                  'hung': False, 'backlog': 0, 'response': 0.0}
+        self._emit('show', hwnd)
+        return hwnd
+
+    def destroy_window(self, hwnd):
+        with self._lock:
+            self.windows.pop(hwnd, None)
+        self._emit('destroy', hwnd)
+
+    def set_hung(self, pid, hung=True):
+        """Marks a process as not pumping messages: posts pile up in its queue and activation fails."""
+        with self._lock:
+            for w in self.windows.values():
+                if w['pid'] == pid:
+                    w['hung'] = hung
+                    if not hung:
+                        w['backlog'] = 0 # Queue drained once it recovers
+
+    def set_response_time(self, pid, seconds):
+        """Makes a process's windows answer sent messages (probe_window) only after `seconds`, like a loading client."""
+        with self._lock:
+            for w in self.windows.values():
+                if w['pid'] == pid:
+                    w['response'] = seconds
+
+    def set_monitors(self, monitors):
+        """Replaces the display topology and fires the display-change notification."""
+        self.monitors = list(monitors)
+        if self.on_display_change:
+            self.on_display_change()
+
+    def fire_hotkey(self, hotkey):
+        """
+        Simulates a keypress, as the hook thread would: runs every callback registered for `hotkey` and
+        sends its key events ('ctrl+f7': ctrl down, f7 down, f7 up, ctrl up) to every hook_keys hook.
+        Returns how many callbacks and hooks ran.
+        """
+        with self._lock:
+            callbacks = [(callback, args) for name, callback, args in self.hotkeys.values() if name == hotkey]
+            key_hooks = list(self.key_hooks.values())
+        for callback, args in callbacks:
+            callback(*args)
+        if key_hooks:
+            scans = [key_code(name)[1] for name in hotkey.split('+')]
+            for scan, down in [(scan, True) for scan in scans] + [(scan, False) for scan in reversed(scans)]:
+                for on_key in key_hooks:
+                    on_key(scan, down)
+        return len(callbacks) + len(key_hooks)
+
+    def inject_input(self, kind, code, down, x=0, y=0):
+        """Simulates a global key or mouse button event: runs every hook_input callback, as the hook threads would."""
+        with self._lock:
+            hooks = list(self.input_hooks.values())
+        for on_input, keys in hooks:
+            if keys or kind == 'mouse':
+                on_input(kind, code, down, x, y)
+
+    def _emit(self, kind, hwnd):
+        if self._on_event:
+            self._on_event(kind, hwnd)
+
+    # --- Win32Backend interface ---
+    def list_processes(self):
+        self._call('list_processes')
+        with self._lock:
+            return list(self.processes.items())
+
+    def get_process_name(self, pid):
+        self._call('get_process_name')
+        return self.processes.get(pid)
+
+    def forget_process(self, pid):
+        pass
+
+    def enum_windows(self):
+        self._call('enum_windows')
+        with self._lock:
+            return [hwnd for hwnd, w in self.windows.items() if w['visible']]
+
+    def is_candidate_window(self, hwnd):
+        self._call('is_candidate_window')
+        w = self.windows.get(hwnd)
+        return bool(w and w['visible'])
+
+    def get_window_thread_process_id(self, hwnd):
+        self._call('get_window_thread_process_id')
+        w = self.windows.get(hwnd)
+        if w is None:
+            return 0, 0
+        return w['tid'], w['pid']
+
+    def get_window_rect(self, hwnd):
+        self._call('get_window_rect')
+        w = self.windows.get(hwnd)
+        return w['rect'] if w else (0, 0, 0, 0)
+
+    def get_client_rect(self, hwnd):
+        self._call('get_client_rect')
+        w = self.windows.get(hwnd)
+        if w is None:
+            return 0, 0, 0, 0
+        (left, top, right, bottom), (dl, dt, dr, db) = w['rect'], self.frame_insets
+        return left + dl, top + dt, max(left + dl, right - dr), max(top + dt, bottom - db)
+
+    def is_window(self, hwnd):
+        self._call('is_window')
+        return hwnd in self.windows
+
+    def needs_restore(self, hwnd):
+        self._call('needs_restore')
+        w = self.windows.get(hwnd)
+        return bool(w and w['state'] != 'normal')
+
+    def restore_window(self, hwnd):
+        self._call('restore_window')
+        w = self.windows.get(hwnd)
+        if w:
+            w['state'] = 'normal'
+
+    def set_window_positions(self, moves):
+        self._call('set_window_positions')
+        for hwnd, insert_after, x, y, w, h, flags in moves:
+            self._call('defer_window_pos')
+            window = self.windows.get(hwnd)
+            if window:
+                if window['hung']: # Positioning sends to the window's thread and waits for it
+                    time.sleep(self.hung_block)
+                window['rect'] = (x, y, x + w, y + h)
+
+    def probe_window(self, hwnd, timeout_ms):
+        self._call('probe_window')
+        w = self.windows.get(hwnd)
+        if w is None:
+            return None
+        if w['hung'] or w['response'] * 1000 >= timeout_ms:
+            time.sleep(timeout_ms / 1000.0)
+            return None
+        start = time.perf_counter()
+        time.sleep(w['response'])
+        return time.perf_counter() - start
+
+    def get_foreground_window(self):
+        self._call('get_foreground_window')
+        return self.foreground
+
+    def enum_monitors(self):
+        self._call('enum_monitors')
+        return list(self.monitors)
+
+    def get_refresh_rate(self):
+        self._call('get_refresh_rate')
+        return self.refresh_rate
+
+    def post_message(self, hwnd, msg, wparam, lparam):
+        self._call('post_message')
+        w = self.windows.get(hwnd)
+        if w is None:
+            return False
+        if w['hung']:
+            if w['backlog'] >= POSTED_MESSAGE_QUOTA:
+                return False # Queue full, PostMessage fails like on Windows
+            w['backlog'] += 1
+        if self.posted is not None:
+            self.posted.append((time.perf_counter(), hwnd, msg, wparam, lparam))
+        return True
+
+    def bring_to_foreground(self, hwnd):
+        self._call('bring_to_foreground')
+        w = self.windows.get(hwnd)
+        if not w or w['hung']:
+            return
+        if self.focus_refusals > 0:
+            self.focus_refusals -= 1
+            return
+
+        def take_focus():
+            if hwnd in self.windows and self.foreground != hwnd:
+                self.foreground = hwnd
+                self._emit('foreground', hwnd)
+
+        if self.focus_delay > 0:
+            threading.Timer(self.focus_delay, take_focus).start()
+        else:
+            take_focus()
+
+    def attach_thread_input(self, thread_id, target_thread_id, attach):
+        self._call('attach_thread_input')
+
+    def get_cursor_pos(self):
+        self._call('get_cursor_pos')
+        return self.cursor
+
+    def set_cursor_pos(self, pos):
+        self._call('set_cursor_pos')
+        self.cursor = tuple(pos)
+        self.input_log.append((time.perf_counter(), 'move', self.cursor))
+
+    def capture_region(self, rect, out):
+        self._call('capture_region')
+        if self.frame_source:
+            self.frame_source(rect, out)
+        else:
+            out[...] = 0
+
+    def click(self):
+        self._call('click')
+        self.input_log.append((time.perf_counter(), 'click', self.cursor))
+
+    def press_key(self, key_name):
+        self._call('press_key')
+        self.input_log.append((time.perf_counter(), 'key', key_name))
+
+    def add_hotkey(self, hotkey, callback, args=()):
+        with self._lock:
+            handle = next(self._hotkey_handles)
+            self.hotkeys[handle] = (hotkey, callback, tuple(args))
+        return handle
+
+    def remove_hotkey(self, handle):
+        with self._lock:
+            del self.hotkeys[handle] # KeyError, like keyboard.remove_hotkey with an unknown handle
+
+    def remove_all_hotkeys(self):
+        with self._lock:
+            self.hotkeys.clear()
+
+    def hook_keys(self, on_key):
+        with self._lock:
+            handle = next(self._hotkey_handles)
+            self.key_hooks[handle] = on_key
+        return handle
+
+    def unhook_keys(self, handle):
+        with self._lock:
+            del self.key_hooks[handle]
+
+    def hook_input(self, on_input, keys=True):
+        with self._lock:
+            handle = next(self._hotkey_handles)
+            self.input_hooks[handle] = (on_input, keys)
+        return handle
+
+    def unhook_input(self, handle):
+        with self._lock:
+            del self.input_hooks[handle]
+
+    def start_event_listener(self, on_event):
+        self._on_event = on_event
+
+    def stop_event_listener(self):
+        self._on_event = None
+
+    def watch_process_exit(self, pid, on_exit):
+        with self._lock:
+            if pid in self.processes:
+                self._exit_watchers.setdefault(pid, []).append(on_exit)
+                return
+        on_exit(pid)
+
+class MonitorInfo:
+    """One display: monitor and work-area rects as (left, top, right, bottom), plus DPI scale (1.0 = 96 dpi)."""
+    __slots__ = ('handle', 'rect', 'work_area', 'dpi_scale', 'primary')
+
+    def __init__(self, handle, rect, work_area, dpi_scale, primary):
+        self.handle = handle
+        self.rect = rect
+        self.work_area = work_area
+        self.dpi_scale = dpi_scale
+        self.primary = primary
+
+    def __repr__(self):
+        return f"MonitorInfo(work_area={self.work_area}, dpi_scale={self.dpi_scale}, primary={self.primary})"
+
+class MonitorTopology:
+    """
+    Cached display topology. Monitors are enumerated once and re-enumerated only after a
+    display-change notification, not per layout. Index 0 is the primary monitor, the rest
+    follow left to right.
+    """
+    def __init__(self, backend, on_change=None):
+        self.backend = backend
+        self.on_change = on_change # Called with no arguments after a display change, from the notifying thread
+        self._monitors = None
+        self.stats = {'queries': 0, 'invalidations': 0}
+        backend.on_display_change = self.invalidate
+
+    def monitors(self):
+        monitors = self._monitors
+        if monitors is None:
+            self.stats['queries'] += 1
+            found = self.backend.enum_monitors()
+            monitors = self._monitors = tuple(sorted(found, key=lambda m: (not m.primary, m.rect[0], m.rect[1])))
+        return monitors
+
+    def invalidate(self):
+        self._monitors = None
+        self.stats['invalidations'] += 1
+        if self.on_change:
+            self.on_change()
+
+    def get(self, index):
+        """Returns monitor `index`, falling back to the primary if that display isn't attached."""
+        monitors = self.monitors()
+        return monitors[index] if 0 <= index < len(monitors) else monitors[0]
+
+    def __len__(self):
+        return len(self.monitors())
+
+class DD2Client:
+    """Cached facts about one DD2 game window."""
+    __slots__ = ('hwnd', 'pid', 'tid', 'rect', 'last_seen', 'activation', 'activation_failures', 'client_inset')
+
+    def __init__(self, hwnd, pid, tid, rect, last_seen):
+        self.hwnd = hwnd
+        self.pid = pid
+        self.tid = tid
+        self.rect = rect
+        self.last_seen = last_seen
+        self.activation = LatencyHistogram() # Time to a confirmed foreground change, successful activations only
+        self.activation_failures = 0
+        self.client_inset = None # Frame around the client area (left, top, right, bottom), learned on first use
+
+    def __repr__(self):
+        return f"DD2Client(hwnd={self.hwnd}, pid={self.pid}, tid={self.tid}, rect={self.rect})"
+
+class DD2WindowRegistry:
+    """
+    Persistent registry of DD2 game windows.
+    Kept current from window show/hide/destroy and process exit notifications, with a periodic
+    full reconcile as a fallback for anything the notifications miss. Readers never rescan.
+    """
+    def __init__(self, backend, target_exe, reconcile_interval=5.0, on_change=None, metrics=None, on_message=None):
+        self.backend = backend
+        self.target_exe = target_exe
+        self.metrics = metrics or Metrics(enabled=False)
+        self.reconcile_interval = reconcile_interval # Seconds between fallback full scans (0 disables)
+        self.on_change = on_change # Called as on_change(hwnds) from whichever thread saw the change
+        self.on_message = on_message or print # Background failures are reported here
+
+        self._lock = threading.RLock()
+        self._clients = {} # hwnd -> DD2Client, in discovery order
+        self._by_pid = {} # pid -> [hwnd, ...]
+        self._snapshot = () # Ordered tuple of hwnds handed out to readers
+        self._watched_pids = set()
+        self._primed = False
+        self._stop_event = threading.Event()
+        self._reconcile_thread = None
+        self.foreground = 0 # Foreground window as last reported by the event listener
+        self._foreground_changed = threading.Condition()
+
+        self.stats = {'hits': 0, 'misses': 0, 'events': 0, 'scans': 0, 'scan_time': 0.0, 'last_scan_time': 0.0}
+
+    # --- Lifecycle ---
+    def start(self):
+        """Primes the cache and starts listening for changes."""
+        self.backend.start_event_listener(self._on_window_event)
+        self.note_foreground(self.backend.get_foreground_window())
+        self.reconcile()
+        if self.reconcile_interval > 0 and not self._reconcile_thread:
+            self._stop_event.clear()
+            self._reconcile_thread = threading.Thread(target=self._reconcile_loop, daemon=True, name="dd2-reconcile")
+            self._reconcile_thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._reconcile_thread = None
+        self.backend.stop_event_listener()
+
+    def _reconcile_loop(self):
+        while not self._stop_event.wait(self.reconcile_interval):
+            try:
+                self.reconcile()
+            except Exception as e: # Keep the fallback alive through transient API failures
+                self.on_message(f"DD2 window reconcile failed: {e}")
+
+    # --- Readers ---
+    def hwnds(self):
+        """Returns the current DD2 windows as a tuple, in discovery order."""
+        if not self._primed:
+            self.stats['misses'] += 1
+            self.reconcile()
+        else:
+            self.stats['hits'] += 1
+        return self._snapshot
+
+    def clients(self):
+        with self._lock:
+            return tuple(self._clients[hwnd] for hwnd in self._snapshot)
+
+    def get(self, hwnd):
+        return self._clients.get(hwnd)
+
+    def thread_id(self, hwnd):
+        """Thread owning `hwnd`: cached for DD2 windows, looked up for anything else."""
+        client = self._clients.get(hwnd)
+        if client:
+            self.stats['hits'] += 1
+            return client.tid
+        self.stats['misses'] += 1
+        return self.backend.get_window_thread_process_id(hwnd)[0]
+
+    def client_rect(self, hwnd):
+        """
+        Client area of a DD2 window in screen coordinates: the cached window rect less its frame. The
+        frame is measured once per window; only a window the registry doesn't know is queried every time.
+        """
+        client = self._clients.get(hwnd)
+        if client is None:
+            self.stats['misses'] += 1
+            return self.backend.get_client_rect(hwnd)
+        if client.client_inset is None:
+            self.stats['misses'] += 1
+            window, inner = self.backend.get_window_rect(hwnd), self.backend.get_client_rect(hwnd)
+            if inner[2] <= inner[0]: # Minimized: nothing to measure yet
+                return inner
+            client.rect = window
+            client.client_inset = (inner[0] - window[0], inner[1] - window[1], window[2] - inner[2], window[3] - inner[3])
+        else:
+            self.stats['hits'] += 1
+        (left, top, right, bottom), (dl, dt, dr, db) = client.rect, client.client_inset
+        return left + dl, top + dt, right - dr, bottom - db
+
+    def wait_for_foreground(self, hwnd, deadline):
+        """Blocks until `hwnd` is reported as the foreground window or perf_counter() passes `deadline`. Returns whether it was."""
+        with self._foreground_changed:
+            while self.foreground != hwnd:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return False
+                self._foreground_changed.wait(remaining)
+            return True
+
+    def hwnds_for_pid(self, pid):
+        with self._lock:
+            return tuple(self._by_pid.get(pid, ()))
+
+    def __len__(self):
+        return len(self._snapshot)
+
+    # --- Writers ---
+    def note_foreground(self, hwnd):
+        """Records the foreground window, from the listener or from a caller that has just queried it."""
+        with self._foreground_changed:
+            self.foreground = hwnd
+            self._foreground_changed.notify_all()
+
+    def reconcile(self):
+        """Full process + window scan. Returns the number of DD2 windows found."""
+        start = time.perf_counter()
+        pids = {pid for pid, name in self.backend.list_processes() if name == self.target_exe}
+        found = []
+        for hwnd in self.backend.enum_windows():
+            tid, pid = self.backend.get_window_thread_process_id(hwnd)
+            if pid in pids:
+                found.append((hwnd, pid, tid, self.backend.get_window_rect(hwnd)))
+
+        now = time.monotonic()
+        with self._lock:
+            before = self._snapshot
+            alive = {hwnd for hwnd, _, _, _ in found}
+            for hwnd in [h for h in self._clients if h not in alive]:
+                self._remove(hwnd)
+            for hwnd, pid, tid, rect in found:
+                client = self._clients.get(hwnd)
+                if client:
+                    client.rect = rect
+                    client.last_seen = now
+                else:
+                    self._add(DD2Client(hwnd, pid, tid, rect, now))
+            self._primed = True
+            changed = self._snapshot != before
+
+        elapsed = time.perf_counter() - start
+        self.metrics.record('find_dd2_windows', elapsed)
+        self.stats['scans'] += 1
+        self.stats['scan_time'] += elapsed
+        self.stats['last_scan_time'] = elapsed
+        self._watch_new_pids()
+        if changed:
+            self._notify()
+        return len(self._snapshot)
+
+    def discard(self, hwnd):
+        """Drops a window that a caller found to be dead (e.g. PostMessage failed)."""
+        with self._lock:
+            if hwnd not in self._clients:
+                return
+            self._remove(hwnd)
+            self.stats['misses'] += 1
+        self._notify()
+
+    def update_rect(self, hwnd, rect):
+        """Records a rect the caller has just applied, so readers don't have to query it."""
+        client = self._clients.get(hwnd)
+        if client:
+            client.rect = tuple(rect)
+            client.last_seen = time.monotonic()
+
+    def _add(self, client):
+        self._clients[client.hwnd] = client
+        self._by_pid.setdefault(client.pid, []).append(client.hwnd)
+        self._snapshot = tuple(self._clients)
+
+    def _remove(self, hwnd):
+        client = self._clients.pop(hwnd)
+        pid_hwnds = self._by_pid.get(client.pid, [])
+        if hwnd in pid_hwnds:
+            pid_hwnds.remove(hwnd)
+        if not pid_hwnds:
+            self._by_pid.pop(client.pid, None)
+        self._snapshot = tuple(self._clients)
+
+    def _watch_new_pids(self):
+        with self._lock:
+            new_pids = [pid for pid in self._by_pid if pid not in self._watched_pids]
+            self._watched_pids.update(new_pids)
+        for pid in new_pids:
+            self.backend.watch_process_exit(pid, self._on_process_exit)
+
+    def _notify(self):
+        if self.on_change:
+            self.on_change(self._snapshot)
+
+    # --- Notification handlers (called from backend threads) ---
+    def _on_window_event(self, kind, hwnd):
+        self.stats['events'] += 1
+        if kind == 'foreground':
+            self.note_foreground(hwnd)
+            return
+        if kind == 'show':
+            if hwnd in self._clients or not self.backend.is_candidate_window(hwnd):
+                return
+            tid, pid = self.backend.get_window_thread_process_id(hwnd)
+            if self.backend.get_process_name(pid) != self.target_exe:
+                return
+            with self._lock:
+                if hwnd in self._clients:
+                    return
+                self._add(DD2Client(hwnd, pid, tid, self.backend.get_window_rect(hwnd), time.monotonic()))
+            self._watch_new_pids()
+        else: # 'hide' or 'destroy'
+            with self._lock:
+                if hwnd not in self._clients:
+                    return
+                self._remove(hwnd)
+        self._notify()
+
+    def _on_process_exit(self, pid):
+        with self._lock:
+            self._watched_pids.discard(pid)
+            hwnds = list(self._by_pid.get(pid, ()))
+            for hwnd in hwnds:
+                self._remove(hwnd)
+        self.backend.forget_process(pid)
+        if hwnds:
+            self._notify()
+
+# Below this, wait_until() spins instead of sleeping; covers timer granularity on Windows
+SPIN_THRESHOLD = 0.002
+
+def wait_until(deadline):
+    """Blocks until time.perf_counter() reaches deadline: sleeps for the bulk, spins the last stretch."""
+    while True:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return
+        if remaining > SPIN_THRESHOLD:
+            time.sleep(remaining - SPIN_THRESHOLD)
+        else:
+            time.sleep(0) # Yield the GIL while spinning
+
+class ClientHealth:
+    """Responsiveness of one DD2 window, as seen by HealthMonitor."""
+    __slots__ = ('state', 'latency', 'last_probe', 'good_probes')
+
+    def __init__(self):
+        self.state = 'ok' # 'ok', 'slow' or 'hung'
+        self.latency = 0.0 # Smoothed probe round trip, seconds
+        self.last_probe = None # Round trip of the last probe, None if it timed out
+        self.good_probes = 0 # Answered probes in a row, for recovery from 'hung'
+
+class HealthMonitor:
+    """
+    Probes each DD2 window's message queue from a background thread (backend.probe_window, bounded
+    by timeout_ms) and classifies it: 'ok', 'slow' (smoothed round trip over slow_ms) or 'hung' (a
+    probe timed out). A hung window needs `recover_after` answered probes in a row to come back.
+    Send, layout and activation paths ask is_hung() and leave hung windows alone.
+    """
+    def __init__(self, backend, get_hwnds, interval_ms=500, timeout_ms=200, slow_ms=50, recover_after=2,
+                 on_change=None, metrics=None):
+        self.backend = backend
+        self.get_hwnds = get_hwnds # Returns the windows to watch
+        self.interval_ms = interval_ms
+        self.timeout_ms = timeout_ms
+        self.slow_ms = slow_ms
+        self.recover_after = recover_after
+        self.on_change = on_change # Called as on_change(hwnd, old_state, new_state) from the monitor thread
+        self.metrics = metrics or Metrics(enabled=False)
+        self.enabled = True # False: nothing counts as hung (for comparison runs)
+        self.clients = {} # hwnd -> ClientHealth; replaced, never changed in place, so readers need no lock
+        self.stats = {'probes': 0, 'timeouts': 0, 'skipped_sends': 0, 'deferred_moves': 0, 'skipped_activations': 0}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="dd2-health")
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.probe_all()
+            self._stop.wait(self.interval_ms / 1000.0)
+
+    def state(self, hwnd):
+        client = self.clients.get(hwnd)
+        return client.state if client else 'ok'
+
+    def is_hung(self, hwnd):
+        client = self.clients.get(hwnd)
+        return self.enabled and client is not None and client.state == 'hung'
+
+    def responsive(self, hwnds):
+        """hwnds without the hung ones, in order."""
+        if not self.enabled:
+            return list(hwnds)
+        clients = self.clients
+        return [hwnd for hwnd in hwnds if getattr(clients.get(hwnd), 'state', 'ok') != 'hung']
+
+    def summary(self):
+        counts = {'ok': 0, 'slow': 0, 'hung': 0}
+        for client in list(self.clients.values()):
+            counts[client.state] += 1
+        return counts
+
+    def probe_all(self):
+        """One probe round over the current windows; forgets windows that are gone."""
+        hwnds = list(self.get_hwnds())
+        old = self.clients
+        clients = {hwnd: old.get(hwnd) or ClientHealth() for hwnd in hwnds}
+        self.clients = clients # Swapped in whole: send and shopping threads may be reading the old one
+        for hwnd, client in clients.items():
+            if self._stop.is_set():
+                return
+            self._probe(hwnd, client)
+
+    def _probe(self, hwnd, client):
+        round_trip = self.backend.probe_window(hwnd, self.timeout_ms)
+        self.stats['probes'] += 1
+        client.last_probe = round_trip
+        old = client.state
+        if round_trip is None:
+            self.stats['timeouts'] += 1
+            client.good_probes = 0
+            new = 'hung'
+        else:
+            self.metrics.record('health.probe', round_trip)
+            client.latency = round_trip if client.good_probes == 0 else 0.7 * client.latency + 0.3 * round_trip
+            client.good_probes += 1
+            if old == 'hung' and client.good_probes < self.recover_after:
+                new = 'hung'
+            else:
+                new = 'slow' if client.latency * 1000 > self.slow_ms else 'ok'
+        if new != old:
+            client.state = new
+            if self.on_change:
+                self.on_change(hwnd, old, new)
+
+class LatencyHistogram:
+    """
+    Log-linear latency histogram: each power of two (in microseconds) is split into SUB_BUCKETS
+    linear buckets, so percentiles are accurate to ~12% while record() stays allocation-free.
+    """
+    SUB_BUCKETS = 8
+    MAX_EXPONENT = 40 # 2**40 us is ~12 days
+
+    def __init__(self):
+        self.counts = [0] * ((self.MAX_EXPONENT + 1) * self.SUB_BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+
+    def record(self, seconds):
+        us = seconds * 1e6
+        if us < 1.0:
+            index = 0
+        else:
+            mantissa, exponent = math.frexp(us) # us = mantissa * 2**exponent, 0.5 <= mantissa < 1
+            index = min(exponent * self.SUB_BUCKETS + int((mantissa * 2 - 1) * self.SUB_BUCKETS), len(self.counts) - 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def _bucket_upper(self, index):
+        """Upper bound of a bucket, in seconds."""
+        if index == 0:
+            return 1e-6
+        exponent, sub = divmod(index, self.SUB_BUCKETS)
+        return 2.0 ** (exponent - 1) * (1 + (sub + 1) / self.SUB_BUCKETS) / 1e6
+
+    def percentile(self, p):
+        """Approximate p-th percentile (0-100) in seconds."""
+        if not self.count:
+            return 0.0
+        target = max(1, math.ceil(self.count * p / 100.0))
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return min(self._bucket_upper(index), self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def merge(self, other):
+        for index, n in enumerate(other.counts):
+            self.counts[index] += n
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+
+    def reset(self):
+        self.__init__()
+
+    def rows(self):
+        """Returns (bucket upper bound in seconds, count) for every non-empty bucket."""
+        return [(self._bucket_upper(i), n) for i, n in enumerate(self.counts) if n]
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.mean * 1e3,
+            'min_ms': (self.min or 0.0) * 1e3,
+            'p50_ms': self.percentile(50) * 1e3,
+            'p90_ms': self.percentile(90) * 1e3,
+            'p99_ms': self.percentile(99) * 1e3,
+            'max_ms': self.max * 1e3,
+        }
+
+class _Probe:
+    """Context manager that records the time spent in its block."""
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.record(time.perf_counter() - self.start)
+        return False
+
+class _NullProbe:
+    """Stand-in returned by Metrics.probe() while probes are off."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_PROBE = _NullProbe()
+
+class Metrics:
+    """
+    Named latency histograms (and small value distributions, e.g. retry counts) for the hot
+    paths. With probes disabled, probe() and record() cost a single attribute check.
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._histograms = {} # name -> LatencyHistogram
+        self._values = {} # name -> {value: count}
+        self._lock = threading.Lock() # Only guards creating names and values; recording relies on the GIL
+
+    def histogram(self, name):
+        hist = self._histograms.get(name)
+        if hist is None:
+            with self._lock:
+                hist = self._histograms.setdefault(name, LatencyHistogram())
+        return hist
+
+    def attach(self, name, histogram):
+        """Exposes a histogram owned by another component (it keeps recording regardless of enabled)."""
+        with self._lock:
+            self._histograms[name] = histogram
+
+    def probe(self, name):
+        """`with metrics.probe('apply_layout'):` times the block."""
+        if not self.enabled:
+            return _NULL_PROBE
+        return _Probe(self.histogram(name))
+
+    def record(self, name, seconds):
+        if self.enabled:
+            self.histogram(name).record(seconds)
+
+    def count(self, name, value):
+        """Adds one observation of a discrete value (e.g. an attempt count)."""
+        if self.enabled:
+            values = self._values.get(name)
+            if values is None or value not in values: # New keys under the lock: snapshot() copies these dicts
+                with self._lock:
+                    values = self._values.setdefault(name, {})
+                    values[value] = values.get(value, 0) + 1
+                return
+            values[value] += 1
+
+    def reset(self):
+        with self._lock:
+            for hist in self._histograms.values():
+                hist.reset()
+            self._values.clear()
+
+    def snapshot(self):
+        """Returns {'histograms': {name: summary}, 'values': {name: {value: count}}}."""
+        with self._lock:
+            histograms = dict(self._histograms)
+            values = {name: dict(counts) for name, counts in self._values.items()}
+        return {
+            'histograms': {name: hist.summary() for name, hist in sorted(histograms.items()) if hist.count},
+            'values': values,
+        }
+
+    def export_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=4, default=str)
+
+    def export_csv(self, path):
+        snapshot = self.snapshot()
+        columns = ['count', 'mean_ms', 'min_ms', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms']
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['name'] + columns)
+            for name, summary in snapshot['histograms'].items():
+                writer.writerow([name] + [round(summary[c], 4) if c != 'count' else summary[c] for c in columns])
+            for name, counts in snapshot['values'].items():
+                for value, n in sorted(counts.items(), key=lambda item: str(item[0])):
+                    writer.writerow([f"{name}={value}", n] + [''] * (len(columns) - 1))
+
+class KeyBroadcaster:
+    """
+    Sends keys to many windows in parallel: every key-down is posted, one hold interval is
+    waited against a monotonic deadline, then every key-up is posted. K keys to N windows
+    therefore take about K hold intervals instead of K x N.
+    """
+    def __init__(self, backend, hold_ms=20, metrics=None):
+        self.backend = backend
+        self.hold_ms = hold_ms
+        self.metrics = metrics or Metrics(enabled=False)
+
+    def broadcast(self, hwnds, vk_codes, requested_at=None):
+        """
+        Sends each vk code in order to all hwnds. Returns the hwnds whose posts failed.
+        `requested_at` (perf_counter time of the triggering hotkey) feeds the hotkey -> first post probe.
+        """
+        hold = self.hold_ms / 1000.0
+        post = self.backend.post_message
+        metrics = self.metrics
+        targets = list(hwnds)
+        failed = []
+        for vk_code in vk_codes:
+            down_lparam, up_lparam = VK_LPARAMS.get(vk_code, (0, 0))
+            pressed = []
+            for hwnd in targets:
+                if metrics.enabled:
+                    start = time.perf_counter()
+                    ok = post(hwnd, WM_KEYDOWN, vk_code, down_lparam)
+                    now = time.perf_counter()
+                    metrics.record('send_per_window', now - start)
+                    if requested_at is not None and ok:
+                        metrics.record('hotkey_to_first_post', now - requested_at)
+                        requested_at = None
+                else:
+                    ok = post(hwnd, WM_KEYDOWN, vk_code, down_lparam)
+                if ok:
+                    pressed.append(hwnd)
+                else:
+                    failed.append(hwnd)
+            if not pressed:
+                break
+            wait_until(time.perf_counter() + hold) # Every window gets at least the full hold
+            for hwnd in pressed:
+                post(hwnd, WM_KEYUP, vk_code, up_lparam)
+            targets = pressed # Don't keep posting to windows that have gone away
+        return failed
+
+# (mouse button, down) -> (message, wParam) for replaying clicks with PostMessage
+MOUSE_MESSAGES = {
+    (0, True): (WM_LBUTTONDOWN, MK_LBUTTON),
+    (0, False): (WM_LBUTTONUP, 0),
+    (1, True): (WM_RBUTTONDOWN, MK_RBUTTON),
+    (1, False): (WM_RBUTTONUP, 0),
+}
+
+class MacroTimeline:
+    """
+    Recorded input stored as parallel typed arrays, one entry per event: offset in seconds from
+    the first event, kind (KEY or MOUSE), vk code or mouse button, down flag, and the mouse
+    position as a fraction of the recorded window, so a click replays onto any window size.
+
+    File format (little-endian): magic b'DD2M', uint16 version, uint32 event count, then each
+    field array in _FIELDS order.
+    """
+    KEY, MOUSE = 0, 1
+    MAGIC = b'DD2M'
+    VERSION = 1
+    _HEADER = struct.Struct('<4sHI')
+    _FIELDS = (('times', 'd'), ('kinds', 'B'), ('codes', 'H'), ('downs', 'B'), ('xs', 'f'), ('ys', 'f'))
+
+    def __init__(self):
+        for name, typecode in self._FIELDS:
+            setattr(self, name, array.array(typecode))
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def duration(self):
+        return self.times[-1] if self.times else 0.0
+
+    def append(self, offset, kind, code, down, x=0.0, y=0.0):
+        self.times.append(offset)
+        self.kinds.append(kind)
+        self.codes.append(code)
+        self.downs.append(1 if down else 0)
+        self.xs.append(x)
+        self.ys.append(y)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self._HEADER.pack(self.MAGIC, self.VERSION, len(self)))
+            for name, _ in self._FIELDS:
+                data = getattr(self, name)
+                if sys.byteorder == 'big':
+                    data = array.array(data.typecode, data)
+                    data.byteswap()
+                data.tofile(f)
+
+    @classmethod
+    def load(cls, path):
+        """Reads a file written by save(). Raises ValueError for anything else (EOFError if truncated)."""
+        timeline = cls()
+        with open(path, 'rb') as f:
+            magic, version, count = cls._HEADER.unpack(f.read(cls._HEADER.size))
+            if magic != cls.MAGIC or version != cls.VERSION:
+                raise ValueError(f"{path} is not a version {cls.VERSION} macro file")
+            for name, _ in cls._FIELDS:
+                data = getattr(timeline, name)
+                data.fromfile(f, count)
+                if sys.byteorder == 'big':
+                    data.byteswap()
+        return timeline
+
+class MacroRecorder:
+    """
+    Records the key and mouse button events that happen while one window is in the foreground.
+    Clicks outside that window and vk codes in `ignore_vk` (the record/replay hotkeys) are dropped.
+    """
+    def __init__(self, backend, ignore_vk=()):
+        self.backend = backend
+        self.ignore_vk = frozenset(ignore_vk)
+        self.timeline = None
+        self.hwnd = None
+        self._rect = None
+        self._started = None # perf_counter of the first recorded event
+        self._handle = None
+
+    @property
+    def recording(self):
+        return self._handle is not None
+
+    def start(self, hwnd):
+        self.hwnd = hwnd
+        self._rect = self.backend.get_client_rect(hwnd) # Clicks are kept relative to the client area, which replay posts to
+        self.timeline = MacroTimeline()
+        self._started = None
+        self._handle = self.backend.hook_input(self._on_input)
+
+    def stop(self):
+        """Stops recording and returns the timeline."""
+        if self._handle is not None:
+            self.backend.unhook_input(self._handle)
+            self._handle = None
+        return self.timeline
+
+    def _on_input(self, kind, code, down, x, y):
+        # Hook thread: keep it short, the OS drops hooks that take too long
+        now = time.perf_counter()
+        if self.backend.get_foreground_window() != self.hwnd:
+            return
+        if kind == 'key':
+            if code in self.ignore_vk:
+                return
+            event = (MacroTimeline.KEY, code, down)
+        else:
+            left, top, right, bottom = self._rect
+            if not (left <= x < right and top <= y < bottom):
+                return
+            event = (MacroTimeline.MOUSE, code, down, (x - left) / (right - left), (y - top) / (bottom - top))
+        if self._started is None:
+            self._started = now
+        self.timeline.append(now - self._started, *event)
+
+class MacroPlayer:
+    """
+    Replays a MacroTimeline into any set of windows with PostMessage, on its own thread. Each event
+    goes to every target at start + offset / speed, reached by sleeping and then spinning the last
+    stretch (like wait_until), so timing stays well under a millisecond. How late each event was
+    posted is recorded as 'macro.lateness'. Keys or buttons still held when a replay is stopped
+    are released.
+    """
+    def __init__(self, backend, metrics=None):
+        self.backend = backend
+        self.metrics = metrics or Metrics(enabled=False)
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def play(self, timeline, hwnds, speed=1.0, on_done=None):
+        """Starts a replay, stopping any running one. on_done(completed, failed_hwnds) runs on the replay thread."""
+        self.stop()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(timeline, list(hwnds), speed, self._stop, on_done),
+                                        daemon=True, name="dd2-macro")
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self.running and self._thread is not threading.current_thread():
+            self._thread.join(1.0)
+
+    def _run(self, timeline, hwnds, speed, stop, on_done):
+        post = self.backend.post_message
+        record = self.metrics.record
+        sizes = {}
+        for hwnd in hwnds:
+            left, top, right, bottom = self.backend.get_client_rect(hwnd) # Mouse lparams are client coordinates
+            sizes[hwnd] = (right - left, bottom - top)
+        targets = list(hwnds)
+        failed = []
+        held = {} # (kind, code) -> message releasing it
+        times, kinds, codes, downs, xs, ys = (timeline.times, timeline.kinds, timeline.codes, timeline.downs,
+                                              timeline.xs, timeline.ys)
+        completed = False
+        start = time.perf_counter()
+        try:
+            for i in range(len(times)):
+                due = start + times[i] / speed
+                while True: # Sleep in short slices so stop() is noticed, then spin to the deadline
+                    remaining = due - time.perf_counter()
+                    if remaining <= SPIN_THRESHOLD or stop.is_set():
+                        break
+                    time.sleep(min(remaining - SPIN_THRESHOLD, 0.05))
+                if stop.is_set():
+                    return
+                wait_until(due)
+                record('macro.lateness', time.perf_counter() - due)
+
+                code, down = codes[i], bool(downs[i])
+                if kinds[i] == MacroTimeline.KEY:
+                    msg, wparam = (WM_KEYDOWN if down else WM_KEYUP), code
+                    lparam = VK_LPARAMS.get(code, (0, 0))[0 if down else 1]
+                    messages = [(hwnd, msg, wparam, lparam) for hwnd in targets]
+                    release = WM_KEYUP, code, None
+                else:
+                    msg, wparam = MOUSE_MESSAGES[code, down]
+                    messages = []
+                    for hwnd in targets:
+                        width, height = sizes[hwnd]
+                        x, y = int(xs[i] * width), int(ys[i] * height)
+                        messages.append((hwnd, msg, wparam, (y << 16) | (x & 0xFFFF)))
+                    release = MOUSE_MESSAGES[code, False][0], 0, (xs[i], ys[i])
+                for hwnd, msg, wparam, lparam in messages:
+                    if not post(hwnd, msg, wparam, lparam):
+                        failed.append(hwnd)
+                        targets.remove(hwnd) # Gone or hung; don't keep posting to it
+                if down:
+                    held[kinds[i], code] = release
+                else:
+                    held.pop((kinds[i], code), None)
+            completed = True
+        finally:
+            for msg, wparam, pos in held.values():
+                for hwnd in targets:
+                    lparam = VK_LPARAMS.get(wparam, (0, 0))[1]
+                    if pos:
+                        width, height = sizes[hwnd]
+                        lparam = (int(pos[1] * height) << 16) | (int(pos[0] * width) & 0xFFFF)
+                    post(hwnd, msg, wparam, lparam)
+            if on_done:
+                on_done(completed, failed)
+
+class ClickMirror:
+    """
+    Mirrors mouse clicks made in the main window into every secondary window. The input hook only
+    timestamps and queues each button event; a worker thread maps it through the cached client
+    rects (set with set_rects after every layout) to each secondary's client coordinates and posts
+    it there. Hook event -> last post is recorded as 'mirror.latency'.
+    """
+    def __init__(self, backend, is_hung=None, get_foreground=None, metrics=None):
+        self.backend = backend
+        self.is_hung = is_hung or (lambda hwnd: False) # Hung secondaries are skipped, their queues are full enough
+        self.get_foreground = get_foreground or backend.get_foreground_window # Cheap cached reads preferred
+        self.metrics = metrics or Metrics(enabled=False)
+        self.paused = False # Set while the app clicks in the main window itself (auto-shopping)
+        self.stats = {'mirrored': 0, 'ignored': 0, 'posts': 0, 'failed_posts': 0}
+        self._main = None # (hwnd, client rect)
+        self._targets = () # (hwnd, x scale, y scale) per secondary: its client size over the main window's
+        self._queue = queue.SimpleQueue()
+        self._handle = None
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._handle is not None
+
+    def set_rects(self, main_hwnd, client_rects):
+        """Caches the main window and the secondaries' client rects (screen coordinates), e.g. after a layout."""
+        main_rect = client_rects.get(main_hwnd)
+        if not main_rect:
+            self._main, self._targets = None, ()
+            return
+        width, height = max(1, main_rect[2] - main_rect[0]), max(1, main_rect[3] - main_rect[1])
+        targets = tuple((hwnd, (right - left) / width, (bottom - top) / height)
+                        for hwnd, (left, top, right, bottom) in client_rects.items() if hwnd != main_hwnd)
+        self._main, self._targets = (main_hwnd, main_rect), targets # Swapped in one assignment each; the worker reads a consistent pair
+
+    def start(self):
+        if self._handle is not None:
+            return
+        # Hooked first: if that raises, no worker is left blocked on the queue
+        self._handle = self.backend.hook_input(self._on_input, keys=False) # Only clicks are mirrored: no keyboard hook
+        self._thread = threading.Thread(target=self._run, daemon=True, name="dd2-mirror")
+        self._thread.start()
+
+    def stop(self):
+        if self._handle is None:
+            return
+        self.backend.unhook_input(self._handle)
+        self._handle = None
+        self._queue.put(None)
+        self._thread.join(1.0)
+        self._thread = None
+
+    def _on_input(self, kind, code, down, x, y):
+        # Hook thread: only timestamp and queue
+        if kind == 'mouse':
+            self._queue.put((time.perf_counter(), code, down, x, y))
+
+    def _run(self):
+        get, post, record = self._queue.get, self.backend.post_message, self.metrics.record
+        while True:
+            event = get()
+            if event is None:
+                return
+            hooked_at, code, down, x, y = event
+            main, targets = self._main, self._targets
+            if main is None or self.paused or (code, down) not in MOUSE_MESSAGES:
+                continue
+            main_hwnd, (left, top, right, bottom) = main
+            if not (left <= x < right and top <= y < bottom) or self.get_foreground() != main_hwnd:
+                self.stats['ignored'] += 1
+                continue
+            msg, wparam = MOUSE_MESSAGES[code, down]
+            dx, dy = x - left, y - top
+            for hwnd, x_scale, y_scale in targets:
+                if self.is_hung(hwnd):
+                    continue
+                lparam = (int(dy * y_scale) << 16) | (int(dx * x_scale) & 0xFFFF)
+                if down: # Games read the pointer from the last move as often as from the click itself
+                    post(hwnd, WM_MOUSEMOVE, 0, lparam)
+                if post(hwnd, msg, wparam, lparam):
+                    self.stats['posts'] += 1
+                else:
+                    self.stats['failed_posts'] += 1
+            self.stats['mirrored'] += 1
+            record('mirror.latency', time.perf_counter() - hooked_at)
+
+class RegionWatcher:
+    """
+    Tells when a small screen region has reacted to input: it differs from a reference captured
+    just before the input, and has then held still between two samples. The three capture buffers
+    are allocated once and reused; comparisons are vectorized with numpy (see _load_numpy).
+    """
+    def __init__(self, backend, size=48, pixel_tolerance=24, change_fraction=0.05):
+        self.backend = backend
+        self.size = size
+        self.pixel_tolerance = pixel_tolerance # Per-channel difference that counts as a changed pixel
+        self.change_fraction = change_fraction # Share of changed pixels that counts as a changed region
+        self.rect = None
+        self._reference = numpy.zeros((size, size, 4), numpy.uint8)
+        self._current = numpy.zeros_like(self._reference)
+        self._previous = numpy.zeros_like(self._reference)
+        self._diff = numpy.zeros((size, size, 3), numpy.int16)
+        self._mask = numpy.zeros((size, size, 3), bool)
+        self._changed = False
+        self.captures = 0
+
+    def watch(self, x, y):
+        """Centers the region on (x, y). Call rearm() before each input."""
+        half = self.size // 2
+        self.rect = (x - half, y - half, x - half + self.size, y - half + self.size)
+        self.rearm()
+
+    def rearm(self):
+        """Captures the reference the next poll() is compared against."""
+        self.backend.capture_region(self.rect, self._reference)
+        self._previous[...] = self._reference
+        self._changed = False
+
+    def _changed_share(self, a, b):
+        # Alpha is ignored; a pixel changed if any colour channel moved by more than the tolerance
+        numpy.subtract(a[..., :3], b[..., :3], out=self._diff, dtype=numpy.int16)
+        numpy.abs(self._diff, out=self._diff)
+        numpy.greater(self._diff, self.pixel_tolerance, out=self._mask)
+        return numpy.count_nonzero(self._mask.any(axis=2)) / (self.size * self.size)
+
+    def poll(self):
+        """Takes one sample; True once the region has changed from the reference and then settled."""
+        self.backend.capture_region(self.rect, self._current)
+        self.captures += 1
+        settled = False
+        if not self._changed:
+            self._changed = self._changed_share(self._current, self._reference) >= self.change_fraction
+        else:
+            settled = self._changed_share(self._current, self._previous) < self.change_fraction
+        self._current, self._previous = self._previous, self._current
+        return settled
+
+def _gray(bgra):
+    """Luma of a BGRA capture, as float32."""
+    return (bgra[..., 0] * numpy.float32(0.114) + bgra[..., 1] * numpy.float32(0.587) +
+            bgra[..., 2] * numpy.float32(0.299))
+
+def _downscale(gray, factor):
+    """Area average over factor x factor blocks (edges that don't fill a block are dropped)."""
+    if factor <= 1:
+        return gray
+    height, width = gray.shape[0] // factor * factor, gray.shape[1] // factor * factor
+    return gray[:height, :width].reshape(height // factor, factor, width // factor, factor).mean(axis=(1, 3))
+
+def _resize(image, height, width):
+    """Nearest-neighbour resize of a 2-D array (templates are small; this only needs to be cheap)."""
+    rows = (numpy.arange(height) * image.shape[0] / height).astype(numpy.intp)
+    cols = (numpy.arange(width) * image.shape[1] / width).astype(numpy.intp)
+    return image[rows[:, None], cols]
+
+def match_template(image, template):
+    """
+    Normalized cross-correlation of `template` at every position of `image` (2-D arrays): a score map
+    of shape (H - h + 1, W - w + 1) in [-1, 1]. The correlation is one FFT product and the per-window
+    image statistics come from integral images, so the cost doesn't grow with the template size.
+    """
+    height, width = template.shape
+    rows, cols = image.shape[0] - height + 1, image.shape[1] - width + 1
+    if rows < 1 or cols < 1:
+        raise ValueError("template is larger than the image")
+    image = image.astype(numpy.float64)
+    template = template - template.mean()
+    template_norm = numpy.sqrt((template * template).sum())
+    spectrum = numpy.fft.rfft2(image) * numpy.conj(numpy.fft.rfft2(template, s=image.shape))
+    correlation = numpy.fft.irfft2(spectrum, s=image.shape)[:rows, :cols] # No wrap-around in the valid region
+
+    def window_sums(values):
+        integral = numpy.zeros((values.shape[0] + 1, values.shape[1] + 1))
+        numpy.cumsum(numpy.cumsum(values, axis=0), axis=1, out=integral[1:, 1:])
+        return (integral[height:, width:] - integral[:-height, width:] -
+                integral[height:, :-width] + integral[:-height, :-width])
+
+    sums = window_sums(image)
+    variance = window_sums(image * image) - sums * sums / (height * width)
+    denominator = numpy.sqrt(numpy.maximum(variance, 0)) * template_norm
+    scores = numpy.zeros_like(correlation)
+    numpy.divide(correlation, denominator, out=scores, where=denominator > 1e-6) # Flat regions score 0
+    return scores
+
+def _correlation(a, b):
+    """Normalized cross-correlation of two same-shaped arrays: match_template at a single position."""
+    a, b = a - a.mean(), b - b.mean()
+    denominator = numpy.sqrt((a * a).sum() * (b * b).sum())
+    return float((a * b).sum() / denominator) if denominator > 1e-6 else 0.0
+
+def find_peaks(scores, count, spacing, threshold):
+    """Up to `count` best (row, col, score) at least `spacing` (rows, cols) apart, best first, all >= threshold."""
+    scores = scores.copy()
+    peaks = []
+    for _ in range(count):
+        row, col = divmod(int(scores.argmax()), scores.shape[1])
+        score = float(scores[row, col])
+        if score < threshold:
+            break
+        peaks.append((row, col, score))
+        scores[max(0, row - spacing[0] + 1):row + spacing[0], max(0, col - spacing[1] + 1):col + spacing[1]] = -numpy.inf
+    return peaks
+
+class ShopCalibrator:
+    """
+    Finds the shop slots and utility buttons in a capture of the main window by template matching:
+    a coarse search on images downscaled by `factor`, refined at full resolution around each hit.
+    The two templates are cut from a capture where the boxes were placed by hand (save_templates);
+    other window sizes use them rescaled. Rescaled templates and match results are cached per window
+    size, so recalibrating at a known size only re-checks the cached spots.
+    Positions are the clicked points, (x, y) relative to the window's top-left corner.
+    """
+    VERSION = 1
+    KINDS = (('shopping_boxes', 'slot'), ('utility_boxes', 'utility'))
+
+    def __init__(self, path, template_size=48, factor=4, threshold=0.6):
+        self.path = path
+        self.template_size = template_size # Pixels cut around a box, at the reference window size
+        self.factor = factor
+        self.threshold = threshold # Minimum normalized correlation for a match
+        self.templates = None # {'slot': gray array, 'utility': gray array}, cut at reference_size
+        self.reference_size = None # (width, height) of the window the templates were cut from
+        self.results = {} # (width, height) -> {'shopping_boxes': [(x, y), ...], 'utility_boxes': [...]}
+        self._scaled = {} # (width, height) -> {name: (full resolution template, downscaled template)}
+        self.stats = {'searches': 0, 'cache_hits': 0}
+
+    def load(self):
+        """Reads templates and cached results. Returns False if there is no calibration file yet."""
+        if not os.path.exists(self.path):
+            return False
+        with numpy.load(self.path) as data:
+            if int(data['version']) > self.VERSION:
+                raise ValueError(f"calibration file version {int(data['version'])} is newer than {self.VERSION}")
+            self.templates = {'slot': data['slot'], 'utility': data['utility']}
+            self.reference_size = tuple(int(v) for v in data['reference_size'])
+            results = json.loads(str(data['results']))
+        self.results = {tuple(int(v) for v in size.split('x')): {kind: [tuple(p) for p in positions]
+                                                                 for kind, positions in found.items()}
+                        for size, found in results.items()}
+        self._scaled.clear()
+        return True
+
+    def save(self):
+        """Atomic write, like ProfileStore.save."""
+        results = {f"{w}x{h}": found for (w, h), found in self.results.items()}
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(prefix='.calibration-', suffix='.npz', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                numpy.savez(f, version=self.VERSION, reference_size=numpy.array(self.reference_size),
+                            slot=self.templates['slot'], utility=self.templates['utility'], results=json.dumps(results))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+        except BaseException:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+
+    def save_templates(self, capture, positions):
+        """Cuts the templates around the first shopping box and first utility box of `positions`."""
+        gray = _gray(capture)
+        half = self.template_size // 2
+        templates = {}
+        for kind, name in self.KINDS:
+            x, y = positions[kind][0]
+            if not (half <= x <= gray.shape[1] - half and half <= y <= gray.shape[0] - half):
+                raise ValueError(f"the first of the {kind.replace('_', ' ')} is too close to the window edge")
+            templates[name] = gray[y - half:y + half, x - half:x + half].copy()
+        self.templates = templates
+        self.reference_size = (capture.shape[1], capture.shape[0])
+        self.results = {self.reference_size: {kind: [tuple(p) for p in positions[kind]] for kind, _ in self.KINDS}}
+        self._scaled.clear()
+
+    def _templates_for(self, size):
+        """Templates rescaled to a window size (UI scales with the window height), cached per size."""
+        if size not in self._scaled:
+            ratio = size[1] / self.reference_size[1]
+            scaled = {}
+            for name, template in self.templates.items():
+                full = _resize(template, max(self.factor * 2, round(template.shape[0] * ratio)),
+                               max(self.factor * 2, round(template.shape[1] * ratio)))
+                scaled[name] = (full, _downscale(full, self.factor))
+            self._scaled[size] = scaled
+        return self._scaled[size]
+
+    def _verify(self, capture, templates, found):
+        """True if every cached position still matches its template (only those patches are converted)."""
+        for kind, name in self.KINDS:
+            full = templates[name][0]
+            height, width = full.shape
+            for x, y in found[kind]:
+                top, left = y - height // 2, x - width // 2
+                patch = _gray(capture[max(0, top):top + height, max(0, left):left + width])
+                if patch.shape != full.shape or _correlation(patch, full) < self.threshold:
+                    return False
+        return True
+
+    @staticmethod
+    def _reading_order(positions, row_gap):
+        """Row by row, left to right; a position starts a new row if it is more than row_gap below the last one."""
+        rows = []
+        for position in sorted(positions, key=lambda p: p[1]):
+            if rows and position[1] - rows[-1][-1][1] <= row_gap:
+                rows[-1].append(position)
+            else:
+                rows.append([position])
+        return [position for row in rows for position in sorted(row)]
+
+    def locate(self, capture, counts):
+        """
+        Positions of counts['shopping_boxes'] slots and counts['utility_boxes'] buttons in a window
+        capture (BGRA, shape (height, width, 4)). Slots are numbered row by row, buttons left to right.
+        Raises ValueError if not all of them are found.
+        """
+        if self.templates is None:
+            raise ValueError("no templates yet")
+        size = (capture.shape[1], capture.shape[0])
+        templates = self._templates_for(size)
+        cached = self.results.get(size)
+        if cached and all(len(cached[kind]) == counts[kind] for kind, _ in self.KINDS) and self._verify(capture, templates, cached):
+            self.stats['cache_hits'] += 1
+            return cached
+
+        self.stats['searches'] += 1
+        gray = _gray(capture)
+        small = _downscale(gray, self.factor)
+        found = {}
+        for kind, name in self.KINDS:
+            full, coarse = templates[name]
+            height, width = full.shape
+            peaks = find_peaks(match_template(small, coarse), counts[kind], coarse.shape, self.threshold * 0.8)
+            positions = []
+            for row, col, _ in peaks:
+                # Refine within one coarse pixel around the hit, at full resolution
+                top, left = max(0, row * self.factor - self.factor), max(0, col * self.factor - self.factor)
+                region = gray[top:top + height + 2 * self.factor, left:left + width + 2 * self.factor]
+                scores = match_template(region, full)
+                fine_row, fine_col = divmod(int(scores.argmax()), scores.shape[1])
+                if scores[fine_row, fine_col] >= self.threshold:
+                    positions.append((left + fine_col + width // 2, top + fine_row + height // 2))
+            if len(positions) < counts[kind]:
+                raise ValueError(f"found {len(positions)} of {counts[kind]} {kind.replace('_', ' ')}")
+            found[kind] = self._reading_order(positions, height // 2) if kind == 'shopping_boxes' else sorted(positions)
+        self.results[size] = found
+        return found
+
+# The auto-shopping routine as data. Each step is (primitive, *args), run by the ShoppingRun
+# method of the same name; times are in ms. 'settle' waits for the box region to react (see
+# RegionWatcher), with its argument as the upper bound.
+SHOPPING_SCRIPT = {
+    'cycles': 3,
+    'utility_boxes': (2, 3), # Utility box clicked after each pass over the boxes, alternating
+    'start': (('activate_main',), ('wait', 100)),
+    'box': (('move', 'box'), ('settle', 100),
+            ('press', 'enter'), ('settle', 1000),
+            ('press', 'enter'), ('settle', 1000),
+            ('press', 'enter'), ('settle', 15000)),
+    'after_boxes': (('wait', 100),),
+    'utility': (('save_cursor',), ('activate_main',), ('wait', 50),
+                ('move', 'utility'), ('wait', 100), ('click',), ('wait', 500), ('restore_cursor',)),
+    'between_cycles': (('wait', 1000),),
+}
+
+class AutomationEngine:
+    """
+    Runs automation routines as coroutines on an asyncio loop in its own thread, so their waits
+    never block Tk. Steps that must touch Tk go through in_gui(); cancel() stops the running
+    routine at whatever it is awaiting, without waiting for a delay to run out.
+    """
+    def __init__(self, call_in_gui):
+        self.call_in_gui = call_in_gui # Runs func(*args) on the Tk thread (WindowManager._call_in_gui)
+        self._loop = None
+        self._thread = None
+        self._future = None # concurrent.futures.Future of the current routine
+
+    def start(self):
+        global asyncio
+        import asyncio
+        if self._thread and self._thread.is_alive():
+            return
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True, name="dd2-automation")
+        self._thread.start()
+
+    def stop(self):
+        self.cancel()
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(1.0)
+            self._loop = self._thread = None
+
+    @property
+    def running(self):
+        return self._future is not None and not self._future.done()
+
+    def submit(self, coro):
+        """Runs coro as the current routine, cancelling any earlier one. Returns its concurrent Future."""
+        self.start()
+        self.cancel()
+        self._future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        return self._future
+
+    def cancel(self):
+        if self._future:
+            self._future.cancel()
+
+    async def in_gui(self, func, *args):
+        """Runs func(*args) on the Tk thread and returns its result, without blocking the loop."""
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+
+        def run():
+            try:
+                result, error = func(*args), None
+            except Exception as e:
+                result, error = None, e
+            loop.call_soon_threadsafe(self._resolve, done, result, error)
+
+        self.call_in_gui(run)
+        return await done
+
+    @staticmethod
+    def _resolve(future, result, error):
+        if future.done(): # Cancelled while the Tk side was running
+            return
+        if error:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+class ShoppingRun:
+    """
+    One auto-shopping run on the AutomationEngine loop, interpreting a script like SHOPPING_SCRIPT.
+    Primitives are the coroutine methods named in PRIMITIVES; none of them blocks the loop.
+    """
+    PRIMITIVES = ('move', 'click', 'press', 'wait', 'settle', 'activate_main', 'save_cursor', 'restore_cursor')
+
+    def __init__(self, app, script, watch=None):
+        unknown = {step[0] for part in script.values() if isinstance(part, tuple) and part and isinstance(part[0], tuple)
+                   for step in part} - set(self.PRIMITIVES)
+        if unknown:
+            raise ValueError(f"unknown automation primitive(s): {', '.join(sorted(unknown))}")
+        self.app = app
+        self.backend = app.backend
+        self.engine = app.automation
+        self.script = script
+        self.watch = watch # RegionWatcher for adaptive 'settle', or None for fixed delays
+        self.hwnd = None # Window this run drives; None is whichever window is main
+        self.prefix = "" # Start of this run's status lines
+        self.box_index = 0
+        self.utility_box = None
+        self.saved_cursor = None
+        self._fixed_ms = 0 # Fixed-schedule time of the box in progress, from its 'settle' bounds
+
+    async def run(self):
+        app, script = self.app, self.script
+        boxes = app.box_positions['shopping_boxes']
+        prefix = self.prefix
+        try:
+            await self.run_steps(script['start'])
+            for cycle in range(script['cycles']):
+                for self.box_index in range(len(boxes)):
+                    x, y = self.box_point('box')
+                    app.update_status(f"{prefix}Auto-shopping at box {self.box_index + 1}: ({x}, {y})")
+                    app._note_shopping_progress(self.hwnd, f"box {self.box_index + 1}/{len(boxes)}, cycle {cycle + 1}/{script['cycles']}")
+                    started, self._fixed_ms = time.perf_counter(), 0
+                    await self.run_steps(script['box'])
+                    self.report_box(time.perf_counter() - started)
+                app.update_status(f"{prefix}All shopping boxes processed in this cycle.")
+                await self.run_steps(script['after_boxes'])
+
+                self.utility_box = script['utility_boxes'][cycle % len(script['utility_boxes'])]
+                if 1 <= self.utility_box <= len(app.box_positions.get('utility_boxes') or ()):
+                    app.update_status(f"{prefix}Interacting with Utility Box {self.utility_box}.")
+                    app._note_shopping_progress(self.hwnd, f"utility {self.utility_box}, cycle {cycle + 1}/{script['cycles']}")
+                    await self.run_steps(script['utility'])
+                else:
+                    app.update_status(f"{prefix}Error: Utility box #{self.utility_box} is not available.")
+                if cycle + 1 < script['cycles']:
+                    app.update_status(f"{prefix}Restarting shopping sequence from box 1.")
+                    await self.run_steps(script['between_cycles'])
+            app._note_shopping_progress(self.hwnd, "done")
+            app.update_status(f"{prefix}Completed all shopping and utility box interactions. Stopping auto-shopping.")
+            if self.hwnd is None:
+                app.update_status(f"Adaptive pacing saved {app.shopping_time_saved:.1f}s over the fixed schedule.")
+        finally:
+            if app.original_cursor_pos and self.hwnd is None: # Also on cancel: hand the cursor back where it was
+                self.backend.set_cursor_pos(app.original_cursor_pos)
+
+    def box_point(self, target):
+        """Screen position of the current 'box' or (centered) 'utility' box in the main window."""
+        if target == 'box':
+            pos = self.app.box_positions['shopping_boxes'][self.box_index]
+            return pos['x'], pos['y']
+        pos = self.app.box_positions['utility_boxes'][self.utility_box - 1]
+        half = ShoppingOverlay.UTILITY_SIZE // 2 # Utility boxes are clicked in the middle, like the overlay draws them
+        return pos['x'] + half, pos['y'] + half
+
+    def report_box(self, elapsed):
+        self.app._report_shopping_box(self.box_index, elapsed, self._fixed_ms)
+
+    async def run_steps(self, steps):
+        for name, *args in steps:
+            with self.app.metrics.probe(f"automation.{name}"):
+                await getattr(self, name)(*args)
+
+    # --- Primitives ---
+    async def move(self, target):
+        """Moves the cursor to the current 'box' (and watches its region) or the current 'utility' box."""
+        x, y = self.box_point(target)
+        if target == 'box' and self.watch:
+            self.watch.watch(x, y)
+        self.backend.set_cursor_pos((x, y))
+
+    async def click(self):
+        self.backend.click()
+
+    async def press(self, key_name):
+        if self.watch and self.watch.rect:
+            self.watch.rearm() # Reference frame from just before the input
+        self.backend.press_key(key_name)
+
+    async def wait(self, ms):
+        await asyncio.sleep(ms / 1000.0)
+
+    async def settle(self, timeout_ms):
+        """Waits until the watched region has reacted and settled; timeout_ms is the upper bound (and the fixed delay)."""
+        self._fixed_ms += timeout_ms
+        if not self.watch:
+            await asyncio.sleep(timeout_ms / 1000.0)
+            return
+        deadline = time.perf_counter() + timeout_ms / 1000.0
+        while not self.watch.poll():
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return
+            await asyncio.sleep(min(self.app.shopping_poll_ms / 1000.0, remaining))
+
+    async def activate_main(self):
+        hwnds = self.app.dd2_windows
+        if len(hwnds) > self.app.main_window_index: # Activation blocks until confirmed, so it runs on a worker thread
+            hwnd = hwnds[self.app.main_window_index]
+            activated = await asyncio.get_running_loop().run_in_executor(None, self.app._activate_window, hwnd)
+            if not activated: # Clicks and key presses would land in whatever window has focus instead
+                raise RuntimeError(f"main window {hwnd} could not be brought to the foreground")
+            self.app._follow_main_window(hwnd) # The user may have moved it since the last layout
+
+    async def save_cursor(self):
+        self.saved_cursor = self.backend.get_cursor_pos()
+
+    async def restore_cursor(self):
+        if self.saved_cursor:
+            self.backend.set_cursor_pos(self.saved_cursor)
+
+class PostedShoppingRun(ShoppingRun):
+    """
+    A ShoppingRun that drives one client in the background: moves, clicks and key presses are
+    posted to the window's message queue at client coordinates from the box table, so neither the
+    cursor nor the foreground window is touched and every client can shop at once on the same loop.
+    Without a screen region to watch (the window may be covered), 'settle' waits the fixed delay.
+    """
+    def __init__(self, app, script, hwnd, hold_ms=20):
+        super().__init__(app, script)
+        self.hwnd = hwnd
+        self.prefix = f"Window {hwnd}: "
+        self.hold_ms = hold_ms # Between a posted press and its release
+        self.pointer = (0, 0) # Client position of the last posted move; clicks land there
+        self.posts = 0
+
+    def _post(self, msg, wparam, lparam):
+        if self.app.health.is_hung(self.hwnd):
+            raise RuntimeError(f"window {self.hwnd} is not responding")
+        if not self.backend.post_message(self.hwnd, msg, wparam, lparam):
+            raise RuntimeError(f"window {self.hwnd} is gone or its message queue is full")
+        self.posts += 1
+
+    def box_point(self, target):
+        """Client position of the current 'box' or (centered) 'utility' box in this run's window."""
+        if target == 'box':
+            return self.app.box_table.client_pos(self.hwnd, 'shopping_boxes', self.box_index)
+        return self.app.box_table.client_pos(self.hwnd, 'utility_boxes', self.utility_box - 1, center=True)
+
+    def report_box(self, elapsed):
+        self.app.metrics.record('shopping.client_box_time', elapsed)
+
+    async def move(self, target):
+        x, y = self.pointer = self.box_point(target)
+        self._post(WM_MOUSEMOVE, 0, (y << 16) | (x & 0xFFFF))
+
+    async def click(self):
+        x, y = self.pointer
+        lparam = (y << 16) | (x & 0xFFFF)
+        self._post(WM_LBUTTONDOWN, MK_LBUTTON, lparam)
+        try:
+            await asyncio.sleep(self.hold_ms / 1000.0)
+        finally: # Released on cancel too
+            self.backend.post_message(self.hwnd, WM_LBUTTONUP, 0, lparam)
+
+    async def press(self, key_name):
+        vk_code = key_code(key_name)[0]
+        down_lparam, up_lparam = VK_LPARAMS[vk_code]
+        self._post(WM_KEYDOWN, vk_code, down_lparam)
+        try:
+            await asyncio.sleep(self.hold_ms / 1000.0)
+        finally:
+            self.backend.post_message(self.hwnd, WM_KEYUP, vk_code, up_lparam)
+
+    async def settle(self, timeout_ms):
+        self._fixed_ms += timeout_ms
+        await asyncio.sleep(timeout_ms / 1000.0)
+
+    async def activate_main(self):
+        pass # Posted input reaches the window without it being in the foreground
+
+    async def save_cursor(self):
+        pass
+
+    async def restore_cursor(self):
+        pass
+
+class StatusLog:
+    """
+    Bounded, thread-safe status log. Any thread may append; the GUI drains pending lines at a
+    fixed rate and inserts them in one batch. A message identical to the previous one bumps a
+    repeat count on that line instead of adding a new one. Optionally mirrors every message to
+    a rotating log file, written by a background listener thread.
+    """
+    def __init__(self, max_lines=2000, file_path=None, file_max_bytes=1_000_000, file_backups=3):
+        self.max_lines = max_lines
+        self._lock = threading.Lock()
+        self._pending = collections.deque(maxlen=max_lines) # [timestamp, message, count] not yet shown
+        self._last = None # Newest entry, shown or not
+        self._shown_tail = None # Entry on the last line the GUI has drawn
+        self._tail_dirty = False # That line's repeat count changed since it was drawn
+        self.stats = {'appended': 0, 'collapsed': 0, 'overflowed': 0}
+
+        self._logger = None
+        self._listener = None
+        if file_path:
+            self._start_file_sink(file_path, file_max_bytes, file_backups)
+
+    def _start_file_sink(self, file_path, max_bytes, backups):
+        file_handler = logging.handlers.RotatingFileHandler(file_path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8')
+        file_handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        log_queue = queue.SimpleQueue()
+        self._listener = logging.handlers.QueueListener(log_queue, file_handler)
+        self._listener.start()
+        self._logger = logging.getLogger(f"dd2.status.{id(self)}")
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        self._logger.addHandler(logging.handlers.QueueHandler(log_queue))
+
+    def close(self):
+        if self._listener:
+            self._listener.stop() # Flushes what's queued
+            self._listener = None
+
+    def append(self, message):
+        """Records a message and returns it formatted with its timestamp."""
+        timestamp = time.strftime("[%H:%M:%S]")
+        with self._lock:
+            self.stats['appended'] += 1
+            last = self._last
+            if last is not None and last[1] == message:
+                last[0] = timestamp
+                last[2] += 1
+                self.stats['collapsed'] += 1
+                if last is self._shown_tail:
+                    self._tail_dirty = True
+            else:
+                if len(self._pending) == self._pending.maxlen:
+                    self.stats['overflowed'] += 1
+                self._last = [timestamp, message, 1]
+                self._pending.append(self._last)
+        if self._logger:
+            self._logger.info(message)
+        return f"{timestamp} {message}"
+
+    @staticmethod
+    def format(entry):
+        timestamp, message, count = entry
+        return f"{timestamp} {message} \u00d7{count}" if count > 1 else f"{timestamp} {message}"
+
+    def drain(self):
+        """Returns (replacement for the last line already shown, or None; list of new lines)."""
+        with self._lock:
+            tail = self.format(self._shown_tail) if self._tail_dirty else None
+            self._tail_dirty = False
+            lines = [self.format(entry) for entry in self._pending]
+            if lines:
+                self._shown_tail = self._pending[-1]
+            self._pending.clear()
+        return tail, lines
+
+# Bindings used when there is no hotkey config file. The file has the same shape, e.g.
+#   {"bindings": {"up": ["rotate", "up"], "ctrl+p": ["send_all", "esc"], "f7": ["toggle_g_presser"]}}
+# Actions are listed in WindowManager.HOTKEY_ACTIONS.
+DEFAULT_HOTKEYS = {
+    'up': ['rotate', 'up'],
+    'down': ['rotate', 'down'],
+    'f7': ['toggle_g_presser'],
+    'f10': ['toggle_inactive_sender'],
+    'p': ['send_all', 'esc'],
+    'n': ['send_all', 'm'],
+    'y': ['send_all', 'y'],
+    'g': ['send_all', 'g'],
+    'page up': ['send_all', 'pgup'],
+    'page down': ['send_all', 'pgdn'],
+    'b': ['send_inactive', 'm'],
+    'f9': ['quit'],
+    'f11': ['record_macro'],
+    'f12': ['replay_macro', 'others'],
+}
+
+# How each hotkey action treats OS auto-repeat and bursts; the hotkey config file can override any
+# of these under "policies". repeat: 'allow' or 'ignore' (held keys fire once). coalesce: collapse
+# queued duplicates (latest wins). max_rate: accepted presses per second, None for no limit.
+HOTKEY_POLICIES = {
+    'rotate': {'repeat': 'allow', 'coalesce': True, 'max_rate': None}, # Bursts add up into one layout pass
+    'send_all': {'repeat': 'allow', 'coalesce': True, 'max_rate': 10},
+    'send_inactive': {'repeat': 'allow', 'coalesce': True, 'max_rate': 10},
+    'toggle_g_presser': {'repeat': 'ignore', 'coalesce': False, 'max_rate': None},
+    'toggle_inactive_sender': {'repeat': 'ignore', 'coalesce': False, 'max_rate': None},
+    'record_macro': {'repeat': 'ignore', 'coalesce': False, 'max_rate': None},
+    'replay_macro': {'repeat': 'ignore', 'coalesce': False, 'max_rate': None},
+    'switch_profile': {'repeat': 'ignore', 'coalesce': False, 'max_rate': None},
+    'next_profile': {'repeat': 'ignore', 'coalesce': False, 'max_rate': None},
+    'calibrate': {'repeat': 'ignore', 'coalesce': False, 'max_rate': None},
+    'toggle_mirror': {'repeat': 'ignore', 'coalesce': False, 'max_rate': None},
+    'quit': {'repeat': 'ignore', 'coalesce': False, 'max_rate': None},
+}
+
+def merge_hotkey_policies(overrides):
+    """HOTKEY_POLICIES with the config file's "policies" applied. Raises ValueError for bad entries."""
+    if not isinstance(overrides, dict):
+        raise ValueError("hotkey policies must be an object of action -> policy")
+    policies = {action: dict(policy) for action, policy in HOTKEY_POLICIES.items()}
+    for action, override in overrides.items():
+        if action not in policies or not isinstance(override, dict):
+            raise ValueError(f"policy for unknown action '{action}'")
+        for field, value in override.items():
+            valid = {'repeat': value in ('allow', 'ignore'), 'coalesce': isinstance(value, bool),
+                     'max_rate': value is None or (isinstance(value, (int, float)) and value > 0)}
+            if not valid.get(field):
+                raise ValueError(f"bad policy value {field}={value!r} for '{action}'")
+            policies[action][field] = value
+    return policies
+
+class HotkeyTable:
+    """
+    Hotkey bindings compiled for a single low-level keyboard hook: (scan code, modifier bits) maps
+    straight to a prepared (callback, args, ignore_repeat), so a key event costs one dict lookup.
+    Modifier and held-key state are tracked from the same event stream; a key-down for a key that
+    is already held is OS auto-repeat, and is skipped for bindings with ignore_repeat.
+    """
+    MODIFIERS = {'shift': 1, 'ctrl': 2, 'alt': 4}
+    MODIFIER_SCANS = {0x2A: 1, 0x36: 1, 0x1D: 2, 0x38: 4} # Left/right shift, ctrl, alt
+
+    def __init__(self, entries=None):
+        self.entries = entries or {} # (scan code, modifiers) -> (callback, args, ignore_repeat)
+        self.modifiers = 0
+        self.held = set() # Scan codes currently down
+        self.repeats_ignored = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    @classmethod
+    def parse(cls, hotkey):
+        """'ctrl+page up' -> (scan code, modifier bits). Raises ValueError for unknown names."""
+        *modifier_names, key_name = [part.strip().lower() for part in hotkey.split('+')]
+        modifiers = 0
+        for name in modifier_names:
+            if name not in cls.MODIFIERS:
+                raise ValueError(f"unknown modifier '{name}' in hotkey '{hotkey}'")
+            modifiers |= cls.MODIFIERS[name]
+        code = key_code(key_name)
+        if code is None:
+            raise ValueError(f"unknown key '{key_name}' in hotkey '{hotkey}'")
+        return code[1], modifiers
+
+    @classmethod
+    def compile(cls, bindings, resolve):
+        """
+        Builds a table from {hotkey: [action, *args]}. resolve(action, args) returns the prepared
+        (callback, args, ignore_repeat) or raises ValueError; every binding is checked before anything is replaced.
+        """
+        if not isinstance(bindings, dict):
+            raise ValueError("hotkey bindings must be an object of hotkey -> [action, *args]")
+        entries = {}
+        for hotkey, binding in bindings.items():
+            if isinstance(binding, str):
+                binding = [binding]
+            if not isinstance(binding, list) or not binding:
+                raise ValueError(f"binding for '{hotkey}' must be [action, *args]")
+            key = cls.parse(hotkey)
+            if key in entries:
+                raise ValueError(f"hotkey '{hotkey}' is bound twice")
+            entries[key] = resolve(binding[0], tuple(binding[1:]))
+        return cls(entries)
+
+    def on_key(self, scan_code, down):
+        """Hook callback: tracks modifiers and runs the bound callback on key-down. Returns True if one ran."""
+        bit = self.MODIFIER_SCANS.get(scan_code)
+        if bit:
+            self.modifiers = self.modifiers | bit if down else self.modifiers & ~bit
+            return False
+        if not down:
+            self.held.discard(scan_code)
+            return False
+        repeat = scan_code in self.held
+        self.held.add(scan_code)
+        entry = self.entries.get((scan_code, self.modifiers))
+        if entry is None:
+            return False
+        if repeat and entry[2]:
+            self.repeats_ignored += 1
+            return False
+        entry[0](*entry[1])
+        return True
+
+class InputCommand:
+    """One unit of work queued by a hotkey callback."""
+    __slots__ = ('action', 'args', 'enqueued_at', 'key')
+
+    def __init__(self, action, args, enqueued_at, key=None):
+        self.action = action
+        self.args = args
+        self.enqueued_at = enqueued_at
+        self.key = key # Coalescing key, see submit_coalesced
+
+class InputDispatcher:
+    """
+    Bounded command queue drained by a dedicated thread.
+    Hotkey callbacks only call submit(), which never blocks, so the low-level keyboard hook
+    returns immediately; broadcasts and layout work run on the dispatcher thread instead.
+    submit_coalesced() additionally keeps at most one queued command per key and can rate limit it.
+    """
+    def __init__(self, maxsize=32, on_error=None):
+        self.on_error = on_error # Called as on_error(command, exception) from the dispatcher thread
+        self._queue = queue.Queue(maxsize)
+        self._thread = None
+        self._running = False
+        self._current = None # Command being run, for current_enqueued_at()
+        self._pending = {} # Coalescing key -> its command still waiting in the queue
+        self._last_accepted = {} # Coalescing key -> perf_counter of its last accepted submit
+        self._pending_lock = threading.Lock()
+
+        self.dispatch_latency = LatencyHistogram() # Enqueue -> start of dispatch
+        self.submit_time = LatencyHistogram() # Time spent inside submit(), i.e. in the hook callback
+        self.stats = {'submitted': 0, 'dispatched': 0, 'dropped': 0, 'errors': 0, 'max_depth': 0,
+                      'coalesced': 0, 'rate_limited': 0}
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True, name="dd2-dispatcher")
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        try:
+            self._queue.put_nowait(None) # Wake the thread up
+        except queue.Full:
+            pass # It will notice _running on its next timeout
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    def current_enqueued_at(self):
+        """Enqueue time of the command being run, when called from inside it on the dispatcher thread."""
+        command = self._current
+        if command is not None and threading.current_thread() is self._thread:
+            return command.enqueued_at
+        return None
+
+    def submit(self, action, *args):
+        """Queues action(*args). Returns False if the queue is full and the command was dropped."""
+        start = time.perf_counter()
+        try:
+            self._queue.put_nowait(InputCommand(action, args, start))
+            accepted = True
+            self.stats['submitted'] += 1
+            depth = self._queue.qsize()
+            if depth > self.stats['max_depth']:
+                self.stats['max_depth'] = depth
+        except queue.Full:
+            accepted = False
+            self.stats['dropped'] += 1
+        self.submit_time.record(time.perf_counter() - start)
+        return accepted
+
+    def submit_coalesced(self, key, action, *args, min_interval=0, coalesce=True):
+        """
+        Like submit(), for repeatable actions. With `coalesce`, a command with the same key that is
+        still queued is updated in place (latest wins) instead of queueing another; submits less than
+        `min_interval` seconds after the last accepted one with this key are dropped. Returns False if
+        the submit was dropped.
+        """
+        start = time.perf_counter()
+        with self._pending_lock:
+            pending = self._pending.get(key) if coalesce else None
+            if pending is not None:
+                pending.action, pending.args = action, args
+                self.stats['coalesced'] += 1
+                self.submit_time.record(time.perf_counter() - start)
+                return True
+            if min_interval and start - self._last_accepted.get(key, -math.inf) < min_interval:
+                self.stats['rate_limited'] += 1
+                self.submit_time.record(time.perf_counter() - start)
+                return False
+            command = InputCommand(action, args, start, key)
+            try:
+                self._queue.put_nowait(command)
+            except queue.Full:
+                self.stats['dropped'] += 1
+                self.submit_time.record(time.perf_counter() - start)
+                return False
+            if coalesce:
+                self._pending[key] = command
+            self._last_accepted[key] = start
+            self.stats['submitted'] += 1
+            depth = self._queue.qsize()
+            if depth > self.stats['max_depth']:
+                self.stats['max_depth'] = depth
+        self.submit_time.record(time.perf_counter() - start)
+        return True
+
+    def _run(self):
+        while self._running:
+            try:
+                command = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if command is None:
+                continue
+            if command.key is not None:
+                with self._pending_lock: # From here on, a new submit with this key queues a new command
+                    if self._pending.get(command.key) is command:
+                        del self._pending[command.key]
+            self.dispatch_latency.record(time.perf_counter() - command.enqueued_at)
+            self._current = command
+            try:
+                command.action(*command.args)
+            except Exception as e: # One bad command must not kill the dispatcher
+                self.stats['errors'] += 1
+                if self.on_error:
+                    self.on_error(command, e)
+            self._current = None
+            self.stats['dispatched'] += 1
+
+# Layout modes understood by solve_layout
+LAYOUT_MODES = ('classic', 'side', 'bottom', 'grid', 'custom')
+
+def _split_span(start, length, parts, padding):
+    """Splits a span into `parts` equal cells separated by padding; returns [(start, size), ...]."""
+    size = max(1, (length - padding * (parts - 1)) // parts)
+    return [(start + i * (size + padding), size) for i in range(parts)]
+
+def _grid_cells(x, y, w, h, count, padding):
+    """Tiles `count` equal cells row-major into the given rect, as close to square as possible."""
+    cols = math.ceil(math.sqrt(count))
+    rows = math.ceil(count / cols)
+    cells = []
+    for cy, ch in _split_span(y, h, rows, padding):
+        for cx, cw in _split_span(x, w, cols, padding):
+            cells.append((cx, cy, cw, ch))
+    return cells[:count]
+
+@functools.lru_cache(maxsize=256)
+def _layout_slots(mode, work_area, count, main_w, main_h, padding, template):
+    """Slot rects (x, y, w, h) for `count` windows; slot 0 is the main window."""
+    left, top, right, bottom = work_area
+    width, height = right - left, bottom - top
+    main_w, main_h = min(main_w, width), min(main_h, height)
+    secondaries = count - 1
+
+    if mode == 'grid':
+        return tuple(_grid_cells(left, top, width, height, count, padding))
+
+    if mode == 'custom':
+        slots = [(left + int(fx * width), top + int(fy * height), max(1, int(fw * width)), max(1, int(fh * height)))
+                 for fx, fy, fw, fh in template]
+        if count > len(slots): # Overflow windows share the last slot as a grid
+            slots[-1:] = _grid_cells(*slots[-1], count - len(slots) + 1, padding)
+        return tuple(slots[:count])
+
+    slots = [(left, top, main_w, main_h)]
+    side_x = left + main_w + padding
+    side_w = max(1, right - side_x)
+    below_y = top + main_h + padding
+    if secondaries < 1:
+        return tuple(slots)
+
+    if mode == 'side': # All secondaries stacked in the strip right of the main window
+        slots += [(side_x, y, side_w, h) for y, h in _split_span(top, height, secondaries, padding)]
+    elif mode == 'bottom': # All secondaries in one row below the main window
+        bottom_h = max(1, bottom - below_y)
+        slots += [(x, below_y, w, bottom_h) for x, w in _split_span(left, width, secondaries, padding)]
+    else: # 'classic': first secondary in the side strip, the rest in a row under the main window
+        slots.append((side_x, top, side_w, main_h))
+        if secondaries > 1:
+            bottom_h = max(1, bottom - below_y - padding)
+            slots += [(x, below_y, w, bottom_h) for x, w in _split_span(left, main_w, secondaries - 1, padding)]
+    return tuple(slots)
+
+@functools.lru_cache(maxsize=4096)
+def solve_layout(mode, work_area, count, main_index, main_w, main_h, padding, template=None, secondary_area=None):
+    """
+    Pure layout solver: returns one (x, y, w, h) rect per window index for `count` windows on a
+    (left, top, right, bottom) work area, with window `main_index` in the main slot and the others
+    filling the secondary slots in order. Memoized, so rotating the main window is a table lookup.
+    `template` (custom mode only) is a tuple of (x, y, w, h) fractions of the work area.
+    If `secondary_area` is given (another monitor), the main slot stays on `work_area` and the
+    secondaries are tiled as a grid over `secondary_area` instead.
+    """
+    if count < 1:
+        return ()
+    if secondary_area:
+        left, top, right, bottom = secondary_area
+        slots = _layout_slots(mode, tuple(work_area), 1, main_w, main_h, padding, template)
+        if count > 1:
+            slots += tuple(_grid_cells(left, top, right - left, bottom - top, count - 1, padding))
+    else:
+        slots = _layout_slots(mode, tuple(work_area), count, main_w, main_h, padding, template)
+    order = [main_index] + [i for i in range(count) if i != main_index]
+    rects = [None] * count
+    for index, slot in zip(order, slots):
+        rects[index] = slot
+    return tuple(rects)
+
+# A profile bundles everything that changes between setups; a stored profile may leave sections out
+DEFAULT_PROFILE = {
+    'box_positions': { # Fractions of the main window's client area, so they follow the window wherever the layout puts it
+        'shopping_boxes': [{'u': round(0.03 + (i * 0.035), 3), 'v': 0.06} for i in range(8)],
+        'utility_boxes': [{'u': round(0.03 + (i * 0.035), 3), 'v': 0.17} for i in range(3)],
+    },
+    'layout': {'main_w': 1720, 'main_h': 900, 'padding': 0, 'mode': 'classic', 'template': None,
+               'main_monitor': 0, 'secondary_monitor': None}, # secondary_monitor None: same as main_monitor
+    'hotkeys': None, # {'bindings': {...}, 'policies': {...}} like the hotkey config file; None uses that file
+}
+
+def _valid_boxes(boxes):
+    # {u, v} fractions of the client area; {x, y} screen pixels are the older absolute format, migrated once there is a window
+    if not isinstance(boxes, list) or not boxes:
+        raise ValueError("expected a non-empty list of {u, v} positions")
+    if all(isinstance(box, dict) and 'u' in box for box in boxes):
+        return [{'u': float(box['u']), 'v': float(box['v'])} for box in boxes]
+    return [{'x': int(box['x']), 'y': int(box['y'])} for box in boxes]
+
+def _valid_template(template):
+    # Each slot is [x, y, w, h] as fractions of the work area; slot 0 is the main window
+    if (not isinstance(template, (list, tuple)) or not template or
+            not all(isinstance(slot, (list, tuple)) and len(slot) == 4 and all(0 <= v <= 1 for v in slot) for slot in template)):
+        raise ValueError("custom mode needs a 'template' list of [x, y, w, h] fractions")
+    return tuple(tuple(float(v) for v in slot) for slot in template)
+
+def validate_profile(raw):
+    """
+    A complete profile from stored data. Checked field by field: anything missing or invalid falls back
+    to DEFAULT_PROFILE instead of discarding the whole profile. Returns (profile, problems).
+    """
+    profile = copy.deepcopy(DEFAULT_PROFILE)
+    if not isinstance(raw, dict):
+        return profile, ["not an object"]
+    problems = []
+    boxes = raw.get('box_positions') if isinstance(raw.get('box_positions'), dict) else {}
+    for kind in ('shopping_boxes', 'utility_boxes'):
+        if kind in boxes:
+            try:
+                profile['box_positions'][kind] = _valid_boxes(boxes[kind])
+            except (KeyError, TypeError, ValueError) as e:
+                problems.append(f"{kind}: {e}")
+    layout = raw.get('layout') if isinstance(raw.get('layout'), dict) else {}
+    checks = {'main_w': lambda v: int(v) if int(v) > 0 else None, 'main_h': lambda v: int(v) if int(v) > 0 else None,
+              'padding': lambda v: int(v) if int(v) >= 0 else None,
+              'mode': lambda v: v if v in LAYOUT_MODES else None,
+              'main_monitor': int, 'secondary_monitor': lambda v: None if v is None else int(v)}
+    for field, check in checks.items():
+        if field in layout:
+            try:
+                value = check(layout[field])
+                if value is None and layout[field] is not None:
+                    raise ValueError(f"bad value {layout[field]!r}")
+                profile['layout'][field] = value
+            except (TypeError, ValueError) as e:
+                problems.append(f"layout {field}: {e}")
+    if profile['layout']['mode'] == 'custom':
+        try:
+            profile['layout']['template'] = _valid_template(layout.get('template'))
+        except (TypeError, ValueError) as e:
+            problems.append(f"layout template: {e}; using classic")
+            profile['layout']['mode'] = 'classic'
+    hotkeys = raw.get('hotkeys')
+    if hotkeys is not None:
+        if isinstance(hotkeys, dict) and isinstance(hotkeys.get('bindings'), dict):
+            profile['hotkeys'] = {'bindings': hotkeys['bindings'], 'policies': hotkeys.get('policies', {})}
+        else:
+            problems.append("hotkeys: expected an object with 'bindings'")
+    return profile, problems
+
+def box_transform_table(points, rects):
+    """
+    Maps normalized (u, v) points into every rect (left, top, right, bottom) in one broadcast step.
+    Returns (screen, client): per rect, the list of (x, y) per point, in screen and in rect-relative pixels.
+    """
+    if _load_numpy():
+        uv = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 1, 2) # point, 1, (u, v)
+        bounds = numpy.asarray(rects, dtype=numpy.float64).reshape(1, -1, 4) # 1, rect, (left, top, right, bottom)
+        client = numpy.rint(uv * (bounds[..., 2:] - bounds[..., :2])).astype(numpy.int64) # point, rect, (x, y)
+        screen = client + bounds[..., :2].astype(numpy.int64)
+        return screen.transpose(1, 0, 2).tolist(), client.transpose(1, 0, 2).tolist()
+    client = [[[round(u * (right - left)), round(v * (bottom - top))] for u, v in points] for left, top, right, bottom in rects]
+    screen = [[[left + x, top + y] for x, y in row] for (left, top, _, _), row in zip(rects, client)]
+    return screen, client
+
+class BoxTransforms:
+    """
+    Screen and client coordinates of every box in every window, for one layout. Built in one step
+    from the normalized box positions and the windows' client rects; clicks only index it.
+    centers maps a kind to the normalized (du, dv) from a box's corner to the point clicked in it, so
+    that point scales with each window like the box does.
+    """
+    def __init__(self, boxes, client_rects, centers=None):
+        self.rects = dict(client_rects) # hwnd -> client rect (screen coordinates) the table was built for
+        self.offsets = {} # kind -> index of its first box in a row
+        self.center_offsets = {} # kind -> index of its first box center in a row, after all the corners
+        points = []
+        for kind in ('shopping_boxes', 'utility_boxes'):
+            if kind in boxes:
+                self.offsets[kind] = len(points)
+                points += [(box['u'], box['v']) for box in boxes[kind]]
+        self.counts = {kind: len(boxes[kind]) for kind in self.offsets}
+        for kind, (du, dv) in (centers or {}).items():
+            if kind in boxes:
+                self.center_offsets[kind] = len(points)
+                points += [(box['u'] + du, box['v'] + dv) for box in boxes[kind]]
+        screen, client = box_transform_table(points, list(self.rects.values()))
+        self.screen = dict(zip(self.rects, screen)) # hwnd -> [[x, y] per box], all kinds in one row
+        self.client = dict(zip(self.rects, client))
+
+    def screen_pos(self, hwnd, kind, index, center=False):
+        return self.screen[hwnd][(self.center_offsets if center else self.offsets)[kind] + index]
+
+    def client_pos(self, hwnd, kind, index, center=False):
+        return self.client[hwnd][(self.center_offsets if center else self.offsets)[kind] + index]
+
+    def positions(self, hwnd):
+        """Screen positions of the boxes in one window, in the {kind: [{'x', 'y'}]} form the overlay and the shopping loop use."""
+        row = self.screen[hwnd]
+        return {kind: [{'x': x, 'y': y} for x, y in row[start:start + self.counts[kind]]] for kind, start in self.offsets.items()}
+
+    def __contains__(self, hwnd):
+        return hwnd in self.screen
+
+class ProfileStore:
+    """
+    Named profiles in one versioned JSON file: {"version", "active", "profiles": {name: profile}}.
+    Saves are debounced and atomic (temp file, fsync, os.replace), so a crash mid-save leaves the old
+    file intact. reload_if_changed() is one stat() unless the file's mtime or size changed.
+    """
+    VERSION = 1
+
+    def __init__(self, path, save_delay=1.0, on_message=None):
+        self.path = path
+        self.save_delay = save_delay # Seconds a save waits for further changes
+        self.on_message = on_message or print # Load and save problems are reported here
+        self.profiles = {} # name -> validated profile
+        self.active = 'default'
+        self.read_only = False # Set for files written by a newer version, so they aren't downgraded
+        self.stats = {'loads': 0, 'saves': 0, 'save_requests': 0, 'errors': 0}
+        self._stamp = None # (mtime_ns, size) of the file as last read or written
+        self._lock = threading.RLock()
+        self._save_timer = None
+
+    def __contains__(self, name):
+        return name in self.profiles
+
+    def names(self):
+        return list(self.profiles)
+
+    def get(self, name=None):
+        return self.profiles[self.active if name is None else name]
+
+    def _file_stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def load(self):
+        """Reads the file. Returns False if it is missing or unreadable (the current profiles are kept)."""
+        with self._lock:
+            self._stamp = self._file_stamp()
+            if self._stamp is None:
+                return False
+            try:
+                with open(self.path, 'r') as f:
+                    data = json.load(f)
+                version = data.get('version')
+                if not isinstance(version, int) or version < 1:
+                    raise ValueError(f"unsupported version {version!r}")
+                if not isinstance(data.get('profiles'), dict) or not data['profiles']:
+                    raise ValueError("no profiles")
+            except (json.JSONDecodeError, IOError, ValueError, AttributeError) as e:
+                self.stats['errors'] += 1
+                self.on_message(f"Error loading profiles from {self.path}: {e}")
+                return False
+            self.read_only = version > self.VERSION
+            if self.read_only:
+                self.on_message(f"{self.path} was written by a newer version ({version}); changes won't be saved.")
+            profiles = {}
+            for name, raw in data['profiles'].items():
+                profiles[str(name)], problems = validate_profile(raw)
+                for problem in problems:
+                    self.on_message(f"Profile '{name}': {problem}; using the default.")
+            self.profiles = profiles
+            active = data.get('active')
+            self.active = active if active in profiles else next(iter(profiles))
+            if self._save_timer: # The file changed under a pending save; the file wins
+                self._save_timer.cancel()
+                self._save_timer = None
+            self.stats['loads'] += 1
+            return True
+
+    def reload_if_changed(self):
+        """Rereads the file if something else changed it. Returns True if the profiles were reloaded."""
+        stamp = self._file_stamp()
+        if stamp is None or stamp == self._stamp:
+            return False
+        return self.load()
+
+    def put(self, name, profile):
+        """Validates and stores a profile, then schedules a save. Returns the problems found."""
+        profile, problems = validate_profile(profile)
+        with self._lock:
+            self.profiles[name] = profile
+        self.save_later()
+        return problems
+
+    def update(self, name, **sections):
+        """Replaces whole sections (box_positions, layout, hotkeys) of an existing profile."""
+        with self._lock:
+            merged = dict(self.profiles[name], **sections)
+        return self.put(name, merged)
+
+    def activate(self, name):
+        """Makes `name` the active profile (one lookup) and returns it; KeyError if there is none."""
+        profile = self.profiles[name]
+        self.active = name
+        self.save_later()
+        return profile
+
+    def save_later(self):
+        """Debounced save: changes within save_delay of each other are written once."""
+        with self._lock:
+            self.stats['save_requests'] += 1
+            if self._save_timer is None:
+                self._save_timer = threading.Timer(self.save_delay, self._save_pending)
+                self._save_timer.daemon = True
+                self._save_timer.start()
+
+    def _save_pending(self):
+        with self._lock:
+            if self._save_timer is None: # Cancelled by flush() or a reload
+                return
+            self._save_timer = None
+            self.save()
+
+    def flush(self):
+        """Writes a pending save now (on exit)."""
+        with self._lock:
+            if self._save_timer:
+                self._save_timer.cancel()
+                self._save_timer = None
+                self.save()
+
+    def save(self):
+        """Atomic write: a complete temp file in the same directory replaces the old file. Returns success."""
+        with self._lock:
+            if self.read_only:
+                return False
+            data = {'version': self.VERSION, 'active': self.active, 'profiles': self.profiles}
+            directory = os.path.dirname(os.path.abspath(self.path))
+            fd, temp_path = tempfile.mkstemp(prefix='.profiles-', suffix='.tmp', dir=directory)
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(data, f, indent=4)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_path, self.path)
+            except (IOError, OSError, TypeError, ValueError) as e:
+                self.stats['errors'] += 1
+                self.on_message(f"Error saving profiles to {self.path}: {e}")
+                try:
+                    os.unlink(temp_path)
+                except OSError:
+                    pass
+                return False
+            self._stamp = self._file_stamp() # Our own write isn't a change to reload
+            self.stats['saves'] += 1
+            return True
+
+class ScheduledJob:
+    """A periodic job: period, phase offset, enable flag and timing statistics."""
+    def __init__(self, name, func, period_ms, phase_ms=0):
+        self.name = name
+        self.func = func
+        self.period_ms = period_ms
+        self.phase_ms = phase_ms # Offset from the scheduler's epoch; staggers jobs that share the thread
+        self.enabled = False
+        self.next_deadline = None
+        self.period_hist = LatencyHistogram() # Achieved start-to-start period
+        self.lateness_hist = LatencyHistogram() # Start time minus deadline (jitter)
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.last_start = None
+        self.period_hist.reset()
+        self.lateness_hist.reset()
+        self.runs = 0
+        self.skipped = 0 # Ticks dropped because a run overran a whole period
+
+    def summary(self):
+        return {
+            'period_ms': self.period_ms,
+            'achieved_period_ms': self.period_hist.mean * 1e3,
+            'jitter_p99_ms': self.lateness_hist.percentile(99) * 1e3,
+            'runs': self.runs,
+            'skipped': self.skipped,
+        }
+
+class PeriodicScheduler:
+    """
+    Runs periodic jobs on one thread against absolute monotonic deadlines. Every job runs on the
+    grid epoch + phase + n * period regardless of how long earlier runs took, so work time
+    doesn't stretch the period, and jobs with different phases never collide; runs that can't
+    be made up are skipped and counted.
+    """
+    def __init__(self, on_error=None):
+        self.on_error = on_error # Called as on_error(job, exception) from the scheduler thread
+        self.epoch = time.perf_counter()
+        self._jobs = {}
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+
+    def add_job(self, name, func, period_ms, phase_ms=0):
+        with self._cond:
+            job = self._jobs[name] = ScheduledJob(name, func, period_ms, phase_ms)
+        return job
+
+    def job(self, name):
+        return self._jobs[name]
+
+    def jobs(self):
+        return list(self._jobs.values())
 
-    def _on_press(self, event):
-        """Records the initial click position."""
-        self._drag_data["x"] = event.x
-        self._drag_data["y"] = event.y
+    def set_enabled(self, name, enabled, run_now=False):
+        """Turns a job on or off. With run_now, a job being enabled runs at once and keeps its period from that run."""
+        with self._cond:
+            job = self._jobs[name]
+            if enabled and not job.enabled:
+                job.reset_stats()
+                job.next_deadline = time.perf_counter() if run_now else self._first_slot(job)
+            job.enabled = enabled
+            self._cond.notify()
+
+    def set_period(self, name, period_ms, phase_ms=None):
+        """Changes a job's period (and optionally phase), re-aligning a running job to its new grid."""
+        with self._cond:
+            job = self._jobs[name]
+            job.period_ms = period_ms
+            if phase_ms is not None:
+                job.phase_ms = phase_ms
+            if job.enabled:
+                job.next_deadline = self._first_slot(job)
+            self._cond.notify()
+
+    def _first_slot(self, job):
+        """Earliest grid slot (epoch + phase + n * period) that is not in the past."""
+        period = job.period_ms / 1000.0
+        offset = time.perf_counter() - self.epoch - job.phase_ms / 1000.0
+        return self.epoch + job.phase_ms / 1000.0 + max(0, math.ceil(offset / period)) * period
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True, name="dd2-scheduler")
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+
+    def _next_due(self):
+        """Waits on the condition until a job is within SPIN_THRESHOLD of its deadline. Returns it, or None on stop."""
+        with self._cond:
+            while self._running:
+                enabled = [job for job in self._jobs.values() if job.enabled]
+                if not enabled:
+                    self._cond.wait()
+                    continue
+                job = min(enabled, key=lambda j: j.next_deadline)
+                remaining = job.next_deadline - time.perf_counter()
+                if remaining <= SPIN_THRESHOLD:
+                    return job, job.next_deadline
+                self._cond.wait(remaining - SPIN_THRESHOLD)
+        return None, None
+
+    def _run(self):
+        while True:
+            job, deadline = self._next_due()
+            if job is None:
+                return
+            wait_until(deadline)
+            if not job.enabled or job.next_deadline != deadline: # Toggled while we were spinning
+                continue
+
+            start = time.perf_counter()
+            job.lateness_hist.record(start - deadline)
+            if job.last_start is not None:
+                job.period_hist.record(start - job.last_start)
+            job.last_start = start
+            job.runs += 1
+            try:
+                job.func()
+            except Exception as e: # Keep the other jobs (and this one) running
+                if self.on_error:
+                    self.on_error(job, e)
 
-    def _on_drag(self, event):
-        """Moves the widget with the mouse."""
-        x = self.winfo_pointerx() - self._drag_data["x"]
-        y = self.winfo_pointery() - self._drag_data["y"]
-        self.place(x=x, y=y)
+            with self._cond:
+                if job.next_deadline != deadline: # Re-anchored by set_enabled during the run
+                    continue
+                period = job.period_ms / 1000.0
+                next_deadline = deadline + period
+                now = time.perf_counter()
+                if next_deadline <= now: # Overran: skip to the next future slot on the same grid
+                    missed = int((now - next_deadline) // period) + 1
+                    job.skipped += missed
+                    next_deadline += missed * period
+                job.next_deadline = next_deadline
 
 class ShoppingOverlay(tk.Toplevel):
     """
-    An overlay window for shopping mode with draggable, semi-transparent squares.
+    Setup overlay for the shopping boxes: every box is drawn on one canvas, in a borderless topmost
+    window that only covers the boxes' bounding region (plus a drag margin) instead of the whole screen.
+    Drags are coalesced to one redraw per display refresh. It exists only during SETUP; auto-run
+    destroys it, so nothing is composited over the game while shopping.
     """
-    def __init__(self, master, initial_positions=None):
+    MARGIN = 80 # Pixels around the boxes' bounding region; the window grows as a box is dragged toward its edge
+    SHOPPING_SIZE = 50
+    UTILITY_SIZE = 25 # Half size
+    TRANSPARENT_COLOR = 'magenta' # Colour key, unlikely to be in game content
+    TEXT_COLOR = '#1E1E2E' # Dark text for light-coloured boxes
+    # Catppuccin Mocha: Rosewater .. Lavender; utility boxes start at Green so they don't repeat the first ones
+    COLORS = ('#f5e0dc', '#f2cdcd', '#f5c2e7', '#cba6f7', '#f38ba8', '#eba0ac', '#fab387',
+              '#f9e2af', '#a6e3a1', '#94e2d5', '#89dceb', '#74c7ec', '#89b4fa', '#b4befe')
+
+    def __init__(self, master, initial_positions=None, refresh_hz=60):
         super().__init__(master)
         self.master = master
         self.overrideredirect(True)
         self.attributes('-topmost', True)
         self.attributes('-alpha', 0.6) # Set transparency for the entire overlay
+        self.attributes('-transparentcolor', self.TRANSPARENT_COLOR)
+        self.config(bg=self.TRANSPARENT_COLOR)
+        self.canvas = tk.Canvas(self, bg=self.TRANSPARENT_COLOR, highlightthickness=0, cursor="fleur")
+        self.canvas.pack(fill=tk.BOTH, expand=True)
 
-        # Use a transparent color to make the window background invisible
-        # Using magenta, a color unlikely to be in game content
-        self.transparent_color = 'magenta'
-        self.attributes('-transparentcolor', self.transparent_color)
-        self.config(bg=self.transparent_color)
-
-        # Fullscreen geometry
-        self.geometry(f"{self.winfo_screenwidth()}x{self.winfo_screenheight()}+0+0")
-
-        self.shopping_squares = []
-        self.utility_squares = []
-
-        # Catppuccin Mocha colors for the boxes
-        catppuccin_colors = [
-            '#f5e0dc',  # Rosewater
-            '#f2cdcd',  # Flamingo
-            '#f5c2e7',  # Pink
-            '#cba6f7',  # Mauve
-            '#f38ba8',  # Red
-            '#eba0ac',  # Maroon
-            '#fab387',  # Peach
-            '#f9e2af',  # Yellow
-            '#a6e3a1',  # Green
-            '#94e2d5',  # Teal
-            '#89dceb',  # Sky
-            '#74c7ec',  # Sapphire
-            '#89b4fa',  # Blue
-            '#b4befe'   # Lavender
-        ]
-        text_color = '#1E1E2E' # Dark text for light-colored boxes
-
-        # Default positions for shopping boxes if not provided or malformed
-        default_shopping_positions = [{'x': 50 + (i * 60), 'y': 50} for i in range(8)]
-        shopping_positions = initial_positions.get('shopping_boxes', default_shopping_positions) if isinstance(initial_positions, dict) else default_shopping_positions
-
-        # Default positions for utility boxes (3 of them, different starting point)
-        default_utility_positions = [{'x': 50 + (i * 60), 'y': 150} for i in range(3)] # Changed range to 3
-        utility_positions = initial_positions.get('utility_boxes', default_utility_positions) if isinstance(initial_positions, dict) else default_utility_positions
-
-        for i, pos in enumerate(shopping_positions):
-            bg_color = catppuccin_colors[i % len(catppuccin_colors)]
-            square = DraggableSquare(self, box_number=i+1, bg_color=bg_color, text_color=text_color, width=50, height=50) # Explicitly set size
-            square.place(x=pos.get('x', 50 + (i * 60)), y=pos.get('y', 50))
-            self.shopping_squares.append(square)
-
-        for i, pos in enumerate(utility_positions):
-            # Start utility box colors from a different index to ensure they don't repeat the first few shopping box colors
-            bg_color = catppuccin_colors[(i + 8) % len(catppuccin_colors)]
-            square = DraggableSquare(self, box_number=f"U{i+1}", bg_color=bg_color, text_color=text_color, width=25, height=25) # Half size
-            square.place(x=pos.get('x', 50 + (i * 60)), y=pos.get('y', 150))
-            self.utility_squares.append(square)
-        
-        # Add a "Shop" label next to the utility boxes
-        self.shop_label = tk.Label(self, text="SHOP", font=("Arial", 10, "bold"), fg=text_color, bg=self.transparent_color)
-        self.shop_label.place(x=230, y=150) # Position to the right of the utility boxes
+        self.frame_ms = max(1, round(1000.0 / refresh_hz))
+        self.origin = (0, 0) # Screen position of the canvas' top-left corner
+        self.boxes = [] # {'kind', 'x', 'y', 'size'}: screen position of each box's top-left corner
+        self.stats = {'motion_events': 0, 'redraws': 0, 'resizes': 0}
+        self._drag = None # (box index, pointer offset x, pointer offset y) while a box is held
+        self._drag_target = None # Latest pointer position, drawn at the next frame
+        self._frame_pending = None # after() id of the next coalesced redraw
+
+        positions = initial_positions if isinstance(initial_positions, dict) else {}
+        for kind, size, first_color, prefix in (('shopping_boxes', self.SHOPPING_SIZE, 0, ''), ('utility_boxes', self.UTILITY_SIZE, 8, 'U')):
+            for i, pos in enumerate(positions.get(kind) or master.box_positions[kind]):
+                index = len(self.boxes)
+                self.boxes.append({'kind': kind, 'x': pos['x'], 'y': pos['y'], 'size': size})
+                color = self.COLORS[(first_color + i) % len(self.COLORS)]
+                tag = f"box{index}" # Rectangle and number share the tag, so one move() shifts both
+                self.canvas.create_rectangle(pos['x'], pos['y'], pos['x'] + size, pos['y'] + size, fill=color, width=0, tags=(tag,))
+                self.canvas.create_text(pos['x'] + size / 2, pos['y'] + size / 2, text=f"{prefix}{i + 1}", fill=self.TEXT_COLOR,
+                                        font=("Arial", 12 if size >= 40 else 9, "bold"), tags=(tag,))
+        self._fit_region()
+
+        self.canvas.bind("<ButtonPress-1>", self._on_press)
+        self.canvas.bind("<B1-Motion>", self._on_motion)
+        self.canvas.bind("<ButtonRelease-1>", self._on_release)
+        self.master.update_status(f"Shopping overlay created in SETUP mode ({self.covered_area()}).")
+
+    def covered_area(self):
+        """How much of the screen the layered window covers; the compositor blends every pixel of it per frame."""
+        width, height = int(self.canvas.cget('width')), int(self.canvas.cget('height'))
+        screen = self.winfo_screenwidth() * self.winfo_screenheight()
+        return f"{width}x{height}, {width * height / screen:.0%} of the screen"
 
-        self.is_click_through = False
-        self.master.update_status("Shopping overlay created in SETUP mode.")
+    def _fit_region(self):
+        """Places the window over the boxes' bounding region plus MARGIN; items keep their screen positions."""
+        left = min(box['x'] for box in self.boxes) - self.MARGIN
+        top = min(box['y'] for box in self.boxes) - self.MARGIN
+        right = max(box['x'] + box['size'] for box in self.boxes) + self.MARGIN
+        bottom = max(box['y'] + box['size'] for box in self.boxes) + self.MARGIN
+        self.canvas.move('all', self.origin[0] - left, self.origin[1] - top)
+        self.origin = (left, top)
+        self.canvas.config(width=right - left, height=bottom - top)
+        self.geometry(f"{right - left}x{bottom - top}+{left}+{top}")
+        self.stats['resizes'] += 1
+
+    def _on_press(self, event):
+        # Topmost box under the pointer (numbers are on top of their own rectangle)
+        for item in reversed(self.canvas.find_overlapping(event.x, event.y, event.x, event.y)):
+            tag = next((t for t in self.canvas.gettags(item) if t.startswith('box')), None)
+            if tag:
+                box = self.boxes[int(tag[3:])]
+                self._drag = (int(tag[3:]), event.x_root - box['x'], event.y_root - box['y'])
+                return
+
+    def _on_motion(self, event):
+        """Only records the pointer; the box is redrawn at most once per display refresh."""
+        self.stats['motion_events'] += 1
+        if not self._drag:
+            return
+        self._drag_target = (event.x_root, event.y_root)
+        if self._frame_pending is None:
+            self._frame_pending = self.after(self.frame_ms, self._draw_frame)
+
+    def _on_release(self, event):
+        if self._frame_pending is not None: # Land the box exactly where it was let go
+            self.after_cancel(self._frame_pending)
+            self._draw_frame()
+        self._drag = None
+
+    def _draw_frame(self):
+        self._frame_pending = None
+        if not self._drag or not self._drag_target:
+            return
+        with self.master.metrics.probe('overlay.frame'):
+            index, offset_x, offset_y = self._drag
+            box = self.boxes[index]
+            x, y = self._drag_target[0] - offset_x, self._drag_target[1] - offset_y
+            self.canvas.move(f"box{index}", x - box['x'], y - box['y'])
+            box['x'], box['y'] = x, y
+            self.stats['redraws'] += 1
+            # Grow (or shrink) the window once the box gets within half the margin of its edge
+            width, height = int(self.canvas.cget('width')), int(self.canvas.cget('height'))
+            inner = self.MARGIN // 2
+            if (x - self.origin[0] < inner or y - self.origin[1] < inner or
+                    self.origin[0] + width - (x + box['size']) < inner or self.origin[1] + height - (y + box['size']) < inner):
+                self._fit_region()
 
     def get_box_positions(self):
         """Returns the current x, y coordinates of all squares."""
-        shopping_positions = []
-        for square in self.shopping_squares:
-            shopping_positions.append({'x': square.winfo_x(), 'y': square.winfo_y()})
-        
-        utility_positions = []
-        for square in self.utility_squares:
-            utility_positions.append({'x': square.winfo_x(), 'y': square.winfo_y()})
-            
-        return {'shopping_boxes': shopping_positions, 'utility_boxes': utility_positions}
+        positions = {'shopping_boxes': [], 'utility_boxes': []}
+        for box in self.boxes:
+            positions[box['kind']].append({'x': box['x'], 'y': box['y']})
+        return positions
+
+    def destroy(self):
+        if self.stats['motion_events']:
+            self.master.update_status(f"Overlay: {self.stats['motion_events']} drag events drawn in {self.stats['redraws']} "
+                                      f"frames, {self.stats['resizes']} region changes; covered {self.covered_area()}.")
+        super().destroy()
+
+class MetricsPanel(tk.Toplevel):
+    """Table of the hot-path timing probes, with JSON/CSV export."""
+    COLUMNS = ('count', 'mean_ms', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms')
+
+    def __init__(self, master, metrics):
+        super().__init__(master)
+        self.master = master
+        self.metrics = metrics
+        self.title("Metrics")
+        self.geometry("760x360")
+        self.configure(bg=master.theme['bg'])
+
+        self.tree = ttk.Treeview(self, columns=self.COLUMNS, show='tree headings', height=12)
+        self.tree.heading('#0', text='probe')
+        self.tree.column('#0', width=220)
+        for column in self.COLUMNS:
+            self.tree.heading(column, text=column)
+            self.tree.column(column, width=80, anchor=tk.E)
+        self.tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=(10, 5))
 
-    def set_click_through(self, enable: bool):
-        """Toggles the click-through property of the overlay window."""
-        hwnd = self.winfo_id()
+        buttons = ttk.Frame(self)
+        buttons.pack(fill=tk.X, padx=10, pady=(0, 10))
+        self.enabled_var = tk.BooleanVar(value=metrics.enabled)
+        ttk.Checkbutton(buttons, text="Probes enabled", variable=self.enabled_var, command=self._toggle_enabled).pack(side=tk.LEFT)
+        ttk.Button(buttons, text="Export CSV", command=lambda: self._export('csv')).pack(side=tk.RIGHT, padx=(5, 0))
+        ttk.Button(buttons, text="Export JSON", command=lambda: self._export('json')).pack(side=tk.RIGHT, padx=(5, 0))
+        ttk.Button(buttons, text="Reset", command=self._reset).pack(side=tk.RIGHT, padx=(5, 0))
+
+        self._refresh_job = None # after() id of the next refresh, cancelled when the panel closes
+        self._refresh()
+
+    def _toggle_enabled(self):
+        self.metrics.enabled = self.enabled_var.get()
+        self.master.update_status(f"Metrics probes {'enabled' if self.metrics.enabled else 'disabled'}.")
+
+    def _reset(self):
+        self.metrics.reset()
+        self._refresh(reschedule=False)
+
+    def _refresh(self, reschedule=True):
+        snapshot = self.metrics.snapshot()
+        self.tree.delete(*self.tree.get_children())
+        for name, summary in snapshot['histograms'].items():
+            self.tree.insert('', tk.END, text=name, values=[summary['count']] + [f"{summary[c]:.3f}" for c in self.COLUMNS[1:]])
+        for name, counts in snapshot['values'].items():
+            detail = ", ".join(f"{value}: {n}" for value, n in sorted(counts.items(), key=lambda item: str(item[0])))
+            self.tree.insert('', tk.END, text=f"{name} ({detail})", values=[sum(counts.values())])
+        if reschedule:
+            self._refresh_job = self.after(1000, self._refresh)
+
+    def _export(self, fmt):
+        path = filedialog.asksaveasfilename(parent=self, defaultextension=f".{fmt}",
+                                            initialfile=time.strftime(f"dd2_metrics_%Y%m%d_%H%M%S.{fmt}"),
+                                            filetypes=[(fmt.upper(), f"*.{fmt}")])
+        if not path:
+            return
         try:
-            current_style = windll.user32.GetWindowLongW(hwnd, win32con.GWL_EXSTYLE)
-            if enable:
-                new_style = current_style | win32con.WS_EX_LAYERED | win32con.WS_EX_TRANSPARENT
-                windll.user32.SetWindowLongW(hwnd, win32con.GWL_EXSTYLE, new_style)
-                
-                # Make the magenta background transparent
-                win32gui.SetLayeredWindowAttributes(hwnd, win32api.RGB(255, 0, 255), 0, win32con.LWA_COLORKEY)
-                
-                win32gui.SetWindowPos(hwnd, 0, 0, 0, 0, 0, win32con.SWP_NOMOVE | win32con.SWP_NOSIZE | win32con.SWP_NOZORDER | win32con.SWP_FRAMECHANGED)
-                self.is_click_through = True
-                self.master.update_status("Click-through enabled.")
+            if fmt == 'json':
+                self.metrics.export_json(path)
             else:
-                # To make it interactive again, remove the transparent style
-                new_style = current_style & ~win32con.WS_EX_TRANSPARENT
-                windll.user32.SetWindowLongW(hwnd, win32con.GWL_EXSTYLE, new_style)
-                win32gui.SetWindowPos(hwnd, 0, 0, 0, 0, 0, win32con.SWP_NOMOVE | win32con.SWP_NOSIZE | win32con.SWP_NOZORDER | win32con.SWP_FRAMECHANGED)
-                self.is_click_through = False
-                self.master.update_status("Click-through disabled.")
-        except Exception as e:
-            self.master.update_status(f"Error setting window style: {e}")
+                self.metrics.export_csv(path)
+            self.master.update_status(f"Exported metrics to: {path}")
+        except IOError as e:
+            self.master.update_status(f"Error exporting metrics to {path}: {e}")
+
+    def destroy(self):
+        if self._refresh_job:
+            self.after_cancel(self._refresh_job)
+            self._refresh_job = None
+        super().destroy()
 
 class WindowManager(tk.Tk): # Inherit from tk.Tk
     """
     Manages game window layout and input broadcasting based on an AHK script.
     Includes a GUI for control.
     """
-    def __init__(self):
-        super().__init__() # Call parent constructor
-        self.title("Zeb DD2 Script")
-        self.geometry("900x400") # Adjust size as needed
+    def __init__(self, backend=None, headless=False, report_startup=False, status_log_lines=2000, status_log_file=None):
+        # Headless: Tcl timers only, no widgets or display (benchmarks and simulation runs, see run_headless)
+        super().__init__(useTk=not headless) # Call parent constructor
+        self.headless = headless
+        self.closed = False
+        if not headless:
+            self.title("Zeb DD2 Script")
+            self.geometry("1100x400") # Adjust size as needed
 
         # Determine the application path for PyInstaller compatibility
         if getattr(sys, 'frozen', False):
@@ -173,70 +3337,220 @@ class WindowManager(tk.Tk): # Inherit from tk.Tk
             self.application_path = os.path.dirname(os.path.abspath(__file__))
 
         self.target_exe = "DunDefGame.exe"
-        self.main_w = 1720
-        self.main_h = 900
-        self.padding = 0
-        
-        self.dd2_windows = []  # List of HWNDs
+
+        # Hot-path timing probes, viewable in the Metrics panel; cheap enough to leave on
+        self.metrics = Metrics(enabled=True)
+        self.metrics_panel = None
+        self.startup_times = {} # Phase -> seconds: import, widgets, platform_import, init, discovery, first_layout
+        self.report_startup = report_startup # Print the breakdown once the first layout is done
+        self.startup_complete = threading.Event() # Set after the background discovery and first layout
+        self._record_startup('import', _IMPORT_STARTED, _IMPORT_FINISHED)
+
+        self.status_text = None # Initialize status_text to None
+        self.status_flush_ms = 50 # How often pending log lines are drawn (20 fps)
+        # status_log_lines: lines kept in the log area, older ones are trimmed; status_log_file: e.g.
+        # 'dd2_status.log' (relative to the application) to also keep a rotating log file
+        self.status_log = StatusLog(status_log_lines,
+                                    os.path.join(self.application_path, status_log_file) if status_log_file else None)
+        self._gui_thread = threading.current_thread() # Tk may only be touched from this thread
+        self._gui_calls = queue.SimpleQueue() # (func, args) marshalled from other threads, see _call_in_gui
+
+        # Paint the window before anything slow: platform imports, hotkeys and discovery come after
+        if not headless:
+            start = time.perf_counter()
+            self._apply_terminal_theme() # Apply the new theme
+            self.create_widgets() # New method to set up GUI
+            self.update() # First paint
+            self._record_startup('widgets', start)
+
+        start = time.perf_counter()
+        self.backend = backend or Win32Backend() # Imports pywin32, psutil and keyboard
+        self._record_startup('platform_import', start)
+        start = time.perf_counter()
+        # Cached DD2 window list, kept current by window/process notifications (see dd2_windows)
+        self.registry = DD2WindowRegistry(self.backend, self.target_exe, on_change=self._on_dd2_windows_changed,
+                                          metrics=self.metrics, on_message=self.update_status)
         self.main_window_index = 0
         self.last_main_hwnd = 0
+        # Background responsiveness probes; sends, layout and activation leave hung windows alone
+        self.health = HealthMonitor(self.backend, self.registry.hwnds, on_change=self._on_health_changed,
+                                    metrics=self.metrics)
+        self._layout_deferred = False # A layout skipped a hung window; it is reapplied when the window recovers
+        # Activation waits on foreground-change notifications instead of sleeping between retries
+        self.activation_timeout_ms = 250 # Overall deadline for one activation
+        self.activation_retry_ms = 50 # Foreground request is repeated if no notification arrives within this
         
+        # Click mirror: clicks in the main window are posted to the secondaries at the same relative spot.
+        # Its rects are refreshed with the box table (_rebuild_box_table) after every layout
+        self.click_mirror = ClickMirror(self.backend, self.health.is_hung, lambda: self.registry.foreground, self.metrics)
+
         self.select_mode = False
         self.mouse_listener = None
         
-        self.ahk_hook_ids = {} # All AHK style hotkey hook references
+        # AHK style hotkeys: bindings from the hotkey config file (or DEFAULT_HOTKEYS), compiled into a
+        # HotkeyTable behind one keyboard hook and recompiled when the file changes
         self.ahk_keybinds_enabled = True # Controls all AHK style hotkeys
+        self.hotkey_config_file = 'hotkeys_config.json'
+        self.hotkey_reload_ms = 1000 # How often the config file's mtime is checked
+        self.hotkey_table = None
+        self.hotkey_hook = None # Handle from backend.hook_keys while the keybinds are enabled
+        self._hotkey_config_stamp = None # (mtime, size) of the loaded config file, None for the defaults
 
-        self.broadcasting_hotkeys_enabled = True # Controls hotkeys for broadcasting (P, N, Y, G, PgUp, PgDn, B)
+        self._pending_rotation = 0 # Net rotate steps not yet applied, see _queue_rotation
+        self._rotation_lock = threading.Lock()
 
-        self.key_map = {
-            'g': ord('G'),
-            'esc': win32con.VK_ESCAPE,
-            'pgup': win32con.VK_PRIOR,
-            'pgdn': win32con.VK_NEXT,
-            'm': ord('M'),
-            'y': ord('Y'),
-        }
         self.key_delay_ms = 20 # From AHK script
+        self.broadcaster = KeyBroadcaster(self.backend, self.key_delay_ms, self.metrics)
+        # Hotkey callbacks only enqueue; broadcasts and rotation run on this thread
+        self.dispatcher = InputDispatcher(on_error=self._on_dispatch_error)
+        self.dispatcher.start()
+        self.metrics.attach('dispatch.enqueue_to_dispatch', self.dispatcher.dispatch_latency)
+        self.metrics.attach('dispatch.hook_callback', self.dispatcher.submit_time)
+
+        # Macros: record the main window's input (F11), replay it into the other clients (F12)
+        self.macro_file = 'macro.dd2m'
+        self.macro_speed = 1.0 # Replay speed factor; 2.0 replays twice as fast
+        self.macro_recorder = MacroRecorder(self.backend, ignore_vk=(VK_F11, VK_F12))
+        self.macro_player = MacroPlayer(self.backend, self.metrics)
+        self.macro = self._load_macro()
 
         self.g_presser_enabled = False
         self.inactive_sender_enabled = False
 
         self.intervalG = 1200 # Time between 'G' presses (in milliseconds)
         self.keyGSend = "g"   # The key to send for G-presser
-        self.g_presser_timer = None # For F7 functionality
-        self.inactive_sender_timer = None # For F10 functionality
-        self.mouse_controller = MouseController()
-        self.shopping_cycle_count = 0 # Track completed shopping box cycles
-        self.utility_box_cycle_index = 0 # New: Track which utility box to interact with (0 for box 2, 1 for box 3)
-        self.shopping_loop_id = None # Store the ID of the scheduled shopping loop
+        self.g_presser_phase_ms = 50 # Lands G presses in the inactive sender's idle gap
+        self.inactive_sender_interval = 100 # 100ms as per AHK script
+        self.inactive_sender_phase_ms = 0
+
+        # Periodic jobs (F7 / F10) run on their own thread against absolute deadlines
+        self.scheduler = PeriodicScheduler(on_error=self._on_scheduled_job_error)
+        self.scheduler.add_job('g_presser', self._g_presser_tick, self.intervalG, self.g_presser_phase_ms)
+        self.scheduler.add_job('inactive_sender', self._inactive_sender_tick, self.inactive_sender_interval,
+                               self.inactive_sender_phase_ms)
+        for job in self.scheduler.jobs():
+            self.metrics.attach(f"timer.{job.name}.period", job.period_hist)
+            self.metrics.attach(f"timer.{job.name}.lateness", job.lateness_hist)
+        self.scheduler.start()
+        # Auto-shopping runs as a coroutine script on its own loop (see SHOPPING_SCRIPT)
+        self.automation = AutomationEngine(self._call_in_gui)
+        self.shopping_script = SHOPPING_SCRIPT
+        self.shopping_task = None # Future of the running ShoppingRun
+        # 'main' shops in the main window with the real cursor; 'all' shops in every client at once in
+        # the background with posted input (PostedShoppingRun), leaving cursor and focus to the user
+        self.shopping_target = 'main'
+        self.shopping_progress = {} # hwnd (None for the main-window run) -> progress text for the GUI
+        # Adaptive pacing: each shopping step waits for the box region to react and settle, with the
+        # old fixed delays as upper bounds. Needs numpy; without it the fixed schedule is used.
+        self.adaptive_shopping = True
+        self.shopping_region_size = 48 # Pixels, square, centered on the box position
+        self.shopping_poll_ms = 30
+        self.shopping_pixel_tolerance = 24
+        self.shopping_change_fraction = 0.05
+        self.shopping_watch = None # RegionWatcher while auto-run is active
+        self.shopping_time_saved = 0.0 # Seconds saved vs the fixed schedule in this run
+        # Calibrate: finds the boxes in a capture of the main window by template matching (see ShopCalibrator)
+        self.calibration_file = 'calibration.npz' # Templates and per-resolution results
+        self.calibration_capture_file = 'calibration_capture.npy' # Last capture, replayable with --calibrate-image
+        self.save_calibration_capture = False # Whether each calibration writes that file (a few MB per capture)
+        self.calibrator = None # Loaded on first use; needs numpy
 
         # Shopping Mode state
         self.shopping_mode_state = "OFF" # OFF, SETUP, AUTO-RUN
         self.shopping_overlay = None
-        self.shopping_config_file = 'shopping_overlay_config.json'
-        self.status_text = None # Initialize status_text to None
-        self.box_positions = self._load_box_positions()
+        # Box positions, layout parameters (main_w/main_h/padding, mode, monitors) and optional hotkeys
+        # come from the active named profile; switching profiles swaps them without rebuilding the GUI
+        self.profile_file = 'profiles.json'
+        self.profile_reload_ms = 1000 # How often the profile file's mtime is checked
+        self.profile_reload_pending = False # Reloaded while shopping: applied when shopping mode is turned off
+        self.shopping_config_file = 'shopping_overlay_config.json' # Pre-profile config files, read until
+        self.layout_config_file = 'layout_config.json'              # the first profile save replaces them
+        self.box_table = None # BoxTransforms: every box in every window for the current layout, see _rebuild_box_table
+        self.profiles = ProfileStore(os.path.join(self.application_path, self.profile_file), on_message=self.update_status)
+        self._load_profiles()
+        self._show_profile()
         self.original_cursor_pos = None
         self.esc_hook_id = None # Initialize esc hotkey hook id
 
-        self._apply_terminal_theme() # Apply the new theme
-        self.refresh_monitor_work_area()
-        self.create_widgets() # New method to set up GUI
+        self.monitors = MonitorTopology(self.backend, on_change=self._on_display_changed)
+        self._pump_gui_calls()
+        self._flush_status_log()
+        self._refresh_runtime_stats()
+        self.after(self.profile_reload_ms, self._check_profiles)
+
+        # Find and apply initial window layout off the GUI thread. Queued ahead of any hotkey work,
+        # so rotations always see the discovered windows.
+        self.dispatcher.submit(self._startup_discovery)
         
         self._register_ahk_hotkeys()
-        self.ahk_keybinds_toggle_button.config(style='On.TButton') # Set initial style to 'On'
+        if not headless:
+            self.ahk_keybinds_toggle_button.config(style='On.TButton') # Set initial style to 'On'
         # All AHK hotkeys are now managed by _enable_ahk_keybinds, called by _register_ahk_hotkeys
 
-        # Find and apply initial window layout
-        self.find_dd2_windows()
-        self.apply_layout()
-
         self.update_status("DD2 Window Manager GUI Initialized.")
         self.update_status("Hotkeys: UP/DOWN to rotate main.")
+        self._show_macro_state()
 
         # Ensure the mainloop is running to process GUI events
-        self.protocol("WM_DELETE_WINDOW", self._on_closing)
+        if not headless:
+            self.protocol("WM_DELETE_WINDOW", self._on_closing)
+        self._record_startup('init', start)
+
+    def _record_startup(self, phase, start, end=None):
+        self.startup_times[phase] = seconds = (end or time.perf_counter()) - start
+        self.metrics.record(f"startup.{phase}", seconds)
+
+    def _startup_discovery(self):
+        """Monitor query, first window scan and first layout; runs on the dispatcher thread."""
+        try:
+            start = time.perf_counter()
+            self.refresh_monitor_work_area()
+            self.registry.start()
+            self.health.start()
+            self._record_startup('discovery', start)
+            start = time.perf_counter()
+            self.apply_layout()
+            self._record_startup('first_layout', start)
+        finally:
+            self.startup_complete.set()
+            self._call_in_gui(self._on_startup_complete)
+
+    def _on_startup_complete(self):
+        self.update_status(f"Startup complete: {len(self.registry)} DD2 windows found and laid out.")
+        self._show_window_count()
+        if self.report_startup:
+            breakdown = ", ".join(f"{phase} {seconds * 1e3:.0f}ms" for phase, seconds in self.startup_times.items())
+            report = f"Startup times: {breakdown}; {(time.perf_counter() - _IMPORT_STARTED) * 1e3:.0f}ms to first layout."
+            self.update_status(report)
+            print(report)
+
+    def _show_window_count(self):
+        if not self.headless:
+            self.windows_status_label.config(text=f"DD2 Windows: {len(self.registry)}")
+
+    def _on_health_changed(self, hwnd, old, new):
+        """HealthMonitor callback (monitor thread)."""
+        client = self.health.clients.get(hwnd)
+        if new == 'hung':
+            self.update_status(f"Window {hwnd} is not responding; skipping it for sends, layout and activation.")
+        elif new == 'slow':
+            self.update_status(f"Window {hwnd} is slow to respond ({client.latency * 1000:.0f}ms).")
+        else:
+            self.update_status(f"Window {hwnd} is responding again.")
+        if old == 'hung' and self._layout_deferred:
+            self.dispatcher.submit(self.apply_layout) # Put it where the skipped layout wanted it
+        self._call_in_gui(self._show_health)
+
+    def _show_health(self):
+        if self.headless:
+            return
+        counts = self.health.summary()
+        text = f"Health: {counts['ok']} ok"
+        if counts['slow']:
+            text += f", {counts['slow']} slow"
+        if counts['hung']:
+            text += f", {counts['hung']} hung"
+        self.health_status_label.config(text=text, style='Warning.TLabel' if counts['hung'] else 'Status.TLabel')
 
     def _apply_terminal_theme(self):
         """Creates and applies a custom 'cool terminal' theme using Catppuccin Mocha colors."""
@@ -245,6 +3559,7 @@ class WindowManager(tk.Tk): # Inherit from tk.Tk
             'fg': '#CDD6F4',  # Catppuccin Mocha: Text (main foreground)
             'bg_alt': '#181825', # Catppuccin Mocha: Mantle (for text area background)
             'fg_alt': '#A6E3A1', # Catppuccin Mocha: Green (for accents/status labels)
+            'fg_warn': '#F38BA8', # Catppuccin Mocha: Red (for warnings, e.g. hung windows)
             'font': ('Consolas', 10),
             'font_bold': ('Consolas', 10, 'bold')
         }
@@ -277,6 +3592,7 @@ class WindowManager(tk.Tk): # Inherit from tk.Tk
         # Label
         style.configure('TLabel', foreground=self.theme['fg']) # Default labels use main foreground
         style.configure('Status.TLabel', foreground=self.theme['fg_alt']) # Status labels use accent foreground
+        style.configure('Warning.TLabel', foreground=self.theme['fg_warn'])
 
         # Button
         style.configure('TButton',
@@ -335,6 +3651,12 @@ class WindowManager(tk.Tk): # Inherit from tk.Tk
         hotkey_frame = ttk.LabelFrame(control_panels_container, text="[ HOTKEY STATUS ]", padding=10)
         hotkey_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=(0, 5))
 
+        self.windows_status_label = ttk.Label(hotkey_frame, text="DD2 Windows: searching...", style='Status.TLabel')
+        self.windows_status_label.pack(anchor=tk.W, pady=2)
+
+        self.health_status_label = ttk.Label(hotkey_frame, text="Health: -", style='Status.TLabel')
+        self.health_status_label.pack(anchor=tk.W, pady=2)
+
         self.ahk_keybinds_status_label = ttk.Label(hotkey_frame, text="AHK Keybinds: ENABLED", style='Status.TLabel')
         self.ahk_keybinds_status_label.pack(anchor=tk.W, pady=2)
         
@@ -343,10 +3665,19 @@ class WindowManager(tk.Tk): # Inherit from tk.Tk
 
         self.inactive_sender_status_label = ttk.Label(hotkey_frame, text="Inactive Sender (F10): OFF", style='Status.TLabel')
         self.inactive_sender_status_label.pack(anchor=tk.W, pady=2)
+
+        self.click_mirror_status_label = ttk.Label(hotkey_frame, text="Click Mirror: OFF", style='Status.TLabel')
+        self.click_mirror_status_label.pack(anchor=tk.W, pady=2)
         
         ttk.Label(hotkey_frame, text="Select Window (F8)").pack(anchor=tk.W, pady=2)
         ttk.Label(hotkey_frame, text="Emergency Kill (F9)").pack(anchor=tk.W, pady=2)
 
+        self.dispatch_stats_label = ttk.Label(hotkey_frame, text="Dispatch: idle", style='Status.TLabel')
+        self.dispatch_stats_label.pack(anchor=tk.W, pady=2)
+
+        self.scheduler_stats_label = ttk.Label(hotkey_frame, text="Timers: idle", style='Status.TLabel')
+        self.scheduler_stats_label.pack(anchor=tk.W, pady=2)
+
         # --- Actions (middle) ---
         actions_frame = ttk.LabelFrame(control_panels_container, text="[ ACTIONS ]", padding=10)
         actions_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=5)
@@ -360,8 +3691,31 @@ class WindowManager(tk.Tk): # Inherit from tk.Tk
         self.inactive_sender_toggle_button = ttk.Button(actions_frame, text="Toggle Inactive Sender", command=self._toggle_inactive_sender_gui)
         self.inactive_sender_toggle_button.pack(fill=tk.X, pady=4)
 
+        self.click_mirror_toggle_button = ttk.Button(actions_frame, text="Toggle Click Mirror", command=self.toggle_click_mirror)
+        self.click_mirror_toggle_button.pack(fill=tk.X, pady=4)
+
         ttk.Button(actions_frame, text="Refresh DD2 Windows", command=self._refresh_dd2_windows).pack(fill=tk.X, pady=4)
+        ttk.Button(actions_frame, text="Metrics", command=self._open_metrics_panel).pack(fill=tk.X, pady=4)
 
+        # Profiles: box sets, layout and hotkeys; values are filled in once the profile file is loaded
+        profile_row = ttk.Frame(actions_frame)
+        profile_row.pack(fill=tk.X, pady=4)
+        self.profile_combo = ttk.Combobox(profile_row, state='readonly', width=14)
+        self.profile_combo.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.profile_combo.bind('<<ComboboxSelected>>', lambda event: self.switch_profile(self.profile_combo.get()))
+        ttk.Button(profile_row, text="New...", command=self.save_profile_as).pack(side=tk.LEFT, padx=(4, 0))
+
+
+        # --- Macro ---
+        macro_frame = ttk.LabelFrame(control_panels_container, text="[ MACRO ]", padding=10)
+        macro_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=5)
+
+        self.macro_status_label = ttk.Label(macro_frame, text="Macro: none", style='Status.TLabel')
+        self.macro_status_label.pack(anchor=tk.W, pady=2)
+
+        ttk.Button(macro_frame, text="Record / Stop (F11)", command=self.toggle_macro_recording).pack(fill=tk.X, pady=4)
+        ttk.Button(macro_frame, text="Replay to Others (F12)", command=lambda: self.replay_macro('others')).pack(fill=tk.X, pady=4)
+        ttk.Button(macro_frame, text="Replay to All", command=lambda: self.replay_macro('all')).pack(fill=tk.X, pady=4)
 
         # --- Shopping Mode (rightmost) ---
         shopping_frame = ttk.LabelFrame(control_panels_container, text="[ SHOPPING MODE ]", padding=10)
@@ -373,280 +3727,728 @@ class WindowManager(tk.Tk): # Inherit from tk.Tk
         self.shopping_toggle_button = ttk.Button(shopping_frame, text="Enable Shopping", command=self._toggle_shopping_mode)
         self.shopping_toggle_button.pack(fill=tk.X, pady=4)
 
+        ttk.Button(shopping_frame, text="Calibrate", command=self.calibrate_shop_boxes).pack(fill=tk.X, pady=4)
+
+        self.shopping_target_button = ttk.Button(shopping_frame, text="Target: Main Window", command=self._toggle_shopping_target)
+        self.shopping_target_button.pack(fill=tk.X, pady=4)
+
+        self.shopping_progress_label = ttk.Label(shopping_frame, text="", style='Status.TLabel', justify=tk.LEFT)
+        self.shopping_progress_label.pack(anchor=tk.W, pady=2)
+
     def update_status(self, message):
-        """Updates the log area in the GUI or prints to console if GUI not ready."""
-        timestamp = time.strftime("[%H:%M:%S]")
-        formatted_message = f"{timestamp} {message}"
-        if self.status_text: # Check if the widget has been created
-            self.status_text.config(state=tk.NORMAL)
-            self.status_text.insert(tk.END, formatted_message + "\n")
-            self.status_text.see(tk.END) # Scroll to the end
-            self.status_text.config(state=tk.DISABLED)
-        else:
+        """Queues a line for the log area (drawn by _flush_status_log). Safe to call from any thread."""
+        formatted_message = self.status_log.append(message)
+        if not self.status_text and not self.headless:
             print(formatted_message) # Print to console during early initialization
 
-    def _load_box_positions(self):
-        """Loads box positions from the config file."""
-        default_shopping_positions = [{'x': 50 + (i * 60), 'y': 50} for i in range(8)]
-        default_utility_positions = [{'x': 50 + (i * 60), 'y': 150} for i in range(3)] # Changed range to 3
-        default_all_positions = {
-            'shopping_boxes': default_shopping_positions,
-            'utility_boxes': default_utility_positions
-        }
+    def _flush_status_log(self):
+        """Draws pending log lines in one batched insert and trims the widget to the line cap."""
+        tail, lines = self.status_log.drain()
+        if self.status_text and (tail is not None or lines): # Headless: drained for the file sink only
+            text = self.status_text
+            text.config(state=tk.NORMAL)
+            if tail is not None: # A repeated message: rewrite its count on the last line
+                text.delete("end-2l linestart", "end-1c")
+                text.insert(tk.END, tail + "\n")
+            if lines:
+                text.insert(tk.END, "\n".join(lines) + "\n")
+            line_count = int(text.index("end-1c").split(".")[0]) - 1
+            if line_count > self.status_log.max_lines:
+                text.delete("1.0", f"{line_count - self.status_log.max_lines + 1}.0")
+            text.see(tk.END) # Scroll to the end
+            text.config(state=tk.DISABLED)
+        self.after(self.status_flush_ms, self._flush_status_log)
+
+    def _call_in_gui(self, func, *args):
+        """Runs func(*args) on the Tk thread: immediately if already there, otherwise via _pump_gui_calls."""
+        if threading.current_thread() is self._gui_thread:
+            func(*args)
+        else:
+            self._gui_calls.put((func, args))
+
+    def _pump_gui_calls(self):
+        """Drains calls marshalled from hotkey, listener and dispatcher threads. A failing call is logged, not fatal."""
+        try:
+            while True:
+                try:
+                    func, args = self._gui_calls.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    func(*args)
+                except Exception as e:
+                    self.update_status(f"Error in {getattr(func, '__name__', func)}: {e}")
+        finally:
+            self.after(15, self._pump_gui_calls)
+
+    def _on_dispatch_error(self, command, error):
+        self.update_status(f"Error running hotkey action {getattr(command.action, '__name__', command.action)}: {error}")
+
+    def _open_metrics_panel(self):
+        if self.metrics_panel and self.metrics_panel.winfo_exists():
+            self.metrics_panel.lift()
+            return
+        self.metrics_panel = MetricsPanel(self, self.metrics)
+
+    def _on_scheduled_job_error(self, job, error):
+        self.update_status(f"Error in timer '{job.name}': {error}")
+
+    def _refresh_runtime_stats(self):
+        """
+        Shows dispatcher health (queue depth, enqueue-to-dispatch latency, hook callback cost, drops)
+        and the achieved period and jitter of every running timer.
+        """
+        if self.headless:
+            return
+        d = self.dispatcher
+        if d.stats['submitted']:
+            self.dispatch_stats_label.config(
+                text=f"Dispatch: depth {d.depth} | p99 {d.dispatch_latency.percentile(99) * 1e3:.1f}ms"
+                     f" | hook {d.submit_time.percentile(99) * 1e6:.0f}us | dropped {d.stats['dropped']}"
+                     f" | coalesced {d.stats['coalesced']} | rate-limited {d.stats['rate_limited']}"
+                     f" | repeats ignored {self.hotkey_table.repeats_ignored}")
+        timers = []
+        for job in self.scheduler.jobs():
+            if job.enabled and job.runs > 1:
+                stats = job.summary()
+                timers.append(f"{job.name} {stats['achieved_period_ms']:.1f}ms (jitter {stats['jitter_p99_ms']:.2f}ms)")
+        self.scheduler_stats_label.config(text="Timers: " + (" | ".join(timers) if timers else "idle"))
+        self.after(1000, self._refresh_runtime_stats)
+
+    def _load_profiles(self):
+        """Loads the profile file and applies the active profile. Without one, the pre-profile config files become 'default'."""
+        path = self.profiles.path
+        if self.profiles.load():
+            self.update_status(f"Loaded {len(self.profiles.names())} profile(s) from {path}; active '{self.profiles.active}'.")
+        else:
+            if os.path.exists(path): # Unreadable: keep it for inspection instead of saving over it
+                try:
+                    os.replace(path, path + '.bad')
+                    self.update_status(f"Moved the unreadable profile file to {path}.bad.")
+                except OSError as e:
+                    self.update_status(f"Error moving the unreadable profile file to {path}.bad: {e}")
+            raw = {}
+            for section, file_name in (('box_positions', self.shopping_config_file), ('layout', self.layout_config_file)):
+                config_full_path = os.path.join(self.application_path, file_name)
+                if not os.path.exists(config_full_path):
+                    continue
+                try:
+                    with open(config_full_path, 'r') as f:
+                        raw[section] = json.load(f)
+                    self.update_status(f"Using {config_full_path} for profile 'default'.")
+                except (json.JSONDecodeError, IOError) as e:
+                    self.update_status(f"Error loading {config_full_path}: {e}. Using defaults for it.")
+            profile, problems = validate_profile(raw)
+            for problem in problems:
+                self.update_status(f"Profile 'default': {problem}; using the default.")
+            self.profiles.profiles['default'] = profile # Written with the first change, not on every start
+            self.profiles.active = 'default'
+        self._apply_profile(self.profiles.get())
+
+    def _apply_profile(self, profile):
+        """Points the live settings at a profile's sections. Callers reapply the layout and hotkeys."""
+        layout = profile['layout']
+        self.main_w, self.main_h, self.padding = layout['main_w'], layout['main_h'], layout['padding']
+        self.layout_mode = layout['mode']
+        self.layout_template = layout['template']
+        self.main_monitor = layout['main_monitor'] # Monitor index for the main window (0 = primary)
+        # Secondaries are tiled here if it differs
+        self.secondary_monitor = layout['main_monitor'] if layout['secondary_monitor'] is None else layout['secondary_monitor']
+        self._rebuild_box_table()
+
+    def _main_client_rect(self):
+        """Client rect of the main window; before there is one, where a window of the layout's size would put it."""
+        if self.last_main_hwnd and self.registry.get(self.last_main_hwnd):
+            return self.registry.client_rect(self.last_main_hwnd)
+        left, top = getattr(self, 'm_left', 0), getattr(self, 'm_top', 0)
+        return left, top, left + self.main_w, top + self.main_h
+
+    def _rebuild_box_table(self):
+        """
+        Maps the active profile's box positions into every DD2 window's client area, after a layout, box
+        or profile change. self.box_positions becomes the main window's row (screen pixels) of the table.
+        """
+        boxes = self.profiles.get()['box_positions']
+        main_rect = self._main_client_rect()
+        if any('x' in box for kind in boxes for box in boxes[kind]):
+            if not (self.last_main_hwnd and self.registry.get(self.last_main_hwnd)):
+                self.box_positions = boxes # Older absolute positions are still right until the layout places a window
+                return
+            boxes = self._migrate_box_positions(boxes, main_rect)
+        rects = {client.hwnd: self.registry.client_rect(client.hwnd) for client in self.registry.clients()}
+        rects.setdefault(self.last_main_hwnd, main_rect)
+        # Utility boxes are clicked in the middle; the overlay's pixel size is for the main window
+        half = ShoppingOverlay.UTILITY_SIZE // 2
+        centers = {'utility_boxes': (half / max(1, main_rect[2] - main_rect[0]), half / max(1, main_rect[3] - main_rect[1]))}
+        self.box_table = BoxTransforms(boxes, rects, centers)
+        self.box_positions = self.box_table.positions(self.last_main_hwnd)
+        self.click_mirror.set_rects(self.last_main_hwnd, rects)
+
+    def _migrate_box_positions(self, boxes, rect):
+        """Converts absolute box positions to fractions of `rect` (the main window's client area) and stores them."""
+        left, top, right, bottom = rect
+        width, height = max(1, right - left), max(1, bottom - top)
+        migrated = {kind: [{'u': round((box['x'] - left) / width, 5), 'v': round((box['y'] - top) / height, 5)} if 'x' in box else box
+                           for box in boxes[kind]] for kind in boxes}
+        self.profiles.update(self.profiles.active, box_positions=migrated)
+        self.update_status(f"Converted the box positions of profile '{self.profiles.active}' to window-relative positions "
+                           f"({width}x{height} main window at {left},{top}).")
+        return self.profiles.get()['box_positions']
 
-        config_full_path = os.path.join(self.application_path, self.shopping_config_file)
-        self.update_status(f"Attempting to load box configurations from: {config_full_path}")
+    def _follow_main_window(self, hwnd):
+        """Rebuilds the box table if `hwnd` is no longer where the table has it (moved or resized outside the layout)."""
+        rect = self.backend.get_window_rect(hwnd)
+        client = self.registry.get(hwnd)
+        if client and client.rect != rect:
+            self.registry.update_rect(hwnd, rect)
+            self._rebuild_box_table()
 
-        if not os.path.exists(config_full_path):
-            self.update_status(f"Config file not found at {config_full_path}. Using defaults for all boxes.")
-            return default_all_positions
+    def _reapply_profile(self):
+        """After the active profile changed: hotkeys are recompiled and the layout reapplied; widgets stay as they are."""
+        self._apply_profile(self.profiles.get())
+        self._reload_hotkeys(force=True)
+        self.dispatcher.submit(self._reapply_layout)
+        self._show_profile()
+
+    def switch_profile(self, name):
+        """Makes another profile active. Returns False (and logs why) if it can't."""
+        if self.shopping_mode_state != "OFF": # The overlay and a running script hold the current boxes
+            self.update_status("Turn shopping mode off before switching profiles.")
+            self._show_profile()
+            return False
         try:
-            with open(config_full_path, 'r') as f:
-                loaded_positions = json.load(f)
-            # Basic validation: ensure it's a dict and contains expected keys/lists
-            if (isinstance(loaded_positions, dict) and
-                'shopping_boxes' in loaded_positions and isinstance(loaded_positions['shopping_boxes'], list) and len(loaded_positions['shopping_boxes']) == 8 and
-                'utility_boxes' in loaded_positions and isinstance(loaded_positions['utility_boxes'], list) and len(loaded_positions['utility_boxes']) == 3): # Changed length to 3
-                self.update_status("Loaded all box positions from config.")
-                return loaded_positions
+            self.profiles.activate(name)
+        except KeyError:
+            self.update_status(f"Unknown profile '{name}'.")
+            return False
+        self._reapply_profile()
+        self.update_status(f"Switched to profile '{name}'.")
+        return True
+
+    def next_profile(self):
+        names = self.profiles.names()
+        if len(names) > 1:
+            self.switch_profile(names[(names.index(self.profiles.active) + 1) % len(names)])
+
+    def save_profile_as(self, name=None):
+        """Copies the active profile under a new name and switches to it; asks for the name from the GUI."""
+        if name is None:
+            name = simpledialog.askstring("New Profile", "Name for a copy of the current profile:", parent=self)
+        name = (name or '').strip()
+        if not name:
+            return False
+        if name in self.profiles:
+            self.update_status(f"Profile '{name}' already exists.")
+            return False
+        self.profiles.put(name, self.profiles.get())
+        return self.switch_profile(name)
+
+    def _check_profiles(self):
+        if self.closed:
+            return
+        if self.profiles.reload_if_changed():
+            if self.shopping_mode_state != "OFF": # The overlay and a running script hold the current boxes
+                self.profile_reload_pending = True
+                self.update_status(f"Profiles reloaded from {self.profiles.path}; applied when shopping mode is turned off.")
             else:
-                self.update_status("Config file for box positions is malformed or incomplete. Using defaults for all boxes.")
-                return default_all_positions
-        except (json.JSONDecodeError, IOError) as e:
-            self.update_status(f"Error loading box configurations from {config_full_path}: {e}. Using defaults for all boxes.")
-            return default_all_positions
+                self.update_status(f"Profiles reloaded from {self.profiles.path}; active '{self.profiles.active}'.")
+                self._reapply_profile()
+        self.after(self.profile_reload_ms, self._check_profiles)
+
+    def _show_profile(self):
+        if self.headless:
+            return
+        self.profile_combo.config(values=self.profiles.names())
+        self.profile_combo.set(self.profiles.active)
+
+    def _load_macro(self):
+        """Loads the saved macro, or returns None if there is none (or it can't be read)."""
+        macro_full_path = os.path.join(self.application_path, self.macro_file)
+        if not os.path.exists(macro_full_path):
+            return None
+        try:
+            macro = MacroTimeline.load(macro_full_path)
+        except (IOError, EOFError, ValueError, struct.error) as e:
+            self.update_status(f"Error loading macro from {macro_full_path}: {e}")
+            return None
+        self.update_status(f"Loaded macro: {len(macro)} events, {macro.duration:.1f}s.")
+        return macro
 
     def _save_box_positions(self, positions_dict): # Renamed argument for clarity
-        """Saves box positions to the config file."""
-        config_full_path = os.path.join(self.application_path, self.shopping_config_file)
+        """
+        Stores box positions, given in screen pixels over the main window, in the active profile as fractions
+        of the main window's client area. The profile file is written shortly after (debounced).
+        """
+        left, top, right, bottom = self._main_client_rect()
+        width, height = max(1, right - left), max(1, bottom - top)
+        normalized = {kind: [{'u': round((p['x'] - left) / width, 5), 'v': round((p['y'] - top) / height, 5)} for p in positions]
+                      for kind, positions in positions_dict.items()}
+        for problem in self.profiles.update(self.profiles.active, box_positions=normalized):
+            self.update_status(f"Box positions: {problem}; using the default.")
+        self._rebuild_box_table()
+        self.update_status(f"Saved all box positions to profile '{self.profiles.active}'.")
+
+    def _report_shopping_box(self, box_index, elapsed, fixed_ms):
+        """Logs how long a box took against the fixed schedule; called from the automation loop."""
+        saved = fixed_ms / 1000.0 - elapsed
+        self.shopping_time_saved += saved
+        self.metrics.record('shopping.box_time', elapsed)
+        self.update_status(f"Box {box_index + 1} took {elapsed:.2f}s (fixed schedule {fixed_ms / 1000.0:.1f}s, "
+                           f"saved {saved:.2f}s; {self.shopping_time_saved:.1f}s this run).")
+
+    def calibrate_shop_boxes(self):
+        """
+        Calibrate action: locates the shop slots and utility buttons in the main window and makes them
+        the box positions. The first run has no templates yet and cuts them around the placed boxes.
+        """
+        if self.shopping_mode_state == "AUTO-RUN":
+            self.update_status("Stop auto-shopping before calibrating.")
+            return
+        if not _load_numpy():
+            self.update_status("numpy is not installed; calibration is unavailable.")
+            return
+        if self.shopping_overlay: # What has been dragged so far is the placement to learn from
+            self._save_box_positions(self.shopping_overlay.get_box_positions())
+        self.dispatcher.submit(self._run_calibration)
+
+    def _load_calibrator(self):
+        if self.calibrator is None:
+            calibrator = ShopCalibrator(os.path.join(self.application_path, self.calibration_file))
+            try:
+                calibrator.load()
+            except (OSError, ValueError, KeyError) as e:
+                self.update_status(f"Error loading calibration from {calibrator.path}: {e}. Starting without templates.")
+            self.calibrator = calibrator
+        return self.calibrator
+
+    def _run_calibration(self):
+        """Dispatcher thread: captures the main window and matches; the positions are applied on the Tk thread."""
+        hwnds = self.dd2_windows
+        if not hwnds:
+            self.update_status("Calibration: no DD2 windows found.")
+            return
+        hwnd = hwnds[self.main_window_index % len(hwnds)]
+        if not self._activate_window(hwnd): # The capture reads the screen, so the window must be on top
+            self.update_status("Calibration: the main window could not be brought to the foreground.")
+            return
+        left, top, right, bottom = self.registry.client_rect(hwnd) # The game's surface: no frame, same box fractions
+        capture = numpy.empty((bottom - top, right - left, 4), numpy.uint8)
+        self.backend.capture_region((left, top, right, bottom), capture)
+        calibrator = self._load_calibrator()
         try:
-            with open(config_full_path, 'w') as f:
-                json.dump(positions_dict, f, indent=4)
-            self.update_status(f"Saved all box positions to: {config_full_path}")
-        except IOError as e:
-            self.update_status(f"Error saving box configurations to {config_full_path}: {e}")
-
-    def _shopping_loop(self, step_index=0, box_index=0):
-        """The main non-blocking loop for auto-shopping, broken into granular steps."""
-        if self.shopping_mode_state != "AUTO-RUN":
-            self.update_status("Stopping shopping loop (early exit).")
-            if self.original_cursor_pos:
-                win32api.SetCursorPos(self.original_cursor_pos)
-            self.shopping_loop_id = None # Clear ID as we are stopping
-            return
-
-        if step_index == 0: # Start of a new box interaction (move mouse)
-            if box_index < len(self.box_positions['shopping_boxes']):
-                pos = self.box_positions['shopping_boxes'][box_index]
-                self.update_status(f"Auto-shopping at box {box_index + 1}: ({pos['x']}, {pos['y']})")
-                self.mouse_controller.position = (pos['x'], pos['y'])
-                self.shopping_loop_id = self.after(100, self._shopping_loop, 1, box_index) # Move to step 1 (first Enter) after 100ms
-            else:
-                # All shopping boxes processed for this cycle, proceed to utility boxes
-                self.update_status("All shopping boxes processed in this cycle.")
-                self.shopping_loop_id = self.after(100, self._shopping_loop, 5) # Move to utility box interaction (step 5) after 100ms
-        
-        elif step_index == 1: # First Enter
-            keyboard.press_and_release('enter')
-            self.shopping_loop_id = self.after(1000, self._shopping_loop, 2, box_index) # Move to step 2 (second Enter) after 1s
-            
-        elif step_index == 2: # Second Enter
-            keyboard.press_and_release('enter')
-            self.shopping_loop_id = self.after(1000, self._shopping_loop, 3, box_index) # Move to step 3 (third Enter) after 1s
-            
-        elif step_index == 3: # Third Enter
-            keyboard.press_and_release('enter')
-            self.update_status(f"Finished box {box_index+1}. Waiting before next box (15 seconds).")
-            self.shopping_loop_id = self.after(15000, self._shopping_loop, 0, box_index + 1) # Move to next box (step 0 for next box) after 15s
-            
-        elif step_index == 5: # Utility box interaction
-            # --- New logic for utility boxes ---
-            if self.utility_box_cycle_index == 0: # Current cycle needs utility box 2
-                self.update_status("Interacting with Utility Box 2.")
-                self._interact_with_utility_box(2) # Interact with utility box 2
-                self.utility_box_cycle_index = 1 # Set next cycle to utility box 3
-            else: # Current cycle needs utility box 3
-                self.update_status("Interacting with Utility Box 3.")
-                self._interact_with_utility_box(3) # Interact with utility box 3
-                self.utility_box_cycle_index = 0 # Set next cycle to utility box 2
-
-            self.shopping_cycle_count += 1 # Increment cycle count after utility box interaction
-
-            if self.shopping_cycle_count >= 3: # Stop after 3 full cycles (Utility Box 3 interacted with, and 3rd shopping pass initiated)
-                self.update_status("Completed all shopping and utility box interactions, and final shopping pass. Stopping auto-shopping.")
-                if self.shopping_loop_id:
-                    self.after_cancel(self.shopping_loop_id) # Cancel any pending after call
-                self.shopping_loop_id = None # Clear ID
-                self._toggle_shopping_mode() # Transition to OFF state
-            else:
-                self.update_status("Restarting shopping sequence from box 1.")
-                self.shopping_loop_id = self.after(1000, self._shopping_loop, 0, 0) # Restart shopping loop (step 0, box 0) after 1s
+            if self.save_calibration_capture:
+                numpy.save(os.path.join(self.application_path, self.calibration_capture_file), capture)
+            if calibrator.templates is None:
+                relative = {kind: [(p['x'] - left, p['y'] - top) for p in self.box_positions[kind]] for kind, _ in ShopCalibrator.KINDS}
+                calibrator.save_templates(capture, relative)
+                calibrator.save()
+                self.update_status(f"Calibration templates cut from the current box placement at {right - left}x{bottom - top}. "
+                                   "Calibrate again after the resolution or window size changes.")
+                return
+            searches = calibrator.stats['searches']
+            start = time.perf_counter()
+            found = calibrator.locate(capture, {kind: len(self.box_positions[kind]) for kind, _ in ShopCalibrator.KINDS})
+            elapsed = time.perf_counter() - start
+            searched = calibrator.stats['searches'] != searches
+            if searched:
+                calibrator.save()
+        except (OSError, ValueError) as e:
+            self.update_status(f"Calibration failed: {e}")
+            return
+        self.metrics.record('calibration.locate', elapsed)
+        positions = {kind: [{'x': left + x, 'y': top + y} for x, y in found[kind]] for kind, _ in ShopCalibrator.KINDS}
+        self._call_in_gui(self._apply_calibration, positions)
+        self.update_status(f"Calibrated {sum(len(p) for p in positions.values())} boxes at {right - left}x{bottom - top} "
+                           f"in {elapsed * 1000:.1f}ms ({'searched' if searched else 'cached result confirmed'}).")
+
+    def _apply_calibration(self, positions):
+        self._save_box_positions(positions)
+        if self.shopping_overlay: # Show the found boxes in the open editor
+            self.shopping_overlay.destroy()
+            self.shopping_overlay = ShoppingOverlay(self, initial_positions=self.box_positions,
+                                                    refresh_hz=self.backend.get_refresh_rate())
+
+    def _on_shopping_done(self, task):
+        """Done callback of a ShoppingRun (on the Tk thread): a finished run switches shopping OFF."""
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error:
+            self.update_status(f"Auto-shopping failed: {error}")
+        if task is self.shopping_task and self.shopping_mode_state == "AUTO-RUN":
+            self._toggle_shopping_mode()
 
     def _toggle_shopping_mode(self):
         """Cycles through the shopping mode states: OFF -> SETUP -> AUTO-RUN -> OFF."""
         if self.shopping_mode_state == "OFF":
-            self.shopping_overlay = ShoppingOverlay(self, initial_positions=self.box_positions)
-            self.shopping_mode_state = "SETUP"
-            self.shopping_toggle_button.config(text="Start Auto-Shop")
-            self.shopping_status_label.config(text="Status: SETUP")
+            if not self.headless: # Headless runs shop at the saved box positions
+                self.shopping_overlay = ShoppingOverlay(self, initial_positions=self.box_positions,
+                                                        refresh_hz=self.backend.get_refresh_rate())
+            self._set_shopping_state("SETUP", "Start Auto-Shop")
             self.update_status("Shopping overlay enabled. Drag squares to position them.")
 
         elif self.shopping_mode_state == "SETUP":
-            if self.shopping_overlay:
-                self.box_positions = self.shopping_overlay.get_box_positions()
-                self._save_box_positions(self.box_positions)
-                self.shopping_overlay.set_click_through(True)
-            
-            for square in self.shopping_overlay.utility_squares:
-                square.place_forget()
-            self.update_status("Utility boxes hidden.")
-            
-            self.shopping_mode_state = "AUTO-RUN"
-            self.shopping_toggle_button.config(text="Stop Auto-Shop")
-            self.shopping_status_label.config(text="Status: AUTO-RUN")
+            if self.shopping_overlay: # Unmapped for the whole run: nothing is composited over the game
+                self._save_box_positions(self.shopping_overlay.get_box_positions())
+                self.shopping_overlay.destroy()
+                self.shopping_overlay = None
+                self.update_status("Shopping overlay closed for the run.")
+
+            self._set_shopping_state("AUTO-RUN", "Stop Auto-Shop")
+            self.shopping_time_saved = 0.0
+            self.shopping_watch = None
+            self.shopping_progress = {}
+            if self.shopping_target == 'all':
+                self._start_background_shopping()
+                return
             self.update_status("Auto-shopping started.")
-            
-            if self.dd2_windows and len(self.dd2_windows) > self.main_window_index:
-                self._activate_window(self.dd2_windows[self.main_window_index])
-                time.sleep(0.1)
+            if self.adaptive_shopping:
+                if _load_numpy():
+                    self.shopping_watch = RegionWatcher(self.backend, self.shopping_region_size,
+                                                        self.shopping_pixel_tolerance, self.shopping_change_fraction)
+                else:
+                    self.update_status("numpy is not installed; auto-shopping uses the fixed schedule.")
 
-            self.original_cursor_pos = win32api.GetCursorPos()
-            self.esc_hook_id = keyboard.add_hotkey('esc', self._handle_esc_press)
+            self.original_cursor_pos = self.backend.get_cursor_pos()
+            self.click_mirror.paused = True # The run's own clicks stay in the main window
+            self.esc_hook_id = self.backend.add_hotkey('esc', self._call_in_gui, args=(self._handle_esc_press,))
             self.update_status("Hotkeys: ESC to stop auto-shopping.")
-            self._shopping_loop(0, 0)
+            self.shopping_task = self.automation.submit(ShoppingRun(self, self.shopping_script, self.shopping_watch).run())
+            self.shopping_task.add_done_callback(lambda task: self._call_in_gui(self._on_shopping_done, task))
 
         elif self.shopping_mode_state == "AUTO-RUN":
-            if self.shopping_overlay:
-                self.shopping_overlay.destroy()
-                self.shopping_overlay = None
+            self.automation.cancel() # Stops at the current await; the run restores the cursor
+            self.shopping_task = None
+            self.shopping_watch = None
+            self.click_mirror.paused = False
 
-            if self.shopping_loop_id:
-                self.after_cancel(self.shopping_loop_id)
-                self.shopping_loop_id = None
-
-            self.shopping_mode_state = "OFF"
-            self.shopping_toggle_button.config(text="Enable Shopping")
-            self.shopping_status_label.config(text="Status: OFF")
+            self._set_shopping_state("OFF", "Enable Shopping")
             self.update_status("Auto-shopping stopped.")
-            self.shopping_cycle_count = 0
             
             if self.esc_hook_id:
-                keyboard.remove_hotkey(self.esc_hook_id)
+                self.backend.remove_hotkey(self.esc_hook_id)
                 self.esc_hook_id = None
 
-    def _handle_esc_press(self):
-        """Handler for Esc key press to stop auto-shopping."""
-        if self.shopping_mode_state == "AUTO-RUN":
-            self.update_status("ESC pressed. Stopping auto-shopping.")
+    def _start_background_shopping(self):
+        """AUTO-RUN with target 'all': one PostedShoppingRun per responsive client, all on the automation loop."""
+        self.original_cursor_pos = None # Nothing to hand back: the cursor is never moved
+        hwnds = [hwnd for hwnd in self.health.responsive(self.dd2_windows) if self.box_table and hwnd in self.box_table]
+        if not hwnds:
+            self.update_status("Background shopping: no responsive DD2 windows.")
             self._toggle_shopping_mode()
+            return
+        runs = [PostedShoppingRun(self, self.shopping_script, hwnd, self.key_delay_ms) for hwnd in hwnds]
+        for run in runs:
+            self._note_shopping_progress(run.hwnd, "starting")
+        self.update_status(f"Background shopping started in {len(runs)} window(s); cursor and focus stay free. "
+                           "Stop it with the shopping button.")
+        self.shopping_task = self.automation.submit(self._shop_all_clients(runs))
+        self.shopping_task.add_done_callback(lambda task: self._call_in_gui(self._on_shopping_done, task))
 
-    def _interact_with_utility_box(self, box_number):
-        """Temporarily hides the entire overlay, clicks a utility box position, and shows overlay again."""
-        if not self.shopping_overlay or not self.shopping_overlay.utility_squares:
-            self.update_status(f"Error: Utility boxes not available to interact with box #{box_number}.")
+    async def _shop_all_clients(self, runs):
+        """Runs every client's script concurrently; a client that fails stops alone and is reported."""
+        start = time.perf_counter()
+        results = await asyncio.gather(*(run.run() for run in runs), return_exceptions=True)
+        failed = 0
+        for run, result in zip(runs, results):
+            if isinstance(result, Exception):
+                failed += 1
+                self._note_shopping_progress(run.hwnd, "failed")
+                self.update_status(f"Window {run.hwnd}: background shopping failed: {result}")
+        elapsed = time.perf_counter() - start
+        self.metrics.record('shopping.background_run', elapsed)
+        self.update_status(f"Background shopping finished in {len(runs) - failed}/{len(runs)} window(s) in {elapsed:.1f}s.")
+
+    def _toggle_shopping_target(self):
+        """Switches auto-shopping between the main window (real cursor) and all clients (background, posted input)."""
+        if self.shopping_mode_state == "AUTO-RUN":
+            self.update_status("Stop auto-shopping before changing its target.")
             return
+        self.shopping_target = 'all' if self.shopping_target == 'main' else 'main'
+        if not self.headless:
+            self.shopping_target_button.config(text="Target: All Clients" if self.shopping_target == 'all' else "Target: Main Window")
+        self.update_status(f"Auto-shopping target: {'all clients, in the background' if self.shopping_target == 'all' else 'main window'}.")
 
-        if 1 <= box_number <= len(self.shopping_overlay.utility_squares):
-            utility_square = self.shopping_overlay.utility_squares[box_number - 1]
-            x = utility_square.winfo_x() + utility_square.winfo_width() // 2 # Center of the box
-            y = utility_square.winfo_y() + utility_square.winfo_height() // 2 # Center of the box
+    def _note_shopping_progress(self, hwnd, text):
+        """Records a run's progress (from the automation loop) and has the GUI show it."""
+        self.shopping_progress[hwnd] = text
+        self._call_in_gui(self._show_shopping_progress)
 
-            original_pos = win32api.GetCursorPos()
+    def _show_shopping_progress(self):
+        if self.headless:
+            return
+        lines = [f"{'Main' if hwnd is None else hwnd}: {text}" for hwnd, text in list(self.shopping_progress.items())]
+        self.shopping_progress_label.config(text="\n".join(lines))
 
-            if self.dd2_windows and len(self.dd2_windows) > self.main_window_index:
-                self._activate_window(self.dd2_windows[self.main_window_index])
-            
-            self.update_status(f"Temporarily hiding overlay to click utility box #{box_number}.")
-            self.shopping_overlay.withdraw()
-            time.sleep(0.05)
+    def _set_shopping_state(self, state, button_text):
+        self.shopping_mode_state = state
+        if not self.headless:
+            self.shopping_toggle_button.config(text=button_text)
+            self.shopping_status_label.config(text=f"Status: {state}")
+        if state == "OFF" and self.profile_reload_pending:
+            self.profile_reload_pending = False
+            self.update_status(f"Applying the profiles reloaded during shopping; active '{self.profiles.active}'.")
+            self._reapply_profile()
 
-            self.mouse_controller.position = (x, y)
-            time.sleep(0.1)
-            self.mouse_controller.click(Button.left, 1)
-            time.sleep(0.5)
+    def _handle_esc_press(self):
+        """Handler for Esc key press to stop auto-shopping."""
+        if self.shopping_mode_state == "AUTO-RUN":
+            self.update_status("ESC pressed. Stopping auto-shopping.")
+            self._toggle_shopping_mode()
+
+    def toggle_macro_recording(self):
+        """Starts recording the main window's input, or stops and saves the recording."""
+        if self.macro_recorder.recording:
+            macro = self.macro_recorder.stop()
+            if not len(macro):
+                self.update_status("Macro recording stopped: nothing recorded, keeping the previous macro.")
+            else:
+                self.macro = macro
+                macro_full_path = os.path.join(self.application_path, self.macro_file)
+                try:
+                    macro.save(macro_full_path)
+                    self.update_status(f"Recorded macro: {len(macro)} events, {macro.duration:.1f}s. Saved to {macro_full_path}.")
+                except IOError as e:
+                    self.update_status(f"Recorded macro: {len(macro)} events, but saving to {macro_full_path} failed: {e}")
+        else:
+            hwnds = self.dd2_windows
+            if len(hwnds) <= self.main_window_index:
+                self.update_status("No main DD2 window to record.")
+                return
+            self.macro_player.stop()
+            self.macro_recorder.start(hwnds[self.main_window_index])
+            self.update_status("Recording macro from the main window. F11 to stop.")
+        self._show_macro_state()
 
-            self.shopping_overlay.deiconify()
-            self.update_status(f"Restored overlay after clicking utility box #{box_number}.")
-            time.sleep(0.05)
+    def replay_macro(self, scope='others'):
+        """Replays the macro into the secondary windows ('others') or every window ('all'); stops a running replay."""
+        if self.macro_player.running:
+            self.macro_player.stop()
+            self.update_status("Macro replay stopped.")
+            return
+        if self.macro_recorder.recording:
+            self.update_status("Stop recording (F11) before replaying.")
+            return
+        if not self.macro:
+            self.update_status("No macro recorded yet (F11 to record).")
+            return
+        hwnds = self.dd2_windows
+        if scope == 'others' and len(hwnds) > self.main_window_index:
+            hwnds = [hwnd for hwnd in hwnds if hwnd != hwnds[self.main_window_index]]
+        if not hwnds:
+            self.update_status("No DD2 windows to replay the macro into.")
+            return
+        self.macro_player.play(self.macro, hwnds, self.macro_speed,
+                               on_done=lambda completed, failed: self._call_in_gui(self._on_macro_done, completed, failed))
+        self.update_status(f"Replaying macro into {len(hwnds)} window(s) at {self.macro_speed:g}x.")
+        self._show_macro_state()
 
-            win32api.SetCursorPos(original_pos)
+    def _on_macro_done(self, completed, failed):
+        lateness = self.metrics.histogram('macro.lateness')
+        if completed:
+            self.update_status(f"Macro replay finished (event lateness p99 {lateness.percentile(99) * 1000:.2f}ms).")
+        for hwnd in failed:
+            self.update_status(f"Error replaying macro into window {hwnd}; skipped it for the rest of the replay.")
+        self._show_macro_state()
 
+    def _show_macro_state(self):
+        if self.headless:
+            return
+        if self.macro_recorder.recording:
+            text = "Macro: RECORDING"
+        elif self.macro_player.running:
+            text = "Macro: REPLAYING"
+        elif self.macro:
+            text = f"Macro: {len(self.macro)} events, {self.macro.duration:.1f}s"
         else:
-            self.update_status(f"Error: Utility box #{box_number} is out of range.")
-            
+            text = "Macro: none"
+        self.macro_status_label.config(text=text)
+
     def _toggle_ahk_keybinds(self):
         """Toggles the state of all AHK keybinds."""
         self.ahk_keybinds_enabled = not self.ahk_keybinds_enabled
         if self.ahk_keybinds_enabled:
             self._enable_ahk_keybinds()
-            self.ahk_keybinds_status_label.config(text="AHK Keybinds: ENABLED")
-            self.ahk_keybinds_toggle_button.config(style='On.TButton') # Apply 'On' style
             self.update_status("AHK Keybinds ENABLED.")
         else:
             self._disable_ahk_keybinds()
-            self.ahk_keybinds_status_label.config(text="AHK Keybinds: DISABLED")
-            self.ahk_keybinds_toggle_button.config(style='TButton') # Revert to default style
             self.update_status("AHK Keybinds DISABLED.")
+        if not self.headless:
+            self.ahk_keybinds_status_label.config(text=f"AHK Keybinds: {'ENABLED' if self.ahk_keybinds_enabled else 'DISABLED'}")
+            self.ahk_keybinds_toggle_button.config(style='On.TButton' if self.ahk_keybinds_enabled else 'TButton')
+
+    # Hotkey action -> (method, where it runs): 'dispatch' queues it on the InputDispatcher, 'gui' on the Tk thread.
+    # send_all / send_inactive take key names, resolved to vk codes when the bindings are compiled.
+    HOTKEY_ACTIONS = {
+        'rotate': ('rotate_main_window', 'dispatch'),
+        'send_all': ('_send_vk_to_all', 'dispatch'),
+        'send_inactive': ('_send_vk_to_inactive', 'dispatch'),
+        'toggle_g_presser': ('_toggle_g_presser_gui', 'gui'),
+        'toggle_inactive_sender': ('_toggle_inactive_sender_gui', 'gui'),
+        'record_macro': ('toggle_macro_recording', 'gui'),
+        'replay_macro': ('replay_macro', 'gui'),
+        'switch_profile': ('switch_profile', 'gui'),
+        'next_profile': ('next_profile', 'gui'),
+        'calibrate': ('calibrate_shop_boxes', 'gui'),
+        'toggle_mirror': ('toggle_click_mirror', 'gui'),
+        'quit': ('_on_closing', 'gui'),
+    }
+
+    def _resolve_hotkey_action(self, action, args, policies=HOTKEY_POLICIES):
+        """Prepares one binding for HotkeyTable.compile: (callback, args, ignore_repeat) that only enqueue the work."""
+        if action not in self.HOTKEY_ACTIONS:
+            raise ValueError(f"unknown hotkey action '{action}', expected one of {', '.join(self.HOTKEY_ACTIONS)}")
+        method_name, runs_on = self.HOTKEY_ACTIONS[action]
+        if action in ('send_all', 'send_inactive'):
+            codes = [key_code(name) if isinstance(name, str) else None for name in args]
+            if not args or None in codes:
+                raise ValueError(f"'{action}' needs known key names, got {list(args)}")
+            args = (tuple(code[0] for code in codes), ', '.join(repr(name) for name in args))
+        elif action == 'rotate' and args not in (('up',), ('down',)):
+            raise ValueError(f"'rotate' takes 'up' or 'down', got {list(args)}")
+        elif action == 'replay_macro' and args not in ((), ('others',), ('all',)):
+            raise ValueError(f"'replay_macro' takes 'others' or 'all', got {list(args)}")
+        elif action == 'switch_profile' and (len(args) != 1 or not isinstance(args[0], str)):
+            raise ValueError(f"'switch_profile' takes a profile name, got {list(args)}")
+        policy = policies[action]
+        ignore_repeat = policy['repeat'] == 'ignore'
+        if action == 'rotate' and policy['coalesce']: # Steps add up on the hook thread; one queued rotation applies them all
+            return self._queue_rotation, args, ignore_repeat
+        func = getattr(self, method_name)
+        if runs_on == 'dispatch':
+            if policy['coalesce'] or policy['max_rate']:
+                submit = functools.partial(self.dispatcher.submit_coalesced, coalesce=policy['coalesce'],
+                                           min_interval=1.0 / policy['max_rate'] if policy['max_rate'] else 0)
+                return submit, ((action, *args), func, *args), ignore_repeat
+            return self.dispatcher.submit, (func, *args), ignore_repeat
+        return self._call_in_gui, (func, *args), ignore_repeat
+
+    def _reload_hotkeys(self, force=False):
+        """
+        Compiles the active profile's hotkeys, else the hotkey config file (or the defaults), if the file
+        changed or `force` is set; keeps the current table on errors.
+        """
+        config_full_path = os.path.join(self.application_path, self.hotkey_config_file)
+        try:
+            stat = os.stat(config_full_path)
+            stamp = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            stamp = None
+        if not force and stamp == self._hotkey_config_stamp:
+            return
+        self._hotkey_config_stamp = stamp
+        bindings, policies = DEFAULT_HOTKEYS, HOTKEY_POLICIES
+        profile_hotkeys = self.profiles.get()['hotkeys']
+        # Named before anything can fail, so an error points at what to fix
+        if profile_hotkeys:
+            source = f"profile '{self.profiles.active}'"
+        else:
+            source = config_full_path if stamp is not None else "defaults"
+        try:
+            if profile_hotkeys:
+                bindings = profile_hotkeys['bindings']
+                policies = merge_hotkey_policies(profile_hotkeys['policies'])
+            elif stamp is not None:
+                with open(config_full_path, 'r') as f:
+                    config = json.load(f)
+                bindings = config['bindings']
+                policies = merge_hotkey_policies(config.get('policies', {}))
+            start = time.perf_counter()
+            table = HotkeyTable.compile(bindings, lambda action, args: self._resolve_hotkey_action(action, args, policies))
+            compile_ms = (time.perf_counter() - start) * 1000
+        except (json.JSONDecodeError, IOError, KeyError, TypeError, ValueError) as e:
+            if self.hotkey_table:
+                self.update_status(f"Error in hotkeys from {source}: {e}. Keeping the current hotkeys.")
+                return
+            self.update_status(f"Error in hotkeys from {source}: {e}. Using the default hotkeys.")
+            table, source, compile_ms = HotkeyTable.compile(DEFAULT_HOTKEYS, self._resolve_hotkey_action), "defaults", 0.0
+        if self.hotkey_table: # Keys held across the swap stay held
+            table.modifiers, table.held = self.hotkey_table.modifiers, self.hotkey_table.held
+        self.hotkey_table = table # Swapped in one assignment; the hook reads it per event
+        self.update_status(f"Loaded {len(table)} hotkeys from {source} (compiled in {compile_ms:.2f}ms).")
+
+    def _check_hotkey_config(self):
+        if self.closed:
+            return
+        self._reload_hotkeys()
+        self.after(self.hotkey_reload_ms, self._check_hotkey_config)
+
+    def _on_hotkey_event(self, scan_code, down):
+        """Keyboard hook callback (hook thread): one table lookup, and bound work is only enqueued."""
+        self.hotkey_table.on_key(scan_code, down)
 
     def _enable_ahk_keybinds(self):
-        """Registers all AHK hotkeys to be active."""
-        if not self.ahk_hook_ids: # Only register if not already registered
-            self.ahk_hook_ids['up'] = keyboard.add_hotkey('up', lambda: self.rotate_main_window('up'))
-            self.ahk_hook_ids['down'] = keyboard.add_hotkey('down', lambda: self.rotate_main_window('down'))
-            self.ahk_hook_ids['f7'] = keyboard.add_hotkey('f7', self._toggle_g_presser_gui)
-            self.ahk_hook_ids['f10'] = keyboard.add_hotkey('f10', self._toggle_inactive_sender_gui)
-            self.ahk_hook_ids['p'] = keyboard.add_hotkey('p', lambda: self._send_key_to_all_dd2_windows('esc'))
-            self.ahk_hook_ids['n'] = keyboard.add_hotkey('n', lambda: self._send_key_to_all_dd2_windows('m'))
-            self.ahk_hook_ids['y'] = keyboard.add_hotkey('y', lambda: self._send_key_to_all_dd2_windows('y'))
-            self.ahk_hook_ids['g'] = keyboard.add_hotkey('g', lambda: self._send_key_to_all_dd2_windows('g'))
-            self.ahk_hook_ids['page up'] = keyboard.add_hotkey('page up', lambda: self._send_key_to_all_dd2_windows('pgup'))
-            self.ahk_hook_ids['page down'] = keyboard.add_hotkey('page down', lambda: self._send_key_to_all_dd2_windows('pgdn'))
-            self.ahk_hook_ids['b'] = keyboard.add_hotkey('b', lambda: self._send_key_to_inactive_dd2_windows('m'))
-            self.ahk_hook_ids['f9'] = keyboard.add_hotkey('f9', self._on_closing)
+        """Installs the keyboard hook that drives the compiled hotkey table."""
+        if self.hotkey_hook is None: # Only hook once
+            self.hotkey_hook = self.backend.hook_keys(self._on_hotkey_event)
             self.update_status("All AHK hotkeys are ENABLED and registered.")
 
     def _disable_ahk_keybinds(self):
         """Disables all AHK hotkeys."""
-        for key, hook_id in list(self.ahk_hook_ids.items()):
-            keyboard.remove_hotkey(hook_id)
-            del self.ahk_hook_ids[key]
+        if self.hotkey_hook is not None:
+            self.backend.unhook_keys(self.hotkey_hook)
+            self.hotkey_hook = None
         self.update_status("All AHK hotkeys unhooked.")
 
+    def refresh_monitor_work_area(self):
+        """Gets the main window's monitor work area, excluding the taskbar, from the cached topology."""
+        monitors = self.monitors.monitors()
+        self.m_left, self.m_top, self.m_right, self.m_bottom = self.monitors.get(self.main_monitor).work_area
+        summary = ", ".join(f"{m.work_area[2] - m.work_area[0]}x{m.work_area[3] - m.work_area[1]} @{m.dpi_scale:.0%}"
+                            for m in monitors)
+        self.update_status(f"Monitors: {len(monitors)} ({summary}).")
 
+    def _on_display_changed(self):
+        """Topology change callback (event thread): re-read work areas and re-place the windows."""
+        self.update_status("Display configuration changed.")
+        self.dispatcher.submit(self._reapply_layout)
 
-    def refresh_monitor_work_area(self):
-        """Gets the primary monitor's work area, excluding the taskbar."""
-        monitor_info = win32api.GetMonitorInfo(win32api.MonitorFromPoint((0, 0)))
-        work_area = monitor_info['Work']
-        self.m_left, self.m_top, self.m_right, self.m_bottom = work_area
+    def _reapply_layout(self):
+        """Re-reads the work area (the display or the main monitor may have changed) and applies the layout."""
+        self.refresh_monitor_work_area()
+        self.apply_layout()
+
+    @property
+    def dd2_windows(self):
+        """Tuple of DD2 window handles (HWND) from the registry cache, in discovery order."""
+        return self.registry.hwnds()
 
     def find_dd2_windows(self):
         """
-        Finds all active window handles (HWND) for the target executable.
+        Forces a full rescan of processes and windows for the target executable.
+        Normal paths read the registry cache instead; this is for the Refresh button.
         """
-        new_window_list = []
-        pids = [p.info['pid'] for p in psutil.process_iter(['pid', 'name']) if p.info['name'] == self.target_exe]
+        return self.registry.reconcile()
 
-        def callback(hwnd, hwnds):
-            if not win32gui.IsWindowVisible(hwnd) or not win32gui.IsWindowEnabled(hwnd):
-                return True
-            _, found_pid = win32process.GetWindowThreadProcessId(hwnd)
-            if found_pid in pids:
-                hwnds.append(hwnd)
-            return True
+    def _on_dd2_windows_changed(self, hwnds):
+        """Registry change callback; runs on whichever thread saw the change."""
+        self.update_status(f"DD2 windows changed: now tracking {len(hwnds)}.")
+        self._call_in_gui(self._show_window_count)
 
-        win32gui.EnumWindows(callback, new_window_list)
-        self.dd2_windows = new_window_list
-        return len(self.dd2_windows)
+    def _queue_rotation(self, direction):
+        """Rotate hotkey (hook thread): adds a step, and queues one rotation that applies every step added until it runs."""
+        with self._rotation_lock:
+            self._pending_rotation += 1 if direction == 'up' else -1
+        self.dispatcher.submit_coalesced('rotate', self._apply_pending_rotation)
+
+    def _apply_pending_rotation(self):
+        with self._rotation_lock:
+            steps, self._pending_rotation = self._pending_rotation, 0
+        if steps:
+            self._rotate_main_window(steps)
 
     def rotate_main_window(self, direction='up'):
         """
         Rotates the main window selection.
         """
+        self._rotate_main_window(1 if direction == 'up' else -1)
+
+    def _rotate_main_window(self, steps):
+        """Moves the main window selection `steps` places (positive is 'up') and applies the layout once."""
         if not self.ahk_keybinds_enabled:
             self.update_status("AHK Keybinds are disabled. Cannot rotate main window.")
             return
-        if self.find_dd2_windows() < 1:
+        if len(self.dd2_windows) < 1:
             self.update_status("No DD2 windows found to rotate.")
             return
 
@@ -659,16 +4461,9 @@ class WindowManager(tk.Tk): # Inherit from tk.Tk
         else:
              start_index = self.main_window_index
 
-        if direction == 'up':
-            self.main_window_index = start_index + 1
-        else: # 'down'
-            self.main_window_index = start_index - 1
-
-        if self.main_window_index >= len(self.dd2_windows):
-            self.main_window_index = 0
-        if self.main_window_index < 0:
-            self.main_window_index = len(self.dd2_windows) - 1
-            
+        self.main_window_index = (start_index + steps) % len(self.dd2_windows)
+        if abs(steps) > 1:
+            self.update_status(f"Rotating main window by {steps} (burst of presses collapsed into one layout).")
         self.update_status(f"Rotating main window. New main index: {self.main_window_index}")
         self.apply_layout()
 
@@ -676,90 +4471,132 @@ class WindowManager(tk.Tk): # Inherit from tk.Tk
         """
         Applies the window layout based on the current main window.
         """
-        if not self.dd2_windows:
+        with self.metrics.probe('apply_layout'):
+            self._apply_layout()
+
+    def _apply_layout(self):
+        dd2_windows = self.dd2_windows
+        if not dd2_windows:
             self.update_status("Cannot apply layout, no windows found.")
             return
 
-        main_hwnd = self.dd2_windows[self.main_window_index]
+        if self.main_window_index >= len(dd2_windows): # Windows may have closed since the last rotation
+            self.main_window_index = 0
+        main_hwnd = dd2_windows[self.main_window_index]
         self.last_main_hwnd = main_hwnd
 
-        secondary_windows = [hwnd for hwnd in self.dd2_windows if hwnd != main_hwnd]
-        
-        # 1. Restore all windows first to ensure they can be moved
-        for hwnd in self.dd2_windows:
-            win32gui.ShowWindow(hwnd, win32con.SW_RESTORE)
-        time.sleep(0.05)
-
-        # 2. Position MAIN window
-        x_main, y_main = self.m_left, self.m_top
-        win32gui.SetWindowPos(main_hwnd, win32con.HWND_TOP, x_main, y_main, self.main_w, self.main_h, win32con.SWP_SHOWWINDOW)
-
-        # 3. Position SECONDARY windows
-        sec1_hwnd = secondary_windows[0] if len(secondary_windows) > 0 else None
-        sec2_hwnd = secondary_windows[1] if len(secondary_windows) > 1 else None
-        sec3_hwnd = secondary_windows[2] if len(secondary_windows) > 2 else None
-
-        # SIDE window (sec1)
-        if sec1_hwnd:
-            side_w = self.m_right - (x_main + self.main_w) - self.padding
-            side_h = self.main_h
-            x = x_main + self.main_w + self.padding
-            y = y_main
-            win32gui.SetWindowPos(sec1_hwnd, win32con.HWND_NOTOPMOST, x, y, side_w, side_h, win32con.SWP_SHOWWINDOW | win32con.SWP_NOACTIVATE)
-            
-        # BOTTOM windows (sec2 & sec3)
-        bottom_h = self.m_bottom - (y_main + self.main_h) - self.padding * 2
-        sec_w = (self.main_w - self.padding) // 2
-        
-        if sec2_hwnd:
-            x = x_main
-            y = y_main + self.main_h + self.padding
-            win32gui.SetWindowPos(sec2_hwnd, win32con.HWND_NOTOPMOST, x, y, sec_w, bottom_h, win32con.SWP_SHOWWINDOW | win32con.SWP_NOACTIVATE)
-
-        if sec3_hwnd:
-            x = x_main + sec_w + self.padding
-            y = y_main + self.main_h + self.padding
-            win32gui.SetWindowPos(sec3_hwnd, win32con.HWND_NOTOPMOST, x, y, sec_w, bottom_h, win32con.SWP_SHOWWINDOW | win32con.SWP_NOACTIVATE)
-            
+        # 1. Look up the target rects (memoized per configuration, so rotation is a table lookup)
+        secondary_area = None
+        if self.secondary_monitor != self.main_monitor and len(self.monitors) > 1:
+            secondary_area = self.monitors.get(self.secondary_monitor).work_area
+        rects = solve_layout(self.layout_mode, (self.m_left, self.m_top, self.m_right, self.m_bottom), len(dd2_windows),
+                             self.main_window_index, self.main_w, self.main_h, self.padding, self.layout_template,
+                             secondary_area)
+
+        # 2. MAIN window on top, SECONDARY windows behind it without stealing activation
+        targets = [] # (hwnd, insert_after, x, y, w, h, flags)
+        for hwnd, (x, y, w, h) in zip(dd2_windows, rects):
+            if hwnd == main_hwnd:
+                targets.append((hwnd, HWND_TOP, x, y, w, h, SWP_SHOWWINDOW))
+            else:
+                targets.append((hwnd, HWND_NOTOPMOST, x, y, w, h, SWP_SHOWWINDOW | SWP_NOACTIVATE))
+
+        # 3. Commit only the windows that are not already in place, as one batch
+        moved, skipped, commit_time = self._commit_layout(targets)
+        self._rebuild_box_table() # Box coordinates for every window at its new place
+
         # 4. Activate the main window
         self._activate_window(main_hwnd)
-        self.update_status("Layout applied.")
+        self.update_status(f"Layout applied: {moved} moved, {skipped} already in place, commit {commit_time * 1e3:.1f}ms.")
+
+    def _commit_layout(self, targets):
+        """
+        Diffs target rects against each window's current rect and restore state, then applies the
+        remaining moves in one deferred batch. Returns (moved, skipped, commit seconds).
+        """
+        start = time.perf_counter()
+        moves = []
+        deferred = False
+        for hwnd, insert_after, x, y, w, h, flags in targets:
+            if self.health.is_hung(hwnd): # Positioning it would block until it answers
+                self.health.stats['deferred_moves'] += 1
+                deferred = True
+                continue
+            if self.backend.needs_restore(hwnd):
+                self.backend.restore_window(hwnd) # Minimized/maximized windows ignore positioning
+            elif self.backend.get_window_rect(hwnd) == (x, y, x + w, y + h):
+                continue
+            moves.append((hwnd, insert_after, x, y, w, h, flags))
+        if moves:
+            self.backend.set_window_positions(moves)
+            for hwnd, _, x, y, w, h, _ in moves:
+                self.registry.update_rect(hwnd, (x, y, x + w, y + h))
+        self._layout_deferred = deferred
+        return len(moves), len(targets) - len(moves), time.perf_counter() - start
 
     def _activate_window(self, hwnd):
-        """Robustly activate a window with retries."""
+        """Brings a window to the foreground. Returns True once the foreground change is confirmed."""
+        with self.metrics.probe('activate_window'):
+            return self._activate_window_with_retries(hwnd)
+
+    def _activate_window_with_retries(self, hwnd):
+        backend, registry = self.backend, self.registry
+        if self.health.is_hung(hwnd): # It can't take focus; retrying would only burn the whole deadline
+            self.health.stats['skipped_activations'] += 1
+            self.update_status(f"Window {hwnd} is not responding; not activating it.")
+            return False
+        start = time.perf_counter()
+        deadline = start + self.activation_timeout_ms / 1000.0
+        attempts = 0
+        activated = False
         try:
-            current_foreground = win32gui.GetForegroundWindow()
+            current_foreground = backend.get_foreground_window()
             if current_foreground == hwnd:
-                return
+                return True
+            # Resync with the real foreground, so a missed notification can't confirm a failed request
+            registry.note_foreground(current_foreground)
 
-            # Store the current foreground window's thread ID
-            current_foreground_thread_id = windll.user32.GetWindowThreadProcessId(current_foreground, None)
-            target_thread_id = windll.user32.GetWindowThreadProcessId(hwnd, None)
-
-            # Attach thread input to steal focus if different threads
-            if current_foreground_thread_id != target_thread_id:
-                windll.user32.AttachThreadInput(current_foreground_thread_id, target_thread_id, True)
-                time.sleep(0.01) # Small delay for attachment to take effect
-
-            # Attempt to set foreground window multiple times
-            max_retries = 5
-            for i in range(max_retries):
-                win32gui.BringWindowToTop(hwnd)
-                win32gui.SetForegroundWindow(hwnd)
-                # Check if it's foreground
-                if win32gui.GetForegroundWindow() == hwnd:
-                    self.update_status(f"Window {hwnd} activated successfully after {i+1} attempts.")
-                    break
-                time.sleep(0.05) # Wait a bit before retrying
-            else:
-                self.update_status(f"Warning: Window {hwnd} might not be foreground after {max_retries} attempts.")
+            # Thread ids come from the registry cache; only a foreign foreground window needs a lookup
+            current_foreground_thread_id = registry.thread_id(current_foreground) if current_foreground else 0
+            target_thread_id = registry.thread_id(hwnd)
 
-            # Detach thread input
-            if current_foreground_thread_id != target_thread_id:
-                windll.user32.AttachThreadInput(current_foreground_thread_id, target_thread_id, False)
+            # Attach thread input to steal focus if different threads (takes effect before the call returns)
+            attached = current_foreground_thread_id and current_foreground_thread_id != target_thread_id
+            if attached:
+                backend.attach_thread_input(current_foreground_thread_id, target_thread_id, True)
+            try:
+                while not activated and time.perf_counter() < deadline:
+                    attempts += 1
+                    backend.bring_to_foreground(hwnd)
+                    # Woken by the foreground notification; repeat the request if it doesn't come in time
+                    retry_at = min(deadline, time.perf_counter() + self.activation_retry_ms / 1000.0)
+                    activated = registry.wait_for_foreground(hwnd, retry_at)
+                    if not activated: # No notification: ask the OS, in case it was missed or went stale
+                        current_foreground = backend.get_foreground_window()
+                        registry.note_foreground(current_foreground)
+                        activated = current_foreground == hwnd
+            finally:
+                if attached: # Never leave the two input queues joined, even if a request raised
+                    backend.attach_thread_input(current_foreground_thread_id, target_thread_id, False)
 
         except Exception as e:
             self.update_status(f"Error activating window {hwnd}: {e}")
+        self._record_activation(hwnd, activated, time.perf_counter() - start, attempts)
+        return activated
+
+    def _record_activation(self, hwnd, activated, elapsed, attempts):
+        client = self.registry.get(hwnd)
+        if activated:
+            self.metrics.record('activate_window.latency', elapsed)
+            self.metrics.count('activate_window.attempts', attempts)
+            if client:
+                client.activation.record(elapsed)
+            self.update_status(f"Window {hwnd} activated in {elapsed * 1000:.1f} ms ({attempts} attempts).")
+        else:
+            self.metrics.count('activate_window.attempts', 'failed')
+            if client:
+                client.activation_failures += 1
+            self.update_status(f"Warning: Window {hwnd} did not become foreground within {self.activation_timeout_ms} ms.")
 
     def toggle_select_mode(self):
         """Toggles mouse selection mode for setting the main window."""
@@ -768,7 +4605,7 @@ class WindowManager(tk.Tk): # Inherit from tk.Tk
             self.update_status("SELECT MODE ACTIVATED: Click on a DD2 window to make it main.")
             self.update_status("Press F8 again to cancel.")
             if self.mouse_listener is None or not self.mouse_listener.running:
-                self.mouse_listener = mouse.Listener(on_click=self._on_global_mouse_click)
+                self.mouse_listener = _load_pynput().Listener(on_click=self._on_global_mouse_click)
                 self.mouse_listener.start()
         else:
             self.update_status("SELECT MODE DEACTIVATED.")
@@ -790,8 +4627,8 @@ class WindowManager(tk.Tk): # Inherit from tk.Tk
             self.update_status(f"Window {clicked_hwnd} selected as new main.")
             
             # Deactivate select mode and apply layout
-            self.after(0, self.toggle_select_mode) # Use after() to call from GUI thread
-            self.after(0, self.apply_layout)     # Use after() to call from GUI thread
+            self._call_in_gui(self.toggle_select_mode) # Listener thread; hand off to the GUI thread
+            self.dispatcher.submit(self.apply_layout)
             
             return False # Stop the listener
         else:
@@ -806,7 +4643,6 @@ class WindowManager(tk.Tk): # Inherit from tk.Tk
             # Re-apply layout to ensure the 'main' window is visually correct
             self.apply_layout() 
         else:
-            self.dd2_windows = [] # Clear the list if no windows are found
             self.main_window_index = 0
             self.last_main_hwnd = 0
 
@@ -818,86 +4654,123 @@ class WindowManager(tk.Tk): # Inherit from tk.Tk
             all_box_positions = self.shopping_overlay.get_box_positions()
             self._save_box_positions(all_box_positions)
             self.shopping_overlay.destroy()
+        self.profiles.flush() # A debounced save still pending
         if self.mouse_listener and self.mouse_listener.running:
             self.mouse_listener.stop()
         if self.esc_hook_id: # Ensure esc hotkey is removed on exit
-            keyboard.remove_hotkey(self.esc_hook_id)
+            self.backend.remove_hotkey(self.esc_hook_id)
+            self.esc_hook_id = None
         if self.original_cursor_pos: # Restore mouse cursor if it was moved by auto-run
-            win32api.SetCursorPos(self.original_cursor_pos)
+            self.backend.set_cursor_pos(self.original_cursor_pos)
             self.original_cursor_pos = None
-        keyboard.unhook_all()
+        if self.macro_recorder.recording:
+            self.macro_recorder.stop()
+        self.macro_player.stop()
+        self.click_mirror.stop()
+        self.backend.remove_all_hotkeys()
+        self.automation.stop()
+        self.health.stop()
+        self.dispatcher.stop()
+        self.scheduler.stop()
+        self.registry.stop()
+        self.status_log.close()
+        self.closed = True
+        if self.headless:
+            return # run_headless returns; the caller owns the process
         self.destroy() # Destroy the Tkinter window
         sys.exit(0) # Ensure the entire script exits
 
-    def _send_key_to_all_dd2_windows(self, key_name):
-        """Sends a specified key to all detected DD2 windows."""
-        vk_code = self.key_map.get(key_name.lower())
-        if not vk_code:
-            self.update_status(f"Error: Unknown key '{key_name}' for sending.")
-            return
+    def run_headless(self, duration=None):
+        """Stand-in for mainloop() in headless mode: runs Tcl timers until _on_closing or `duration` seconds pass."""
+        deadline = None if duration is None else time.perf_counter() + duration
+        while not self.closed and (deadline is None or time.perf_counter() < deadline):
+            self.tk.dooneevent(0) # Blocks for at most one _pump_gui_calls period
 
-        self.find_dd2_windows() # Refresh window list
-        if not self.dd2_windows:
-            self.update_status("No DD2 windows found to send key to.")
-            return
+    def _resolve_vk_codes(self, key_names):
+        """Maps key names to vk codes; returns None (and logs) if any name is unknown. Hotkeys resolve theirs at compile time."""
+        vk_codes = []
+        for key_name in key_names:
+            code = key_code(key_name)
+            if not code:
+                self.update_status(f"Error: Unknown key '{key_name}' for sending.")
+                return None
+            vk_codes.append(code[0])
+        return vk_codes
+
+    def _broadcast_keys(self, hwnds, vk_codes):
+        """Sends keys to the given windows in parallel, skipping hung ones, and drops any that turned out to be dead."""
+        self.broadcaster.hold_ms = self.key_delay_ms
+        responsive = self.health.responsive(hwnds)
+        if len(responsive) < len(hwnds): # Their queues are backed up already; don't add to them
+            self.health.stats['skipped_sends'] += len(hwnds) - len(responsive)
+            hwnds = responsive
+        for hwnd in self.broadcaster.broadcast(hwnds, vk_codes, self.dispatcher.current_enqueued_at()):
+            self.update_status(f"Error sending key to window {hwnd}.")
+            if not self.backend.is_window(hwnd): # Closed between notifications; drop it from the cache
+                self.registry.discard(hwnd)
+
+    def _send_key_to_all_dd2_windows(self, *key_names):
+        """Sends one or more keys, in order, to all detected DD2 windows."""
+        vk_codes = self._resolve_vk_codes(key_names)
+        if vk_codes:
+            self._send_vk_to_all(vk_codes, ', '.join(repr(k) for k in key_names))
 
-        for hwnd in self.dd2_windows:
-            self._send_key_to_window(hwnd, vk_code, self.key_delay_ms)
-        self.update_status(f"Sent '{key_name}' to all DD2 windows.")
+    def _send_key_to_inactive_dd2_windows(self, *key_names):
+        """Sends one or more keys, in order, to all detected DD2 windows, excluding the foreground window."""
+        vk_codes = self._resolve_vk_codes(key_names)
+        if vk_codes:
+            self._send_vk_to_inactive(vk_codes, ', '.join(repr(k) for k in key_names))
 
-    def _send_key_to_inactive_dd2_windows(self, key_name):
-        """Sends a specified key to all detected DD2 windows, excluding the foreground window."""
-        vk_code = self.key_map.get(key_name.lower())
-        if not vk_code:
-            self.update_status(f"Error: Unknown key '{key_name}' for sending.")
+    def _send_vk_to_all(self, vk_codes, label):
+        """Broadcast with already resolved vk codes; `label` names the keys in the status line."""
+        dd2_windows = self.dd2_windows # Cached; no rescan per keypress
+        if not dd2_windows:
+            self.update_status("No DD2 windows found to send key to.")
             return
 
-        self.find_dd2_windows() # Refresh window list
-        if not self.dd2_windows:
+        self._broadcast_keys(dd2_windows, vk_codes)
+        self.update_status(f"Sent {label} to all DD2 windows.")
+
+    def _send_vk_to_inactive(self, vk_codes, label):
+        dd2_windows = self.dd2_windows # Cached; no rescan per keypress
+        if not dd2_windows:
             self.update_status("No DD2 windows found to send key to.")
             return
 
-        active_hwnd = win32gui.GetForegroundWindow()
-        for hwnd in self.dd2_windows:
-            if hwnd != active_hwnd:
-                self._send_key_to_window(hwnd, vk_code, self.key_delay_ms)
-        self.update_status(f"Sent '{key_name}' to inactive DD2 windows.")
+        active_hwnd = self.backend.get_foreground_window()
+        self._broadcast_keys([hwnd for hwnd in dd2_windows if hwnd != active_hwnd], vk_codes)
+        self.update_status(f"Sent {label} to inactive DD2 windows.")
 
-    def _g_presser_loop(self):
-        if self.g_presser_enabled:
-            self._send_key_to_all_dd2_windows(self.keyGSend)
-            self.g_presser_timer = self.after(self.intervalG, self._g_presser_loop)
+    def _g_presser_tick(self):
+        """One G-presser run; called by the scheduler thread."""
+        self._send_key_to_all_dd2_windows(self.keyGSend)
 
     def _toggle_g_presser(self):
         self.g_presser_enabled = not self.g_presser_enabled
         if self.g_presser_enabled:
+            self.scheduler.set_period('g_presser', self.intervalG, self.g_presser_phase_ms)
             self.update_status(f"G-Presser ON: Sending '{self.keyGSend}' every {self.intervalG}ms.")
-            self._g_presser_loop() # Start the loop
         else:
-            if self.g_presser_timer:
-                self.after_cancel(self.g_presser_timer)
-                self.g_presser_timer = None
             self.update_status("G-Presser OFF.")
+        self.scheduler.set_enabled('g_presser', self.g_presser_enabled, run_now=True) # First press right away, as before
 
-    def _inactive_sender_loop(self):
-        if self.inactive_sender_enabled:
-            self._send_key_to_inactive_dd2_windows(self.keyGSend)
-            self._send_key_to_inactive_dd2_windows('esc')
-            self.inactive_sender_timer = self.after(100, self._inactive_sender_loop) # 100ms as per AHK script
+    def _inactive_sender_tick(self):
+        """One inactive-sender run; called by the scheduler thread."""
+        self._send_key_to_inactive_dd2_windows(self.keyGSend, 'esc') # One hold interval per key, not per window
 
     def _toggle_inactive_sender(self):
         self.inactive_sender_enabled = not self.inactive_sender_enabled
         if self.inactive_sender_enabled:
-            self.update_status(f"Inactive Sender ON: Sending '{self.keyGSend}' and 'Esc' to inactive windows every 100ms.")
-            self._inactive_sender_loop() # Start the loop
+            self.scheduler.set_period('inactive_sender', self.inactive_sender_interval, self.inactive_sender_phase_ms)
+            self.update_status(f"Inactive Sender ON: Sending '{self.keyGSend}' and 'Esc' to inactive windows every {self.inactive_sender_interval}ms.")
         else:
-            if self.inactive_sender_timer:
-                self.after_cancel(self.inactive_sender_timer)
-                self.inactive_sender_timer = None
             self.update_status("Inactive Sender OFF.")
+        self.scheduler.set_enabled('inactive_sender', self.inactive_sender_enabled, run_now=True)
 
     def _toggle_g_presser_gui(self):
         self._toggle_g_presser()
+        if self.headless:
+            return
         if self.g_presser_enabled:
             self.g_presser_status_label.config(text="G-Presser (F7): ON")
             self.g_presser_toggle_button.config(style='On.TButton') # Apply 'On' style
@@ -907,6 +4780,8 @@ class WindowManager(tk.Tk): # Inherit from tk.Tk
 
     def _toggle_inactive_sender_gui(self):
         self._toggle_inactive_sender()
+        if self.headless:
+            return
         if self.inactive_sender_enabled:
             self.inactive_sender_status_label.config(text="Inactive Sender (F10): ON")
             self.inactive_sender_toggle_button.config(style='On.TButton') # Apply 'On' style
@@ -914,22 +4789,247 @@ class WindowManager(tk.Tk): # Inherit from tk.Tk
             self.inactive_sender_status_label.config(text="Inactive Sender (F10): OFF")
             self.inactive_sender_toggle_button.config(style='TButton') # Revert to default style
 
+    def toggle_click_mirror(self):
+        """Starts or stops mirroring the main window's clicks into the secondary windows."""
+        if self.click_mirror.running:
+            self.click_mirror.stop()
+            latency = self.metrics.histogram('mirror.latency')
+            self.update_status(f"Click mirror OFF ({self.click_mirror.stats['mirrored']} clicks mirrored, "
+                               f"latency p99 {latency.percentile(99) * 1000:.2f}ms).")
+        else:
+            self.click_mirror.start()
+            self.update_status("Click mirror ON: clicks in the main window are repeated in the other windows.")
+        if not self.headless:
+            running = self.click_mirror.running
+            self.click_mirror_status_label.config(text=f"Click Mirror: {'ON' if running else 'OFF'}")
+            self.click_mirror_toggle_button.config(style='On.TButton' if running else 'TButton')
+
     def _register_ahk_hotkeys(self):
         """Initializes and registers all AHK-style hotkeys."""
+        self._reload_hotkeys(force=True)
         self._enable_ahk_keybinds()
+        self.after(self.hotkey_reload_ms, self._check_hotkey_config)
         self.update_status("AHK hotkeys registered (via _enable_ahk_keybinds).")
 
-    def _send_key_to_window(self, hwnd, vk_code, key_delay=20):
-        """Sends a key press (down and up) to a specific window."""
-        try:
-            win32api.PostMessage(hwnd, win32con.WM_KEYDOWN, vk_code, 0)
-            time.sleep(key_delay / 1000.0) # Convert ms to seconds
-            win32api.PostMessage(hwnd, win32con.WM_KEYUP, vk_code, 0)
-        except pywintypes.error as e:
-            self.update_status(f"Error sending key to window {hwnd}: {e}")
+class Simulation:
+    """
+    Scripted environment for a headless WindowManager: DD2 clients that spawn, hang and die, a
+    synthetic hotkey stream and occasional shopping runs, all driven from a separate thread like
+    the real keyboard hook. Reports memory growth, timer drift and dispatch latency periodically.
+    """
+    # Relative weights of the synthetic hotkeys (F9 is left out: it would end the run)
+    HOTKEY_WEIGHTS = {'up': 2, 'down': 2, 'g': 3, 'p': 1, 'n': 1, 'y': 1, 'page up': 1, 'page down': 1, 'b': 2,
+                      'f7': 0.2, 'f10': 0.2}
+    CHURN_WEIGHTS = {'spawn': 3, 'kill': 3, 'hang': 2, 'crash': 1, 'shop': 1}
+
+    def __init__(self, app, backend, max_clients=8, hotkey_rate=5.0, churn_interval=20.0, report_interval=60.0,
+                 seed=None):
+        self.app = app
+        self.backend = backend
+        self.max_clients = max_clients
+        self.hotkey_rate = hotkey_rate # Synthetic presses per second (exponential inter-arrival)
+        self.churn_interval = churn_interval # Mean seconds between process/shopping events
+        self.report_interval = report_interval
+        self.rng = random.Random(seed)
+        self.counts = collections.Counter() # Hotkeys fired and churn actions taken
+        self.dispatch_total = LatencyHistogram()
+        self._hung = {} # pid -> monotonic time it recovers (or dies, if crashing)
+        self._crashing = set()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._started_at = None
+        self._baseline_memory = None
+        self._baseline_snapshot = None
+
+    def start(self):
+        tracemalloc.start()
+        self._started_at = time.monotonic()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="dd2-simulation")
+        self._thread.start()
+        self.app.after(int(self.report_interval * 1000), self._report_tick)
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(2.0)
+
+    def _run(self):
+        hotkeys, weights = list(self.HOTKEY_WEIGHTS), list(self.HOTKEY_WEIGHTS.values())
+        next_churn = time.monotonic() + self.rng.expovariate(1.0 / self.churn_interval)
+        while not self._stop_event.wait(self.rng.expovariate(self.hotkey_rate)):
+            hotkey = self.rng.choices(hotkeys, weights)[0]
+            if self.backend.fire_hotkey(hotkey):
+                self.counts[f"hotkey {hotkey}"] += 1
+            now = time.monotonic()
+            self._recover_hung(now)
+            if now >= next_churn:
+                self._churn(now)
+                next_churn = now + self.rng.expovariate(1.0 / self.churn_interval)
+
+    def _churn(self, now):
+        action = self.rng.choices(list(self.CHURN_WEIGHTS), list(self.CHURN_WEIGHTS.values()))[0]
+        pids = [pid for pid, name in self.backend.list_processes() if name == self.app.target_exe]
+        healthy = [pid for pid in pids if pid not in self._hung]
+        if action == 'spawn' and len(pids) < self.max_clients:
+            self.backend.spawn_process()
+        elif action == 'kill' and len(healthy) > 1:
+            self.backend.kill_process(self.rng.choice(healthy))
+        elif action in ('hang', 'crash') and len(healthy) > 1:
+            pid = self.rng.choice(healthy)
+            self.backend.set_hung(pid)
+            self._hung[pid] = now + self.rng.uniform(2.0, 30.0)
+            if action == 'crash': # Hangs first, then dies instead of recovering
+                self._crashing.add(pid)
+        elif action == 'shop':
+            if self.app.shopping_mode_state == "AUTO-RUN":
+                if self.app.shopping_target == 'all': # Background runs have no ESC hook
+                    self.app._call_in_gui(self.app._toggle_shopping_mode)
+                else:
+                    self.backend.fire_hotkey('esc')
+            elif self.app.shopping_mode_state == "OFF":
+                self.app.shopping_target = self.rng.choice(('main', 'all'))
+                self.app._call_in_gui(self.app._toggle_shopping_mode) # OFF -> SETUP
+                self.app._call_in_gui(self.app._toggle_shopping_mode) # SETUP -> AUTO-RUN
+            else:
+                return
+        else:
+            return
+        self.counts[action] += 1
+
+    def _recover_hung(self, now):
+        for pid, until in list(self._hung.items()):
+            if now >= until:
+                del self._hung[pid]
+                if pid in self._crashing:
+                    self._crashing.discard(pid)
+                    self.backend.kill_process(pid)
+                else:
+                    self.backend.set_hung(pid, False)
+
+    def _report_tick(self):
+        if self.app.closed:
+            return
+        print(self.report())
+        self.app.after(int(self.report_interval * 1000), self._report_tick)
+
+    def report(self, final=False):
+        """One report line per subsystem. Runs on the Tk thread (it reads Tcl's pending timers)."""
+        app = self.app
+        elapsed = time.monotonic() - self._started_at
+        current, peak = tracemalloc.get_traced_memory()
+        if self._baseline_memory is None: # First report is the baseline, after caches have warmed up
+            self._baseline_memory = current
+            self._baseline_snapshot = tracemalloc.take_snapshot()
+        growth = current - self._baseline_memory
+        self.dispatch_total.merge(app.dispatcher.dispatch_latency)
+        interval = app.dispatcher.dispatch_latency.summary()
+        app.dispatcher.dispatch_latency.reset()
+        total = self.dispatch_total.summary()
+
+        health = app.health.summary()
+        lines = [f"[sim {elapsed / 60:7.1f} min] clients {len(app.registry)} (hung {len(self._hung)}, "
+                 f"monitor sees {health['hung']} hung {health['slow']} slow), "
+                 f"shopping {app.shopping_mode_state}, actions {dict(self.counts)}"]
+        lines.append(f"  memory: {current / 1024:.0f} KiB traced (peak {peak / 1024:.0f} KiB), "
+                     f"growth {growth / 1024:+.0f} KiB since first report; pending timers {len(app.tk.call('after', 'info'))}, "
+                     f"hotkeys {len(app.hotkey_table)} bound + {len(self.backend.hotkeys)} extra, tracked windows {len(app.registry)}")
+        lines.append(f"  dispatch: interval p50 {interval['p50_ms']:.2f}ms p99 {interval['p99_ms']:.2f}ms, "
+                     f"overall p99 {total['p99_ms']:.2f}ms max {total['max_ms']:.2f}ms, "
+                     f"dropped {app.dispatcher.stats['dropped']} coalesced {app.dispatcher.stats['coalesced']} "
+                     f"rate-limited {app.dispatcher.stats['rate_limited']} errors {app.dispatcher.stats['errors']}")
+        activation = ", ".join(f"{client.hwnd}: {client.activation.count} ok p99 {client.activation.percentile(99) * 1e3:.2f}ms "
+                               f"{client.activation_failures} failed" for client in app.registry.clients())
+        lines.append(f"  activation: {activation or 'no clients'}")
+        for job in app.scheduler.jobs():
+            if job.runs > 1:
+                stats = job.summary()
+                drift_ppm = (stats['achieved_period_ms'] - stats['period_ms']) / stats['period_ms'] * 1e6
+                lines.append(f"  timer {job.name}: {stats['runs']} runs, period {stats['achieved_period_ms']:.3f}ms "
+                             f"(drift {drift_ppm:+.0f} ppm), lateness p99 {stats['jitter_p99_ms']:.2f}ms, "
+                             f"skipped {stats['skipped']}")
+        if final and self._baseline_snapshot:
+            lines.append("  largest allocation growth since first report:")
+            for stat in tracemalloc.take_snapshot().compare_to(self._baseline_snapshot, 'lineno')[:5]:
+                lines.append(f"    {stat}")
+        return "\n".join(lines)
+
+def run_simulation(duration, clients=4, hotkey_rate=5.0, report_interval=60.0, seed=None):
+    """Runs the full control logic headless against simulated clients for `duration` seconds (None = until Ctrl+C)."""
+    backend = SimulatedBackend()
+    for _ in range(clients):
+        backend.spawn_process()
+    app = WindowManager(backend, headless=True)
+    simulation = Simulation(app, backend, max_clients=max(clients, 8), hotkey_rate=hotkey_rate,
+                            report_interval=report_interval, seed=seed)
+    for hotkey in ('f7', 'f10'): # Start with both timers running
+        backend.fire_hotkey(hotkey)
+    simulation.start()
+    try:
+        app.run_headless(duration)
+    except KeyboardInterrupt:
+        pass
+    simulation.stop()
+    print(simulation.report(final=True))
+    if not app.closed:
+        app._on_closing()
+
+_IMPORT_FINISHED = time.perf_counter()
+
+def calibrate_image(image_path, calibration_path, shopping_boxes=8, utility_boxes=3):
+    """Runs the Calibrate matcher on a stored capture (.npy, as saved by Calibrate); needs neither Windows nor a game."""
+    if not _load_numpy():
+        print("numpy is not installed.")
+        return 1
+    calibrator = ShopCalibrator(calibration_path)
+    try:
+        if not calibrator.load():
+            print(f"No calibration templates at {calibration_path}.")
+            return 1
+        capture = numpy.load(image_path)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Error reading {image_path} or {calibration_path}: {e}")
+        return 1
+    start = time.perf_counter()
+    try:
+        found = calibrator.locate(capture, {'shopping_boxes': shopping_boxes, 'utility_boxes': utility_boxes})
+    except ValueError as e:
+        print(f"Calibration failed: {e}")
+        return 1
+    print(json.dumps({kind: [list(p) for p in positions] for kind, positions in found.items()}))
+    print(f"{capture.shape[1]}x{capture.shape[0]} in {(time.perf_counter() - start) * 1000:.1f}ms "
+          f"({'cached result confirmed' if calibrator.stats['cache_hits'] else 'searched'})")
+    return 0
 
 def main():
-    app = WindowManager()
+    parser = argparse.ArgumentParser(description="Zeb DD2 window manager")
+    parser.add_argument('--simulate', type=float, metavar='SECONDS',
+                        help="Run headless against simulated DD2 clients for SECONDS (0 = until Ctrl+C)")
+    parser.add_argument('--sim-clients', type=int, default=4, help="Simulated DD2 clients at start")
+    parser.add_argument('--sim-hotkey-rate', type=float, default=5.0, help="Synthetic hotkey presses per second")
+    parser.add_argument('--sim-report-interval', type=float, default=60.0, help="Seconds between simulation reports")
+    parser.add_argument('--sim-seed', type=int, help="Random seed, to replay a simulation")
+    parser.add_argument('--startup-times', action='store_true',
+                        help="Print a startup breakdown (import, widgets, platform import, init, discovery, first layout)")
+    parser.add_argument('--calibrate-image', metavar='CAPTURE_NPY',
+                        help="Locate the shop boxes in a stored capture with the saved templates, print them and exit")
+    parser.add_argument('--calibration-file', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'calibration.npz'),
+                        help="Templates for --calibrate-image")
+    parser.add_argument('--log-lines', type=int, default=2000, metavar='N',
+                        help="Lines kept in the status log area; older ones are trimmed")
+    parser.add_argument('--log-file', metavar='PATH',
+                        help="Also write the status log to this rotating file (relative to the application folder)")
+    parser.add_argument('--save-calibration-capture', action='store_true',
+                        help="Save each Calibrate capture as calibration_capture.npy, for --calibrate-image")
+    args = parser.parse_args()
+    if args.calibrate_image:
+        sys.exit(calibrate_image(args.calibrate_image, args.calibration_file))
+    if args.simulate is not None:
+        run_simulation(args.simulate or None, args.sim_clients, args.sim_hotkey_rate, args.sim_report_interval,
+                       args.sim_seed)
+        return
+    app = WindowManager(report_startup=args.startup_times, status_log_lines=args.log_lines, status_log_file=args.log_file)
+    app.save_calibration_capture = args.save_calibration_capture
     app.mainloop()
 
 if __name__ == "__main__":